@@ -10,7 +10,8 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from google_auth_oauthlib.flow import Flow
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from backend.database import get_db
 from shared.models import User
@@ -80,17 +81,17 @@ def verify_jwt_token(token: str) -> dict:
 # ---- User helpers ----
 
 
-def get_or_create_user(
-    db: Session, google_id: str, email: str, name: str, picture_url: str | None
+async def get_or_create_user(
+    db: AsyncSession, google_id: str, email: str, name: str, picture_url: str | None
 ) -> User:
     """Find an existing user by google_id or create a new one."""
-    user = db.query(User).filter(User.google_id == google_id).first()
+    user = (await db.execute(select(User).where(User.google_id == google_id))).scalar_one_or_none()
     if user:
         user.last_login = datetime.now(timezone.utc)
         user.name = name
         user.picture_url = picture_url
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
         return user
 
     user = User(
@@ -100,17 +101,17 @@ def get_or_create_user(
         picture_url=picture_url,
     )
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     return user
 
 
 # ---- FastAPI dependency ----
 
 
-def get_current_user(
+async def get_current_user(
     creds: HTTPAuthorizationCredentials | None = Depends(bearer_scheme),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ) -> User:
     """FastAPI dependency – extracts JWT from Authorization header and returns the User, or raises 401."""
     if creds is None:
@@ -125,7 +126,7 @@ def get_current_user(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired token"
         )
 
-    user = db.query(User).filter(User.id == int(payload["sub"])).first()
+    user = await db.get(User, int(payload["sub"]))
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found"
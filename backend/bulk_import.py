@@ -0,0 +1,132 @@
+"""Bulk import of many documents from a zip archive or a directory.
+
+Files are parsed in a process pool and stored BULK_IMPORT_BATCH_SIZE at a time, each batch in
+a single transaction (see document_processor.store_documents), instead of one commit per file.
+Used by the `/upload/archive` endpoint (through backend.ingestion) and scripts/bulk_import.py.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import zipfile
+from collections.abc import Iterator
+from concurrent.futures import Executor
+from concurrent.futures.process import BrokenProcessPool
+
+from backend.database import SessionLocal
+from backend.document_processor import parse_text, store_documents
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = (".txt", ".md", ".pdf")
+BATCH_SIZE = int(os.getenv("BULK_IMPORT_BATCH_SIZE", "200"))
+
+
+def iter_directory(root: str) -> Iterator[tuple[str, str]]:
+    """Yield (filename, path) for every supported file under `root`, recursively."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        for name in sorted(filenames):
+            if not name.startswith(".") and name.lower().endswith(SUPPORTED_EXTENSIONS):
+                yield name, os.path.join(dirpath, name)
+
+
+def import_directory(root: str, executor: Executor, max_file_bytes: int | None = None) -> dict:
+    """Import every supported file under a directory. Returns a summary (see import_files)."""
+    return import_files(list(iter_directory(root)), executor, max_file_bytes)
+
+
+def import_archive(
+    path: str,
+    executor: Executor,
+    max_file_bytes: int | None = None,
+    max_files: int | None = None,
+    max_total_bytes: int | None = None,
+) -> dict:
+    """Import every supported file in a zip archive. Returns a summary (see import_files).
+
+    Raises ValueError, before anything is extracted, if the archive has more than `max_files`
+    members or the files to extract add up to more than `max_total_bytes` uncompressed.
+    """
+    skipped = []
+    with tempfile.TemporaryDirectory(prefix="bulk-import-") as tmp, zipfile.ZipFile(path) as archive:
+        members = [info for info in archive.infolist() if not info.is_dir()]
+        if max_files is not None and len(members) > max_files:
+            raise ValueError(f"Archive has {len(members)} files; the limit is {max_files}")
+
+        selected = []
+        for info in members:
+            name = os.path.basename(info.filename)
+            if not name or name.startswith(".") or info.filename.startswith("__MACOSX/"):
+                continue
+            if not name.lower().endswith(SUPPORTED_EXTENSIONS):
+                skipped.append({"filename": info.filename, "error": "Unsupported file type"})
+                continue
+            if max_file_bytes is not None and info.file_size > max_file_bytes:
+                skipped.append({"filename": info.filename, "error": "File too large"})
+                continue
+            selected.append((name, info))
+
+        # zipfile never yields more than a member's declared file_size, so the sum is a real bound
+        total = sum(info.file_size for _, info in selected)
+        if max_total_bytes is not None and total > max_total_bytes:
+            raise ValueError(f"Archive unpacks to {total} bytes; the limit is {max_total_bytes}")
+
+        files = []
+        for name, info in selected:
+            # Members are written under generated names; archive paths are never trusted
+            target = os.path.join(tmp, f"{len(files)}{os.path.splitext(name)[1].lower()}")
+            with archive.open(info) as src, open(target, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            files.append((name, target))
+
+        summary = import_files(files, executor)
+    summary["failed"] = skipped + summary["failed"]
+    return summary
+
+
+def import_files(files: list[tuple[str, str]], executor: Executor, max_file_bytes: int | None = None) -> dict:
+    """Parse (filename, path) pairs in `executor` and store them in batches.
+
+    Returns {"imported": count, "duplicates": count, "document_ids": [...],
+    "failed": [{"filename", "error"}, ...]}. A file that cannot be parsed or has no text is
+    reported and skipped; exact copies of stored documents are counted as duplicates.
+    """
+    document_ids: list[int] = []
+    duplicates = 0
+    failed: list[dict] = []
+    for start in range(0, len(files), BATCH_SIZE):
+        batch = files[start : start + BATCH_SIZE]
+        futures = []
+        for filename, path in batch:
+            if max_file_bytes is not None and os.path.getsize(path) > max_file_bytes:
+                failed.append({"filename": filename, "error": "File too large"})
+                continue
+            futures.append((filename, executor.submit(parse_text, path, filename)))
+
+        parsed = []
+        for filename, future in futures:
+            try:
+                text = future.result()
+            except BrokenProcessPool:
+                raise  # the pool is gone; let the caller replace it
+            except Exception as e:
+                failed.append({"filename": filename, "error": f"{type(e).__name__}: {e}"})
+                continue
+            if not text:
+                failed.append({"filename": filename, "error": "No text could be extracted from the file"})
+                continue
+            parsed.append({"title": filename, "content": text})
+
+        if parsed:
+            db = SessionLocal()
+            try:
+                stored = store_documents(db, parsed)
+                document_ids.extend(stored)
+                duplicates += len(parsed) - len(stored)
+            finally:
+                db.close()
+        logger.info("Bulk import: %d/%d files processed", min(start + BATCH_SIZE, len(files)), len(files))
+
+    return {"imported": len(document_ids), "duplicates": duplicates, "document_ids": document_ids, "failed": failed}
@@ -0,0 +1,235 @@
+"""Persisted chat conversations.
+
+A user's messages are kept per department and conversation: clients that run several
+conversations with a department pass a `conversation_id`; without one, messages go to the
+department's default conversation. The chat endpoints load the recent turns of the
+conversation from here, so a client only sends its new message. History is read in pages
+keyed on message id (newest page first, each page oldest first).
+
+Long conversations are summarized as they go: once the messages not yet covered by a
+conversation's summary exceed CHAT_SUMMARY_THRESHOLD_TOKENS, a background task (BACKGROUND
+priority) folds all but the last CHAT_HISTORY_TURNS of them into a stored rolling summary.
+The prompt then gets the summary plus every turn after it, so nothing falls between the two
+and its size stays bounded however long the conversation runs. With summaries disabled the
+prompt gets the last CHAT_HISTORY_TURNS messages.
+"""
+
+import asyncio
+import logging
+import os
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.database import AsyncSessionLocal
+from backend.llm import summarize_conversation
+from backend.llm_scheduler import Priority, SchedulerRejected
+from backend.retrieval import estimate_tokens
+from shared.models import ConversationMessage, ConversationSummary
+
+logger = logging.getLogger(__name__)
+
+CHAT_HISTORY_TURNS = int(os.getenv("CHAT_HISTORY_TURNS", "20"))  # messages kept out of the summary
+# Bounds the prompt history read should the summarizer fall behind
+MAX_UNSUMMARIZED_TURNS = 200
+HISTORY_PAGE_SIZE = 50
+MAX_HISTORY_PAGE_SIZE = 200
+
+SUMMARY_ENABLED = os.getenv("CHAT_SUMMARY_ENABLED", "true").lower() in ("1", "true", "yes")
+SUMMARY_THRESHOLD_TOKENS = int(os.getenv("CHAT_SUMMARY_THRESHOLD_TOKENS", "2000"))
+# Tokens of turns folded into the summary per LLM call; a longer message is cut to this
+SUMMARY_BATCH_TOKENS = 3000
+SUMMARY_RETRY_SECONDS = 30
+
+# (user_id, department, conversation_id)
+ConversationKey = tuple[int, str, str | None]
+
+
+def _in_conversation(model, user_id: int, department: str, conversation_id: str | None):
+    # `== None` renders IS NULL, which the conversation indexes also serve
+    return (
+        model.user_id == user_id,
+        model.department == department,
+        model.conversation_id == conversation_id,
+    )
+
+
+async def _latest_messages(
+    db: AsyncSession,
+    key: ConversationKey,
+    limit: int,
+    before_id: int | None = None,
+    after_id: int | None = None,
+) -> list[ConversationMessage]:
+    query = select(ConversationMessage).filter(*_in_conversation(ConversationMessage, *key))
+    if before_id is not None:
+        query = query.filter(ConversationMessage.id < before_id)
+    if after_id is not None:
+        query = query.filter(ConversationMessage.id > after_id)
+    messages = (await db.scalars(query.order_by(ConversationMessage.id.desc()).limit(limit))).all()
+    return list(reversed(messages))
+
+
+async def history_page(
+    db: AsyncSession,
+    user_id: int,
+    department: str,
+    conversation_id: str | None = None,
+    before_id: int | None = None,
+    limit: int = HISTORY_PAGE_SIZE,
+) -> list[ConversationMessage]:
+    """The `limit` messages before `before_id` (the latest ones without it), oldest first."""
+    return await _latest_messages(db, (user_id, department, conversation_id), limit, before_id=before_id)
+
+
+async def get_summary(
+    db: AsyncSession, user_id: int, department: str, conversation_id: str | None = None
+) -> ConversationSummary | None:
+    """The conversation's rolling summary, if it has one yet."""
+    query = (
+        select(ConversationSummary)
+        .filter(*_in_conversation(ConversationSummary, user_id, department, conversation_id))
+        .order_by(ConversationSummary.id.desc())
+        .limit(1)
+    )
+    return (await db.scalars(query)).first()
+
+
+async def recent_turns(
+    db: AsyncSession,
+    user_id: int,
+    department: str,
+    conversation_id: str | None = None,
+    limit: int | None = None,
+) -> list[dict]:
+    """Prompt turns ({"role", "content"}, oldest first) for the conversation.
+
+    The rolling summary (as a system message), then the messages it does not cover: all of
+    them (up to MAX_UNSUMMARIZED_TURNS) when summaries are enabled, otherwise the last
+    CHAT_HISTORY_TURNS; `limit` overrides either.
+    """
+    if limit is None:
+        limit = MAX_UNSUMMARIZED_TURNS if SUMMARY_ENABLED else CHAT_HISTORY_TURNS
+    summary = await get_summary(db, user_id, department, conversation_id)
+    after_id = summary.last_message_id if summary else None
+    messages = await _latest_messages(db, (user_id, department, conversation_id), limit, after_id=after_id)
+    turns = [{"role": m.role, "content": m.content} for m in messages]
+    if summary:
+        turns.insert(0, {"role": "system", "content": f"Summary of the earlier conversation:\n{summary.content}"})
+    return turns
+
+
+async def save_exchange(
+    db: AsyncSession, user_id: int, department: str, conversation_id: str | None, message: str, reply: str
+) -> None:
+    """Store a user message and the reply, and let the summarizer know the conversation grew."""
+    for role, content in (("user", message), ("assistant", reply)):
+        db.add(
+            ConversationMessage(
+                user_id=user_id, department=department, conversation_id=conversation_id, role=role, content=content
+            )
+        )
+    await db.commit()
+    notify_messages_added(user_id, department, conversation_id)
+
+
+async def clear(db: AsyncSession, user_id: int, department: str, conversation_id: str | None = None) -> None:
+    """Delete one conversation, or with no `conversation_id` all of the department's conversations."""
+    for model in (ConversationMessage, ConversationSummary):
+        query = delete(model).filter(model.user_id == user_id, model.department == department)
+        if conversation_id is not None:
+            query = query.filter(model.conversation_id == conversation_id)
+        await db.execute(query)
+    await db.commit()
+
+
+# --------------- Rolling summaries ---------------
+
+_pending: set[ConversationKey] = set()
+_wake = asyncio.Event()
+
+
+def notify_messages_added(user_id: int, department: str, conversation_id: str | None) -> None:
+    """Queue the conversation for a summary check and wake the summarizer."""
+    if SUMMARY_ENABLED:
+        _pending.add((user_id, department, conversation_id))
+        _wake.set()
+
+
+def _summary_batch(messages: list[ConversationMessage]) -> list[ConversationMessage]:
+    """The oldest of `messages` to fold in one call: at least one, at most SUMMARY_BATCH_TOKENS."""
+    batch, tokens = [], 0
+    for message in messages:
+        cost = min(estimate_tokens(message.content), SUMMARY_BATCH_TOKENS)
+        if batch and tokens + cost > SUMMARY_BATCH_TOKENS:
+            break
+        batch.append(message)
+        tokens += cost
+    return batch
+
+
+async def summarize(
+    user_id: int, department: str, conversation_id: str | None = None, priority: Priority = Priority.BACKGROUND
+) -> int:
+    """Fold the conversation's older turns into its summary if it is over the threshold.
+
+    Returns the number of messages folded in. Raises SchedulerRejected if the LLM queue is full,
+    and ValueError or RuntimeError if the summary could not be generated.
+    """
+    key = (user_id, department, conversation_id)
+    folded = 0
+    async with AsyncSessionLocal() as db:
+        while True:
+            summary = await get_summary(db, *key)
+            query = select(ConversationMessage).filter(*_in_conversation(ConversationMessage, *key))
+            if summary:
+                query = query.filter(ConversationMessage.id > summary.last_message_id)
+            messages = (await db.scalars(query.order_by(ConversationMessage.id))).all()
+            if (
+                len(messages) <= CHAT_HISTORY_TURNS
+                or sum(estimate_tokens(m.content) for m in messages) <= SUMMARY_THRESHOLD_TOKENS
+            ):
+                return folded
+
+            batch = _summary_batch(messages[:-CHAT_HISTORY_TURNS])
+            turns = [{"role": m.role, "content": m.content[: SUMMARY_BATCH_TOKENS * 4]} for m in batch]
+            content = await summarize_conversation(
+                department, summary.content if summary else None, turns, priority=priority
+            )
+
+            # The conversation may have been cleared while the LLM was busy
+            still_there = await db.scalar(select(ConversationMessage.id).filter(ConversationMessage.id == batch[-1].id))
+            if still_there is None:
+                return folded
+            if summary is None:
+                summary = ConversationSummary(user_id=user_id, department=department, conversation_id=conversation_id)
+                db.add(summary)
+            summary.content = content
+            summary.last_message_id = batch[-1].id
+            await db.commit()
+            folded += len(batch)
+            logger.info(
+                "Summarized %d messages of conversation user_id=%s department=%s conversation_id=%s",
+                len(batch), user_id, department, conversation_id,
+            )
+
+
+async def run() -> None:
+    """Summarize conversations as they grow, forever (start as a background task at startup)."""
+    while True:
+        _wake.clear()
+        while _pending:
+            key = _pending.pop()
+            try:
+                await summarize(*key)
+            except SchedulerRejected as e:
+                _pending.add(key)
+                logger.warning("Conversation summary postponed: %s", e)
+                await asyncio.sleep(SUMMARY_RETRY_SECONDS)
+            except (ValueError, RuntimeError) as e:
+                # Retried when the next exchange is saved
+                logger.warning("Conversation summary failed for %s: %s", key, e)
+            except Exception:
+                # e.g. a locked database; must not stop the summarizer
+                logger.exception("Conversation summary failed for %s", key)
+        await _wake.wait()
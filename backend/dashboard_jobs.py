@@ -0,0 +1,119 @@
+"""Background pre-generation of department dashboards.
+
+Runs inside the backend process as an asyncio task. Every department in DASHBOARD_PROMPTS
+whose snapshot is missing or stale (see backend.dashboards) is generated:
+
+- at startup and once a day at DASHBOARD_PREGENERATE_AT;
+- after documents are uploaded or deleted (debounced).
+
+Jobs run at BACKGROUND LLM priority and are retried with exponential backoff. With several
+workers each runs its own loop; the generation lease in backend.dashboards makes them share
+the work instead of repeating it.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+from backend.dashboards import get_snapshot
+from backend.llm_scheduler import Priority
+from shared.personas import DASHBOARD_PROMPTS
+
+logger = logging.getLogger(__name__)
+
+PREGENERATE_ENABLED = os.getenv("DASHBOARD_PREGENERATE_ENABLED", "true").lower() in ("1", "true", "yes")
+PREGENERATE_AT = os.getenv("DASHBOARD_PREGENERATE_AT", "06:00")  # local time, HH:MM
+DEBOUNCE_SECONDS = float(os.getenv("DASHBOARD_PREGENERATE_DEBOUNCE_SECONDS", "60"))
+MAX_RETRIES = int(os.getenv("DASHBOARD_JOB_MAX_RETRIES", "3"))
+BACKOFF_SECONDS = float(os.getenv("DASHBOARD_JOB_BACKOFF_SECONDS", "30"))
+
+
+def _next_daily_run(now: datetime) -> datetime:
+    hour, minute = (int(part) for part in PREGENERATE_AT.split(":"))
+    run_at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    return run_at if run_at > now else run_at + timedelta(days=1)
+
+
+class DashboardPregenerator:
+    """Keeps dashboard snapshots warm and reports per-department job status."""
+
+    def __init__(self, departments: list[str]):
+        self.departments = departments
+        self.jobs = {d: {"state": "idle", "attempts": 0, "last_started": None, "last_finished": None,
+                         "last_error": None, "reason": None} for d in departments}
+        self.next_daily_run: datetime | None = None
+        self._changed_at: float | None = None
+        self._wake = asyncio.Event()
+
+    def notify_documents_changed(self) -> None:
+        """Schedule a regeneration once uploads/deletions have been quiet for the debounce period."""
+        self._changed_at = time.monotonic()
+        self._wake.set()
+
+    async def run(self) -> None:
+        """Pre-generate forever (start as a background task at startup)."""
+        await self.run_all(reason="startup")
+        self.next_daily_run = _next_daily_run(datetime.now())
+        while True:
+            timeout = (self.next_daily_run - datetime.now()).total_seconds()
+            if self._changed_at is not None:
+                timeout = min(timeout, self._changed_at + DEBOUNCE_SECONDS - time.monotonic())
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=max(timeout, 0))
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+            if datetime.now() >= self.next_daily_run:
+                self.next_daily_run = _next_daily_run(datetime.now())
+                await self.run_all(reason="daily")
+            elif self._changed_at is not None and time.monotonic() >= self._changed_at + DEBOUNCE_SECONDS:
+                self._changed_at = None
+                await self.run_all(reason="documents changed")
+
+    async def run_all(self, reason: str) -> None:
+        """Bring every department's snapshot up to date, one after another."""
+        for department in self.departments:
+            self.jobs[department]["state"] = "queued"
+            self.jobs[department]["reason"] = reason
+        for department in self.departments:
+            await self._run_job(department)
+
+    async def _run_job(self, department: str) -> None:
+        job = self.jobs[department]
+        job["last_started"] = datetime.utcnow().isoformat()
+        for attempt in range(MAX_RETRIES + 1):
+            job["state"] = "running"
+            job["attempts"] = attempt + 1
+            try:
+                await get_snapshot(department, priority=Priority.BACKGROUND)
+            except Exception as e:
+                # Anything (e.g. a locked database) fails this job only, never the pre-generator
+                job["last_error"] = f"{type(e).__name__}: {e}"
+                if attempt == MAX_RETRIES:
+                    job["state"] = "failed"
+                    logger.exception("Dashboard pre-generation failed for %s", department)
+                    break
+                delay = BACKOFF_SECONDS * 2**attempt
+                job["state"] = "retrying"
+                logger.warning("Dashboard pre-generation for %s failed, retrying in %.0fs: %s", department, delay, e)
+                await asyncio.sleep(delay)
+            else:
+                job["state"] = "succeeded"
+                job["last_error"] = None
+                break
+        job["last_finished"] = datetime.utcnow().isoformat()
+
+    def status(self) -> dict:
+        return {
+            "enabled": PREGENERATE_ENABLED,
+            "daily_at": PREGENERATE_AT,
+            "next_daily_run": self.next_daily_run.isoformat() if self.next_daily_run else None,
+            "pending_document_change": self._changed_at is not None,
+            "jobs": self.jobs,
+        }
+
+
+pregenerator = DashboardPregenerator(list(DASHBOARD_PROMPTS))
@@ -0,0 +1,341 @@
+"""Dashboard snapshot lookup and generation with single-flight coalescing.
+
+A snapshot is served for as long as it matches the current knowledge-base version and the
+department's dashboard spec version (prompt + chart specs); the calendar day plays no part.
+At most one generation per (department, kb_version, spec_version) runs at a time:
+
+- within a process, concurrent callers await the same in-flight asyncio task;
+- across processes, a lease in `generation_leases` elects one worker to generate while
+  the others poll until the snapshot appears.
+
+A stale snapshot is updated incrementally when documents were only added since it was built:
+the LLM gets the previous dashboard plus just the new documents, in as many passes as it takes
+to fit them all into DASHBOARD_CONTEXT_TOKEN_BUDGET. Deletions, a changed spec, more than
+DASHBOARD_INCREMENTAL_MAX_DOCS new documents, or new documents that do not fit the prompt next
+to the previous dashboard trigger a full rebuild.
+
+Snapshots are written with an upsert against the unique (department, generated_date) index,
+so regenerations on the same day replace each other and older days are kept.
+
+Charts derived from extracted facts (backend.facts) are recomputed from the facts stored at
+the time a snapshot is served, so they catch up as background fact extraction does, without
+a dashboard request ever waiting for extraction or a regeneration.
+
+Database reads and writes run in worker threads with short-lived sessions, never on the event
+loop: a locked SQLite file would otherwise stall every request for the busy timeout.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from datetime import date, datetime
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from backend import leases
+from backend.database import SessionLocal
+from backend.document_processor import get_kb_version
+from backend.facts import derive_charts
+from backend.llm import (
+    DASHBOARD_CONTEXT_TOKEN_BUDGET,
+    generate_dashboard,
+    generate_dashboard_charts,
+    generate_dashboard_structured,
+)
+from backend.llm_scheduler import Priority, SchedulerRejected
+from shared.models import DashboardSnapshot, Document, DocumentChunk
+from shared.personas import get_chart_specs, get_dashboard_version
+
+logger = logging.getLogger(__name__)
+
+LEASE_TTL_SECONDS = float(os.getenv("DASHBOARD_LEASE_TTL_SECONDS", "120"))
+LEASE_POLL_SECONDS = float(os.getenv("DASHBOARD_LEASE_POLL_SECONDS", "1.0"))
+# Beyond this many new documents a full rebuild is cheaper and drifts less than an update
+INCREMENTAL_MAX_DOCS = int(os.getenv("DASHBOARD_INCREMENTAL_MAX_DOCS", "20"))
+# Markdown and charts from one JSON-schema-constrained call; separate calls are the fallback
+STRUCTURED_OUTPUT = os.getenv("DASHBOARD_STRUCTURED_OUTPUT", "true").lower() in ("1", "true", "yes")
+
+_inflight: dict[tuple[str, int, str], asyncio.Task] = {}
+
+
+async def _in_thread(fn, *args):
+    """Run fn(db, *args) in a worker thread with a session of its own."""
+
+    def run():
+        db = SessionLocal()
+        try:
+            return fn(db, *args)
+        finally:
+            db.close()
+
+    return await asyncio.to_thread(run)
+
+
+def find_snapshot(db: Session, department: str, day: date) -> DashboardSnapshot | None:
+    return (
+        db.query(DashboardSnapshot)
+        .filter(DashboardSnapshot.department == department, DashboardSnapshot.generated_date == day)
+        .first()
+    )
+
+
+def find_current_snapshot(db: Session, department: str, kb_version: int, spec_version: str) -> DashboardSnapshot | None:
+    """Newest snapshot built from this knowledge-base and spec version, from any day."""
+    return (
+        db.query(DashboardSnapshot)
+        .filter(
+            DashboardSnapshot.department == department,
+            DashboardSnapshot.kb_version == kb_version,
+            DashboardSnapshot.spec_version == spec_version,
+        )
+        .order_by(DashboardSnapshot.generated_at.desc())
+        .first()
+    )
+
+
+def save_snapshot(
+    db: Session,
+    department: str,
+    day: date,
+    content: str,
+    charts_json: str,
+    kb_version: int,
+    spec_version: str,
+    document_ids: list[int],
+) -> DashboardSnapshot:
+    """Insert or update the snapshot for (department, day)."""
+    covered = json.dumps(sorted(document_ids))
+    for attempt in range(2):
+        snapshot = find_snapshot(db, department, day)
+        if snapshot:
+            snapshot.content = content
+            snapshot.charts_json = charts_json
+            snapshot.generated_at = datetime.utcnow()
+            snapshot.kb_version = kb_version
+            snapshot.spec_version = spec_version
+            snapshot.document_ids = covered
+        else:
+            snapshot = DashboardSnapshot(
+                department=department, content=content, charts_json=charts_json, generated_date=day,
+                kb_version=kb_version, spec_version=spec_version, document_ids=covered,
+            )
+            db.add(snapshot)
+        try:
+            db.commit()
+            break
+        except IntegrityError:
+            # Another process inserted the row between our read and write; update it instead
+            db.rollback()
+            if attempt:
+                raise
+    db.refresh(snapshot)
+    return snapshot
+
+
+def _with_current_facts(db: Session, department: str, snapshot: dict) -> dict:
+    """A copy of the snapshot with its fact-derived charts recomputed from the facts stored now."""
+    specs = get_chart_specs(department) or []
+    derived = derive_charts(db, specs)
+    if not derived:
+        return snapshot
+    by_id = {chart["id"]: chart for chart in json.loads(snapshot["charts_json"] or "[]")}
+    by_id.update(derived)
+    return {**snapshot, "charts_json": json.dumps([by_id[s["id"]] for s in specs if s["id"] in by_id])}
+
+
+def _lookup(db: Session, department: str, spec_version: str) -> tuple[int, dict | None]:
+    """The knowledge-base version and the snapshot that is current for it, if any."""
+    kb_version = get_kb_version(db)
+    snapshot = find_current_snapshot(db, department, kb_version, spec_version)
+    return kb_version, _with_current_facts(db, department, snapshot.to_dict()) if snapshot else None
+
+
+async def get_snapshot(department: str, priority: Priority = Priority.DASHBOARD) -> dict:
+    """Return the current snapshot, generating it (once, however many callers) if stale or missing."""
+    spec_version = get_dashboard_version(department)
+    if spec_version is None:
+        raise ValueError(f"Unknown department: {department}")
+    kb_version, snapshot = await _in_thread(_lookup, department, spec_version)
+    if snapshot:
+        return snapshot
+    snapshot = await _single_flight(department, kb_version, spec_version, force=False, priority=priority)
+    return await _in_thread(_with_current_facts, department, snapshot)
+
+
+async def regenerate_snapshot(department: str, priority: Priority = Priority.DASHBOARD) -> dict:
+    """Regenerate the snapshot even if it is current; joins a generation that is already running."""
+    spec_version = get_dashboard_version(department)
+    if spec_version is None:
+        raise ValueError(f"Unknown department: {department}")
+    kb_version = await _in_thread(get_kb_version)
+    snapshot = await _single_flight(department, kb_version, spec_version, force=True, priority=priority)
+    return await _in_thread(_with_current_facts, department, snapshot)
+
+
+async def _single_flight(department: str, kb_version: int, spec_version: str, force: bool, priority: Priority) -> dict:
+    key = (department, kb_version, spec_version)
+    task = _inflight.get(key)
+    if task is None:
+        # A task of its own, so a caller disconnecting does not cancel it for everyone else
+        task = asyncio.create_task(_generate_with_lease(department, kb_version, spec_version, force, priority))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    else:
+        logger.info("Joining in-flight dashboard generation for %s (kb v%s)", department, kb_version)
+    return await asyncio.shield(task)
+
+
+async def _generate_with_lease(
+    department: str, kb_version: int, spec_version: str, force: bool, priority: Priority
+) -> dict:
+    lease_key = f"dashboard:{department}:{kb_version}:{spec_version}"
+    started = datetime.utcnow()
+    while True:
+        snapshot = await _in_thread(find_current_snapshot, department, kb_version, spec_version)
+        # A forced regeneration is satisfied only by a snapshot written after it began
+        if snapshot and (not force or snapshot.generated_at >= started):
+            return snapshot.to_dict()
+
+        async with leases.hold(lease_key, LEASE_TTL_SECONDS) as acquired:
+            if acquired:
+                snapshot = await _in_thread(find_current_snapshot, department, kb_version, spec_version)
+                if snapshot and (not force or snapshot.generated_at >= started):
+                    return snapshot.to_dict()
+
+                return (await _build_snapshot(department, kb_version, spec_version, priority)).to_dict()
+
+        # Another worker holds the lease; wait for it to finish (or for the lease to lapse)
+        while await _in_thread(leases.is_held, lease_key):
+            await asyncio.sleep(LEASE_POLL_SECONDS)
+
+
+def _latest_snapshot(db: Session, department: str, spec_version: str) -> DashboardSnapshot | None:
+    """Newest snapshot built from this spec version, whatever knowledge-base version it covers."""
+    return (
+        db.query(DashboardSnapshot)
+        .filter(
+            DashboardSnapshot.department == department,
+            DashboardSnapshot.spec_version == spec_version,
+            DashboardSnapshot.document_ids.isnot(None),
+        )
+        .order_by(DashboardSnapshot.generated_at.desc())
+        .first()
+    )
+
+
+def _coverage(db: Session, department: str, spec_version: str) -> tuple[set[int], DashboardSnapshot | None]:
+    """Ids of the documents a snapshot should cover now, and the latest snapshot to update."""
+    current_ids = {doc_id for (doc_id,) in db.query(Document.id).filter(Document.duplicate_of.is_(None))}
+    return current_ids, _latest_snapshot(db, department, spec_version)
+
+
+def _incremental_batches(db: Session, document_ids: list[int]) -> list[list[int]]:
+    """Split new documents into runs whose chunks fit DASHBOARD_CONTEXT_TOKEN_BUDGET together.
+
+    Documents keep the order the context is packed in. Raises ValueError if a document alone is
+    over the budget: part of it would be left out of every pass, so it needs a full rebuild.
+    """
+    rows = (
+        db.query(Document.id, func.coalesce(func.sum(DocumentChunk.token_count), 0))
+        .outerjoin(DocumentChunk, DocumentChunk.document_id == Document.id)
+        .filter(Document.id.in_(document_ids))
+        .group_by(Document.id, Document.upload_date)
+        .order_by(Document.upload_date, Document.id)
+    )
+    batches: list[list[int]] = []
+    used = 0
+    for doc_id, tokens in rows:
+        if tokens > DASHBOARD_CONTEXT_TOKEN_BUDGET:
+            raise ValueError(
+                f"document id={doc_id} ({tokens} tokens) does not fit DASHBOARD_CONTEXT_TOKEN_BUDGET"
+            )
+        if not batches or used + tokens > DASHBOARD_CONTEXT_TOKEN_BUDGET:
+            batches.append([])
+            used = 0
+        batches[-1].append(doc_id)
+        used += tokens
+    return batches
+
+
+async def _build_snapshot(
+    department: str, kb_version: int, spec_version: str, priority: Priority
+) -> DashboardSnapshot:
+    # Stored with the version read before generating, so a document added meanwhile leaves
+    # the snapshot stale rather than wrongly current
+    current_ids, previous = await _in_thread(_coverage, department, spec_version)
+    previous_ids = set(json.loads(previous.document_ids)) if previous else set()
+    new_ids = sorted(current_ids - previous_ids)
+
+    # The LLM helpers do their reads in threads; the session is only handed to them
+    db = SessionLocal()
+    try:
+        generated = None
+        if previous and previous_ids <= current_ids and 0 < len(new_ids) <= INCREMENTAL_MAX_DOCS:
+            try:
+                batches = await _in_thread(_incremental_batches, new_ids)
+                logger.info(
+                    "Updating dashboard for %s with %d new documents in %d passes (kb v%s)",
+                    department, len(new_ids), len(batches), kb_version,
+                )
+                generated = await _update(db, department, priority, previous, batches)
+            except ValueError as e:
+                logger.warning("Incremental update of the %s dashboard failed, rebuilding: %s", department, e)
+        if generated is None:
+            logger.info("Generating dashboard for %s from all documents (kb v%s)", department, kb_version)
+            generated = await _generate(db, department, priority, None, [])
+        content, charts_json = generated
+    finally:
+        db.close()
+    return await _in_thread(
+        save_snapshot, department, date.today(), content, charts_json, kb_version, spec_version, list(current_ids)
+    )
+
+
+async def _update(
+    db: Session, department: str, priority: Priority, previous: DashboardSnapshot, batches: list[list[int]]
+) -> tuple[str, str]:
+    """Fold each run of new documents into the dashboard in turn; every pass builds on the last."""
+    for batch in batches:
+        content, charts_json = await _generate(db, department, priority, previous, batch)
+        previous = DashboardSnapshot(content=content, charts_json=charts_json)  # not stored
+    return content, charts_json
+
+
+async def _generate(
+    db: Session, department: str, priority: Priority, previous: DashboardSnapshot | None, new_ids: list[int]
+) -> tuple[str, str]:
+    """Markdown and charts JSON, updated from `previous` with `new_ids` if given, else from scratch."""
+    # Chart data is only updated incrementally if there is some to update
+    charts_previous = previous if previous and json.loads(previous.charts_json or "[]") else None
+
+    # One structured call covers both parts only if both are incremental or both from scratch;
+    # previous Markdown without charts is updated on its own below, the charts built in full
+    if STRUCTURED_OUTPUT and (previous is None or charts_previous):
+        try:
+            if charts_previous:
+                return await generate_dashboard_structured(
+                    department, db, priority=priority, previous=previous.content,
+                    previous_charts=previous.charts_json, document_ids=new_ids,
+                )
+            return await generate_dashboard_structured(department, db, priority=priority)
+        except SchedulerRejected:
+            raise
+        except (ValueError, RuntimeError) as e:
+            logger.warning("Structured dashboard generation failed for %s, using separate calls: %s", department, e)
+
+    if previous:
+        content = await generate_dashboard(
+            department, db, priority=priority, previous=previous.content, document_ids=new_ids
+        )
+    else:
+        content = await generate_dashboard(department, db, priority=priority)
+    if charts_previous:
+        charts_json = await generate_dashboard_charts(
+            department, db, priority=priority, previous=charts_previous.charts_json, document_ids=new_ids
+        )
+    else:
+        charts_json = await generate_dashboard_charts(department, db, priority=priority)
+    return content, charts_json
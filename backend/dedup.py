@@ -0,0 +1,107 @@
+"""Duplicate detection for knowledge-base documents.
+
+Exact copies are found by a hash of the normalized text (case-folded, whitespace collapsed),
+stored in the indexed `documents.content_hash` column. Near-copies (e.g. the same notes with a
+line edited) are found by comparing MinHash signatures of word shingles. When a new document's
+estimated Jaccard similarity to a stored one reaches NEAR_DUPLICATE_THRESHOLD, the new one is
+kept (it is usually the corrected version): the older document, and any copies of it, get
+`duplicate_of` pointing at it and are left out of retrieval, dashboards and fact extraction.
+"""
+
+import hashlib
+import os
+import re
+import unicodedata
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from shared.models import Document
+
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.9"))  # above 1 disables
+SHINGLE_WORDS = 5
+NUM_PERMUTATIONS = 128
+MINHASH_BLOCK_SHINGLES = 4096
+
+_PRIME = np.uint64(4294967311)  # smallest prime above 2**32
+_rng = np.random.default_rng(20240101)  # fixed seed: signatures must be comparable across runs
+_A = _rng.integers(1, 2**32, size=NUM_PERMUTATIONS, dtype=np.uint64)
+_B = _rng.integers(0, 2**32, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+
+def _words(text: str) -> list[str]:
+    return re.findall(r"\w+", unicodedata.normalize("NFKC", text).casefold())
+
+
+def content_hash(text: str) -> str:
+    """SHA-256 of the normalized text; equal for copies that differ only in case or whitespace."""
+    return hashlib.sha256(" ".join(_words(text)).encode()).hexdigest()
+
+
+def _shingle_hash(words: list[str]) -> int:
+    return int.from_bytes(hashlib.blake2b(" ".join(words).encode(), digest_size=4).digest(), "little")
+
+
+def minhash(text: str) -> bytes | None:
+    """MinHash signature of the text's word shingles, or None if it has no words."""
+    words = _words(text)
+    if not words:
+        return None
+    # Hashed as they are built, so the shingle strings themselves are never all held at once
+    hashes = np.fromiter(
+        {_shingle_hash(words[i : i + SHINGLE_WORDS]) for i in range(max(1, len(words) - SHINGLE_WORDS + 1))},
+        dtype=np.uint64,
+    )
+    # Permute in blocks: a 50 MB upload has millions of shingles, too many for one shingles x 128 array
+    signature = np.full(NUM_PERMUTATIONS, np.iinfo(np.uint64).max, dtype=np.uint64)
+    for start in range(0, hashes.size, MINHASH_BLOCK_SHINGLES):
+        block = hashes[start : start + MINHASH_BLOCK_SHINGLES]
+        # a * x < 2**64 for 32-bit a and x; adding b may wrap, which only perturbs the permutation
+        np.minimum(signature, ((np.outer(block, _A) + _B) % _PRIME).min(axis=0), out=signature)
+    return signature.tobytes()
+
+
+def find_copy(db: Session, content: str) -> Document | None:
+    """The earliest stored document with the same normalized text, if any."""
+    return (
+        db.query(Document)
+        .filter(Document.content_hash == content_hash(content))
+        .order_by(Document.id)
+        .first()
+    )
+
+
+class SignatureIndex:
+    """MinHash signatures of the documents that are not themselves duplicates."""
+
+    def __init__(self, db: Session):
+        rows = (
+            db.query(Document.id, Document.minhash)
+            .filter(Document.duplicate_of.is_(None), Document.minhash.isnot(None))
+            .order_by(Document.id)
+            .all()
+        )
+        self.ids = [doc_id for doc_id, _ in rows]
+        self._signatures = [np.frombuffer(signature, dtype=np.uint64) for _, signature in rows]
+        self._matrix: np.ndarray | None = None
+
+    def add(self, doc_id: int, signature: bytes | None, replaces: int | None = None) -> None:
+        """Add a document, in place of `replaces` if it was that one's near-copy."""
+        if replaces is not None and replaces in self.ids:
+            i = self.ids.index(replaces)
+            del self.ids[i], self._signatures[i]
+            self._matrix = None
+        if signature is not None:
+            self.ids.append(doc_id)
+            self._signatures.append(np.frombuffer(signature, dtype=np.uint64))
+            self._matrix = None
+
+    def match(self, signature: bytes | None) -> int | None:
+        """Id of the most similar document if it counts as a near-duplicate, else None."""
+        if signature is None or not self.ids or NEAR_DUPLICATE_THRESHOLD > 1:
+            return None
+        if self._matrix is None:
+            self._matrix = np.vstack(self._signatures)
+        similarity = (self._matrix == np.frombuffer(signature, dtype=np.uint64)).mean(axis=1)
+        best = int(similarity.argmax())
+        return self.ids[best] if similarity[best] >= NEAR_DUPLICATE_THRESHOLD else None
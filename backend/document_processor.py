@@ -1,37 +1,101 @@
 """Document parsing and storage for uploaded files."""
 
+import asyncio
+import io
 import json
 import logging
 import os
+import re
+import threading
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import BinaryIO
 
 from PyPDF2 import PdfReader
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from shared.models import Document
+from backend import vector_index
+from backend.database import SessionLocal
+from backend.dedup import SignatureIndex, content_hash, find_copy, minhash
+from backend.retrieval import index_document
+from shared.models import Document, KnowledgeBaseVersion
 
 logger = logging.getLogger(__name__)
 
+TEXT_BLOCK_CHARS = 1024 * 1024
 
-def extract_text(filename: str, content_bytes: bytes) -> str:
-    """Extract plain text from a file based on its extension."""
+# (knowledge-base version, SignatureIndex as of it), reused while nothing else changes the KB
+_signature_cache: tuple[int, SignatureIndex] | None = None
+_signature_lock = threading.Lock()
+
+
+def iter_text(stream: BinaryIO, filename: str) -> Iterator[str]:
+    """Yield the text of an open file piece by piece: one page at a time for PDFs, about
+    TEXT_BLOCK_CHARS of whole lines at a time for text, so large files are never held in memory."""
     ext = os.path.splitext(filename)[1].lower()
 
     if ext in (".txt", ".md"):
-        return content_bytes.decode("utf-8", errors="replace")
+        block: list[str] = []
+        size = 0
+        for line in io.TextIOWrapper(stream, encoding="utf-8", errors="replace", newline=""):
+            block.append(line)
+            size += len(line)
+            if size >= TEXT_BLOCK_CHARS:
+                yield "".join(block)
+                block, size = [], 0
+        if block:
+            yield "".join(block)
+        return
 
     if ext == ".pdf":
-        return _extract_pdf_text(content_bytes)
+        # PdfReader seeks and reads the stream as it goes instead of loading it whole
+        for page in PdfReader(stream).pages:
+            yield (page.extract_text() or "") + "\n"
+        return
 
     raise ValueError(f"Unsupported file type: {ext}")
 
 
-def _extract_pdf_text(content_bytes: bytes) -> str:
-    """Extract text from PDF bytes using PyPDF2."""
-    import io
+def extract_text(filename: str, content_bytes: bytes) -> str:
+    """Extract plain text from a file based on its extension."""
+    return "".join(iter_text(io.BytesIO(content_bytes), filename))
+
+
+def parse_file(path: str, filename: str, out_path: str) -> int:
+    """Extract and normalize the text of an uploaded file on disk into out_path, page by page
+    (runs in a worker process). Returns the number of characters written."""
+    with open(path, "rb") as src:
+        return write_text(iter_text(src, filename), out_path)
+
+
+def write_text(pieces: Iterable[str], out_path: str) -> int:
+    """Normalize pieces of text (e.g. pages) and write them to out_path. Returns the characters written."""
+    written = 0
+    with open(out_path, "w", encoding="utf-8") as out:
+        for piece in pieces:
+            piece = normalize_text(piece)
+            if not piece:
+                continue
+            if written:
+                out.write("\n")
+            written += out.write(piece)
+    return written
+
 
-    reader = PdfReader(io.BytesIO(content_bytes))
-    pages = [page.extract_text() or "" for page in reader.pages]
-    return "\n".join(pages)
+def parse_text(path: str, filename: str) -> str:
+    """Extract and normalize the text of a file on disk (runs in a worker process)."""
+    with open(path, "rb") as src:
+        pieces = (normalize_text(piece) for piece in iter_text(src, filename))
+        return "\n".join(piece for piece in pieces if piece)
+
+
+def normalize_text(text: str) -> str:
+    """Normalize line endings, drop NUL characters and trailing spaces, collapse runs of blank lines."""
+    text = text.replace("\r\n", "\n").replace("\r", "\n").replace("\x00", "")
+    lines = [line.rstrip() for line in text.split("\n")]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip("\n")
 
 
 def store_document(
@@ -40,16 +104,230 @@ def store_document(
     content: str,
     tags: list[str] | None = None,
     metadata: dict | None = None,
+    embed: bool = True,
 ) -> Document:
-    """Store a parsed document in the database and return it."""
-    doc = Document(
-        title=title,
-        content=content,
-        tags=json.dumps(tags or []),
-        extra_metadata=json.dumps(metadata or {}),
-    )
-    db.add(doc)
-    db.commit()
+    """Store a parsed document in the database, chunk it for retrieval, and return it.
+
+    If a document with the same normalized text exists, nothing is stored and it is returned
+    instead. A near-copy of an existing document replaces it: the older one gets `duplicate_of`.
+    With `embed=False` the new chunks are left for the caller to embed (see store_document_async).
+    """
+    existing = find_copy(db, content)
+    if existing:
+        logger.info("Document %r is a copy of id=%s; not stored again", title, existing.id)
+        return existing
+
+    signature = minhash(content)
+    with _signatures(db) as scope:
+        original = scope.index.match(signature)
+        doc = Document(
+            title=title,
+            content=content,
+            tags=json.dumps(tags or []),
+            extra_metadata=json.dumps(metadata or {}),
+            content_hash=content_hash(content),
+            minhash=signature,
+        )
+        db.add(doc)
+        index_document(db, doc)
+        db.flush()
+        if original is not None:
+            _supersede(db, doc, original)
+        scope.index.add(doc.id, signature, replaces=original)
+        bump_kb_version(db)
+        scope.versions_added = 1
+        db.commit()
     db.refresh(doc)
-    logger.info("Stored document id=%s title=%s", doc.id, doc.title)
+    if original is not None:
+        logger.info("Stored document id=%s title=%s (replaces its near-copy id=%s)", doc.id, doc.title, original)
+    else:
+        logger.info("Stored document id=%s title=%s", doc.id, doc.title)
+
+    if embed:
+        _embed_new_chunks(db)
+    return doc
+
+
+async def store_document_async(
+    db: AsyncSession,
+    title: str,
+    content: str,
+    tags: list[str] | None = None,
+    metadata: dict | None = None,
+) -> Document:
+    """Async store_document for request handlers and async scripts.
+
+    The inserts run on the async session; embedding the new chunks is a blocking call to the
+    embedding model, so it runs in a thread with its own session.
+    """
+    doc = await db.run_sync(store_document, title, content, tags, metadata, embed=False)
+    await asyncio.to_thread(_embed_new_chunks)
     return doc
+
+
+def _embed_new_chunks(db: Session | None = None) -> None:
+    session = db or SessionLocal()
+    try:
+        vector_index.sync_embeddings(session)
+    except Exception as e:
+        # Keyword retrieval still works; the chunks are embedded on the next successful sync
+        logger.warning("Could not embed new chunks: %s", e)
+    finally:
+        if db is None:
+            session.close()
+
+
+def store_documents(db: Session, documents: list[dict]) -> list[int]:
+    """Store several parsed documents in one transaction (for bulk imports) and return their ids.
+
+    Each dict has `title` and `content`, and optionally `tags` and `metadata`. Exact copies of
+    stored documents (or of each other) are skipped; near-copies replace the older document as
+    in store_document, in the order given.
+    """
+    hashes = [content_hash(d["content"]) for d in documents]
+    seen = set()
+    for start in range(0, len(hashes), 500):
+        seen.update(
+            h for (h,) in db.query(Document.content_hash).filter(Document.content_hash.in_(hashes[start : start + 500]))
+        )
+
+    docs = []
+    with _signatures(db) as scope:
+        for d, digest in zip(documents, hashes):
+            if digest in seen:
+                continue
+            seen.add(digest)
+            signature = minhash(d["content"])
+            original = scope.index.match(signature)
+            doc = Document(
+                title=d["title"],
+                content=d["content"],
+                tags=json.dumps(d.get("tags") or []),
+                extra_metadata=json.dumps(d.get("metadata") or {}),
+                content_hash=digest,
+                minhash=signature,
+            )
+            db.add(doc)
+            index_document(db, doc)
+            db.flush()  # assigns the id later documents in the batch may point to
+            if original is not None:
+                _supersede(db, doc, original)
+            scope.index.add(doc.id, signature, replaces=original)
+            docs.append(doc)
+        if not docs:
+            return []
+        bump_kb_version(db)
+        scope.versions_added = 1
+        db.commit()
+    logger.info("Stored %d documents", len(docs))
+
+    _embed_new_chunks(db)
+    return [doc.id for doc in docs]
+
+
+def delete_document(db: Session, doc: Document) -> None:
+    """Remove a document (and its chunks) from the knowledge base.
+
+    If other documents were flagged as near-copies of it, the newest of them takes its place.
+    """
+    copies = db.query(Document).filter(Document.duplicate_of == doc.id).order_by(Document.id.desc()).all()
+    if copies:
+        copies[0].duplicate_of = None
+        for copy in copies[1:]:
+            copy.duplicate_of = copies[0].id
+    db.delete(doc)
+    bump_kb_version(db)
+    db.commit()
+    logger.info("Deleted document id=%s title=%s", doc.id, doc.title)
+
+
+def backfill_content_hashes(db: Session) -> int:
+    """Hash documents stored before deduplication existed and flag the copies among them.
+
+    Returns the number of documents flagged as duplicates.
+    """
+    pending = db.query(Document).filter(Document.content_hash.is_(None)).order_by(Document.id).all()
+    if not pending:
+        return 0
+    signatures = SignatureIndex(db)
+    flagged = 0
+    for doc in pending:
+        doc.content_hash = content_hash(doc.content)
+        doc.minhash = minhash(doc.content)
+        copy = find_copy(db, doc.content)  # autoflush makes earlier documents in this loop visible
+        if copy and copy.id != doc.id:
+            doc.duplicate_of = copy.duplicate_of or copy.id
+            _drop_facts(doc)
+            flagged += 1
+            continue
+        original = signatures.match(doc.minhash)
+        if original is not None:
+            _supersede(db, doc, original)
+            flagged += 1
+        signatures.add(doc.id, doc.minhash, replaces=original)
+    if flagged:
+        bump_kb_version(db)
+    db.commit()
+    logger.info("Hashed %d existing documents; %d flagged as duplicates", len(pending), flagged)
+    return flagged
+
+
+@dataclass
+class _SignatureScope:
+    index: SignatureIndex
+    versions_added: int = 0  # knowledge-base versions the caller's commit added
+
+
+@contextmanager
+def _signatures(db: Session) -> Iterator[_SignatureScope]:
+    """The SignatureIndex of stored documents, reloaded only if the knowledge base changed elsewhere.
+
+    Stores in this process take turns inside the block. The caller adds its documents to the
+    index, commits and sets `versions_added`; the index is kept for the next store only if the
+    knowledge-base version moved by exactly that much, i.e. nothing else changed it meanwhile.
+    """
+    global _signature_cache
+    with _signature_lock:
+        version = get_kb_version(db)
+        if _signature_cache is not None and _signature_cache[0] == version:
+            scope = _SignatureScope(_signature_cache[1])
+        else:
+            scope = _SignatureScope(SignatureIndex(db))
+        _signature_cache = None  # stays unset if the caller fails half way
+        yield scope
+        new_version = get_kb_version(db)
+        if new_version == version + scope.versions_added:
+            _signature_cache = (new_version, scope.index)
+
+
+def _supersede(db: Session, doc: Document, original_id: int) -> None:
+    """Make `doc` the kept copy in place of its near-copy `original_id` and that one's copies."""
+    db.query(Document).filter(Document.duplicate_of == original_id).update({"duplicate_of": doc.id})
+    original = db.get(Document, original_id)
+    original.duplicate_of = doc.id
+    _drop_facts(original)
+
+
+def _drop_facts(doc: Document) -> None:
+    """Remove a duplicate's extracted facts; its kept copy has (or will get) its own."""
+    for facts in (doc.project_facts, doc.client_facts, doc.person_facts,
+                  doc.deal_facts, doc.technology_facts, doc.milestone_facts):
+        facts.clear()
+    doc.facts_extracted_at = None
+
+
+def get_kb_version(db: Session) -> int:
+    """Current knowledge-base version; changes whenever a document is added or removed."""
+    row = db.get(KnowledgeBaseVersion, 1)
+    return row.version if row else 0
+
+
+def bump_kb_version(db: Session) -> None:
+    """Advance the knowledge-base version as part of the caller's transaction."""
+    updated = (
+        db.query(KnowledgeBaseVersion)
+        .filter(KnowledgeBaseVersion.id == 1)
+        .update({"version": KnowledgeBaseVersion.version + 1}, synchronize_session=False)
+    )
+    if not updated:
+        db.add(KnowledgeBaseVersion(id=1, version=1))
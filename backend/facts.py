@@ -0,0 +1,457 @@
+"""Structured facts extracted from each document once, at ingest, and aggregated with SQL.
+
+After a document is stored, a background task asks the LLM (BACKGROUND priority, JSON-schema
+constrained output) for the projects, clients, people, deals, technologies and milestones it
+mentions, and stores them in the fact_* tables. Dashboard charts that are plain counts or
+values over those entities are then computed by SQL aggregation in `derive_charts` instead of
+having the LLM re-read the documents for every department; only charts that need judgement
+(ratings, content ideas) still go to the LLM.
+"""
+
+import asyncio
+import logging
+import os
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from backend.database import AsyncSessionLocal, SessionLocal
+from backend.llm_scheduler import Priority, SchedulerRejected
+from shared.models import (
+    ClientFact,
+    DealFact,
+    Document,
+    MilestoneFact,
+    PersonFact,
+    ProjectFact,
+    TechnologyFact,
+)
+
+logger = logging.getLogger(__name__)
+
+FACTS_ENABLED = os.getenv("FACTS_EXTRACTION_ENABLED", "true").lower() in ("1", "true", "yes")
+FACTS_CONTEXT_TOKEN_BUDGET = int(os.getenv("FACTS_CONTEXT_TOKEN_BUDGET", "6000"))
+FACTS_RETRY_SECONDS = 30
+# Bar charts over names show the largest values only
+MAX_CHART_ITEMS = 15
+
+PROJECT_STATUSES = ["Active", "At Risk", "Completed", "On Hold"]
+SENIORITIES = ["Junior", "Mid", "Senior", "Lead"]
+ROLES = ["Frontend", "Backend", "Full-Stack", "DevOps", "QA", "Other"]
+DEAL_STAGES = ["Prospecting", "Qualification", "Negotiation", "Closing", "Won", "Lost"]
+UNKNOWN = "Unknown"
+
+_text = {"type": "string"}
+_date = {"type": "string", "description": "YYYY-MM-DD, or empty if not stated"}
+
+
+def _enum(values: list[str]) -> dict:
+    return {"type": "string", "enum": values + [UNKNOWN]}
+
+
+def _array_of(properties: dict) -> dict:
+    return {
+        "type": "array",
+        "items": {"type": "object", "properties": properties, "required": list(properties)},
+    }
+
+
+FACTS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "projects": _array_of({
+            "name": _text,
+            "client": _text,
+            "status": _enum(PROJECT_STATUSES),
+            "type": _text,
+            "start_date": _date,
+            "end_date": _date,
+            "technologies": {"type": "array", "items": _text},
+        }),
+        "clients": _array_of({"name": _text, "industry": _text, "relationship_start": _date}),
+        "people": _array_of({
+            "name": _text,
+            "role": _enum(ROLES),
+            "seniority": _enum(SENIORITIES),
+            "project": _text,
+            "open_work_items": {"type": ["integer", "null"]},
+        }),
+        "deals": _array_of({
+            "company": _text,
+            "stage": _enum(DEAL_STAGES),
+            "industry": _text,
+            "value": {"type": ["number", "null"]},
+        }),
+        "milestones": _array_of({"title": _text, "project": _text, "due_date": _date}),
+    },
+    "required": ["projects", "clients", "people", "deals", "milestones"],
+}
+
+
+# --------------- Storage ---------------
+
+def _key(name: str | None) -> str | None:
+    name = " ".join((name or "").split())
+    return name.lower() or None
+
+
+def _clean(value) -> str | None:
+    """Strip a string field; empty and "Unknown" become None."""
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    return value if value and value != UNKNOWN else None
+
+
+def _parse_date(value) -> date | None:
+    value = _clean(value)
+    if value is None:
+        return None
+    for fmt in ("%Y-%m-%d", "%Y-%m"):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _number(value) -> float | None:
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def store_facts(db: Session, document_id: int, data: dict) -> None:
+    """Replace the facts of a document with those in `data` (FACTS_SCHEMA) and mark it extracted.
+
+    Rows without a name are skipped.
+    """
+    doc = db.get(Document, document_id)
+    if doc is None:
+        return  # deleted while its facts were being extracted
+
+    for facts in (doc.project_facts, doc.client_facts, doc.person_facts,
+                  doc.deal_facts, doc.technology_facts, doc.milestone_facts):
+        facts.clear()
+
+    for p in data.get("projects", []):
+        name = _clean(p.get("name"))
+        if not name:
+            continue
+        doc.project_facts.append(ProjectFact(
+            name=name, name_key=_key(name), client=_clean(p.get("client")), status=_clean(p.get("status")),
+            project_type=_clean(p.get("type")), start_date=_parse_date(p.get("start_date")),
+            end_date=_parse_date(p.get("end_date")),
+        ))
+        for tech in p.get("technologies") or []:
+            if _clean(tech):
+                doc.technology_facts.append(TechnologyFact(
+                    name=_clean(tech), name_key=_key(tech), project_key=_key(name),
+                ))
+    for c in data.get("clients", []):
+        name = _clean(c.get("name"))
+        if name:
+            doc.client_facts.append(ClientFact(
+                name=name, name_key=_key(name), industry=_clean(c.get("industry")),
+                relationship_start=_parse_date(c.get("relationship_start")),
+            ))
+    for p in data.get("people", []):
+        name = _clean(p.get("name"))
+        if not name:
+            continue
+        project = _clean(p.get("project"))
+        work_items = _number(p.get("open_work_items"))
+        doc.person_facts.append(PersonFact(
+            name=name, name_key=_key(name), role=_clean(p.get("role")), seniority=_clean(p.get("seniority")),
+            project=project, project_key=_key(project),
+            open_work_items=int(work_items) if work_items is not None else None,
+        ))
+    for d in data.get("deals", []):
+        company = _clean(d.get("company"))
+        if company:
+            doc.deal_facts.append(DealFact(
+                company=company, company_key=_key(company), stage=_clean(d.get("stage")),
+                industry=_clean(d.get("industry")), value=_number(d.get("value")),
+            ))
+    for m in data.get("milestones", []):
+        title = _clean(m.get("title"))
+        if title:
+            doc.milestone_facts.append(MilestoneFact(
+                title=title, project=_clean(m.get("project")), due_date=_parse_date(m.get("due_date")),
+            ))
+
+    doc.facts_extracted_at = datetime.utcnow()
+    db.commit()
+
+
+# --------------- Extraction ---------------
+
+_lock = asyncio.Lock()
+_wake = asyncio.Event()
+
+
+def notify_document_added() -> None:
+    """Wake the background extractor."""
+    _wake.set()
+
+
+def _pending_documents() -> list[int]:
+    db = SessionLocal()
+    try:
+        return [
+            doc_id for (doc_id,) in
+            db.query(Document.id)
+            .filter(Document.facts_extracted_at.is_(None), Document.duplicate_of.is_(None))
+            .order_by(Document.id)
+        ]
+    finally:
+        db.close()
+
+
+def _store(document_id: int, data: dict) -> None:
+    db = SessionLocal()
+    try:
+        store_facts(db, document_id, data)
+    finally:
+        db.close()  # rolls back whatever a failed store left
+
+
+async def extract_pending(priority: Priority = Priority.BACKGROUND) -> int:
+    """Extract facts from every document that has none yet. Returns how many were done.
+
+    DB work runs in worker threads with a short-lived session per step, so the backlog never
+    holds a connection (or the event loop) while the model runs.
+    A document whose extraction fails stays pending and is retried on the next call.
+    Raises SchedulerRejected if the LLM queue is full.
+    """
+    from backend.llm import extract_document_facts  # backend.llm imports this module
+
+    async with _lock:
+        pending = await asyncio.to_thread(_pending_documents)
+        done = 0
+        for doc_id in pending:
+            try:
+                async with AsyncSessionLocal() as db:
+                    data = await extract_document_facts(db, doc_id, priority=priority)
+                await asyncio.to_thread(_store, doc_id, data)
+            except SchedulerRejected:
+                raise
+            except (ValueError, RuntimeError) as e:
+                logger.warning("Fact extraction failed for document id=%s: %s", doc_id, e)
+                continue
+            except Exception:
+                # e.g. a locked database or output store_facts cannot handle; the rest go on
+                logger.exception("Fact extraction failed for document id=%s", doc_id)
+                continue
+            done += 1
+        if done:
+            logger.info("Extracted facts from %d documents", done)
+        return done
+
+
+async def run() -> None:
+    """Extract facts from new documents forever (start as a background task at startup)."""
+    while True:
+        _wake.clear()
+        try:
+            await extract_pending()
+        except SchedulerRejected as e:
+            logger.warning("Fact extraction postponed: %s", e)
+            await asyncio.sleep(FACTS_RETRY_SECONDS)
+            continue
+        except Exception:
+            # The extractor must outlive any single failure
+            logger.exception("Fact extraction run failed; retrying in %ds", FACTS_RETRY_SECONDS)
+            await asyncio.sleep(FACTS_RETRY_SECONDS)
+            continue
+        await _wake.wait()
+
+
+# --------------- Aggregation ---------------
+
+def _latest(column_id, key_column):
+    """Ids of the newest row per entity key (later documents supersede earlier ones)."""
+    return select(func.max(column_id)).where(key_column.isnot(None)).group_by(key_column)
+
+
+def _ordered(counts: dict[str, float], order: list[str]) -> tuple[list[str], list[float]]:
+    labels = [label for label in order if counts.get(label)]
+    return labels, [counts[label] for label in labels]
+
+
+def _top(rows) -> tuple[list[str], list[float]]:
+    rows = sorted(((label, value) for label, value in rows if label), key=lambda r: r[1], reverse=True)
+    rows = rows[:MAX_CHART_ITEMS]
+    return [label for label, _ in rows], [value for _, value in rows]
+
+
+def _project_status(db: Session):
+    counts = dict(
+        db.query(ProjectFact.status, func.count())
+        .filter(ProjectFact.id.in_(_latest(ProjectFact.id, ProjectFact.name_key)))
+        .group_by(ProjectFact.status)
+        .all()
+    )
+    return _ordered(counts, PROJECT_STATUSES)
+
+
+def _client_longevity(db: Session):
+    today = date.today()
+    rows = (
+        db.query(func.max(ClientFact.name), func.min(ClientFact.relationship_start))
+        .filter(ClientFact.relationship_start.isnot(None))
+        .group_by(ClientFact.name_key)
+        .all()
+    )
+    return _top(
+        (name, max((today.year - start.year) * 12 + today.month - start.month, 0)) for name, start in rows
+    )
+
+
+def _timeline_progress(db: Session):
+    today = date.today()
+    rows = (
+        db.query(ProjectFact.name, ProjectFact.start_date, ProjectFact.end_date)
+        .filter(
+            ProjectFact.id.in_(_latest(ProjectFact.id, ProjectFact.name_key)),
+            ProjectFact.status.in_(["Active", "At Risk"]),
+            ProjectFact.start_date.isnot(None),
+            ProjectFact.end_date > ProjectFact.start_date,
+        )
+        .all()
+    )
+    return _top(
+        (name, round(min(max((today - start).days / (end - start).days, 0), 1) * 100))
+        for name, start, end in rows
+    )
+
+
+def _project_types(db: Session):
+    return _top(
+        db.query(ProjectFact.project_type, func.count())
+        .filter(ProjectFact.id.in_(_latest(ProjectFact.id, ProjectFact.name_key)))
+        .group_by(ProjectFact.project_type)
+        .all()
+    )
+
+
+def _people_per_project(db: Session):
+    return _top(
+        db.query(func.max(PersonFact.project), func.count(func.distinct(PersonFact.name_key)))
+        .filter(PersonFact.project_key.isnot(None))
+        .group_by(PersonFact.project_key)
+        .all()
+    )
+
+
+def _latest_people(db: Session, column):
+    return (
+        db.query(column, func.count())
+        .filter(PersonFact.id.in_(_latest(PersonFact.id, PersonFact.name_key)))
+        .group_by(column)
+        .all()
+    )
+
+
+def _seniority_distribution(db: Session):
+    return _ordered(dict(_latest_people(db, PersonFact.seniority)), SENIORITIES)
+
+
+def _team_composition(db: Session):
+    return _ordered(dict(_latest_people(db, PersonFact.role)), ROLES)
+
+
+def _workload(db: Session):
+    return _top(
+        db.query(PersonFact.name, PersonFact.open_work_items)
+        .filter(
+            PersonFact.id.in_(_latest(PersonFact.id, PersonFact.name_key)),
+            PersonFact.open_work_items.isnot(None),
+        )
+        .all()
+    )
+
+
+def _latest_deals(db: Session):
+    return db.query(DealFact).filter(DealFact.id.in_(_latest(DealFact.id, DealFact.company_key)))
+
+
+def _open_deals(db: Session):
+    return _latest_deals(db).filter(
+        (DealFact.stage.is_(None)) | (DealFact.stage.notin_(["Won", "Lost"]))
+    )
+
+
+def _pipeline_stages(db: Session):
+    counts = dict(
+        _latest_deals(db).with_entities(DealFact.stage, func.count()).group_by(DealFact.stage).all()
+    )
+    return _ordered(counts, DEAL_STAGES)
+
+
+def _leads_by_industry(db: Session):
+    return _top(_open_deals(db).with_entities(DealFact.industry, func.count()).group_by(DealFact.industry).all())
+
+
+def _deal_value(db: Session):
+    return _top(
+        _open_deals(db).filter(DealFact.value.isnot(None)).with_entities(DealFact.company, DealFact.value).all()
+    )
+
+
+def _tech_usage(db: Session):
+    return _top(
+        db.query(func.max(TechnologyFact.name), func.count(func.distinct(TechnologyFact.project_key)))
+        .group_by(TechnologyFact.name_key)
+        .all()
+    )
+
+
+def _deadlines_by_week(db: Session):
+    today = date.today()
+    due = (
+        db.query(func.lower(MilestoneFact.title), MilestoneFact.due_date)
+        .filter(MilestoneFact.due_date >= today, MilestoneFact.due_date < today + timedelta(weeks=4))
+        .distinct()
+        .all()
+    )
+    counts = {f"Week {week}": 0 for week in range(1, 5)}
+    for _, day in due:
+        counts[f"Week {(day - today).days // 7 + 1}"] += 1
+    return list(counts), list(counts.values())
+
+
+# Chart spec id -> aggregation returning (labels, values). Specs not listed need the LLM.
+DERIVED_CHARTS = {
+    "project_status": _project_status,
+    "client_longevity": _client_longevity,
+    "timeline_progress": _timeline_progress,
+    "project_types": _project_types,
+    "team_by_project": _people_per_project,
+    "resource_allocation": _people_per_project,
+    "seniority_distribution": _seniority_distribution,
+    "team_composition": _team_composition,
+    "workload": _workload,
+    "pipeline_stages": _pipeline_stages,
+    "leads_by_industry": _leads_by_industry,
+    "deal_value": _deal_value,
+    "tech_usage": _tech_usage,
+    "deadlines_by_week": _deadlines_by_week,
+}
+
+
+def derive_charts(db: Session, specs: list[dict]) -> dict[str, dict]:
+    """Compute the charts in `specs` that can be derived from stored facts, keyed by chart id."""
+    if not FACTS_ENABLED:
+        return {}
+    charts = {}
+    for spec in specs:
+        aggregate = DERIVED_CHARTS.get(spec["id"])
+        if aggregate is None:
+            continue
+        labels, values = aggregate(db)
+        if not any(values):
+            labels, values = ["No data"], [1]
+        charts[spec["id"]] = {
+            "id": spec["id"], "type": spec["type"], "title": spec["title"], "labels": labels, "values": values,
+        }
+    return charts
@@ -0,0 +1,119 @@
+"""Hedged requests for interactive chat.
+
+The primary generation is started on its own. If it has not produced its first token
+by the hedge deadline (a percentile of recently observed time-to-first-token), a second
+generation of the same prompt is started elsewhere (the fallback model, or a second
+Ollama host). Whichever finishes first wins and the other is cancelled.
+The hedge never waits for a scheduler slot; without one it is skipped (see backend.llm).
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+# Used until enough first-token samples have been observed, and as a floor afterwards
+HEDGE_MIN_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_MIN_DELAY_SECONDS", "2.0"))
+HEDGE_MIN_SAMPLES = 20
+# Optional second Ollama server; when set, the hedge runs the primary model there
+HEDGE_HOST = os.getenv("LLM_HEDGE_HOST")
+
+
+class Hedger:
+    """Runs a primary call with a delayed backup call and keeps hedge metrics."""
+
+    def __init__(self, percentile: float, min_delay: float):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self._first_token_seconds: deque[float] = deque(maxlen=500)
+        self.requests = 0
+        self.hedges_fired = 0
+        self.primary_wins = 0
+        self.hedge_wins = 0
+        self.both_failed = 0
+
+    def deadline(self) -> float:
+        """Seconds to wait for the primary's first token before hedging."""
+        samples = sorted(self._first_token_seconds)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return self.min_delay
+        index = min(int(len(samples) * self.percentile), len(samples) - 1)
+        return max(samples[index], self.min_delay)
+
+    async def run(
+        self,
+        primary: Callable[[Callable[[], None]], Awaitable[str]],
+        hedge: Callable[[], Awaitable[str]],
+    ) -> tuple[str, bool]:
+        """Run `primary`, hedging with `hedge` if the primary is slow to start.
+
+        `primary` is called with an `on_first_token` callback it must invoke when the first
+        token arrives. Returns (reply, hedge_won). Raises the primary's error if both fail.
+        """
+        self.requests += 1
+        started = time.monotonic()
+        first_token = asyncio.Event()
+
+        def on_first_token() -> None:
+            if not first_token.is_set():
+                self._first_token_seconds.append(time.monotonic() - started)
+                first_token.set()
+
+        primary_task = asyncio.create_task(primary(on_first_token))
+        hedge_task: asyncio.Task | None = None
+        try:
+            deadline = self.deadline()
+            waiter = asyncio.create_task(first_token.wait())
+            await asyncio.wait({primary_task, waiter}, timeout=deadline, return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+
+            if first_token.is_set() or primary_task.done():
+                reply = await primary_task
+                self.primary_wins += 1
+                return reply, False
+
+            self.hedges_fired += 1
+            logger.info("No first token after %.2fs; sending hedge request", deadline)
+            hedge_task = asyncio.create_task(hedge())
+            pending = {primary_task, hedge_task}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge_task:
+                            self.hedge_wins += 1
+                        else:
+                            self.primary_wins += 1
+                        return task.result(), task is hedge_task
+                    side = "backup" if task is hedge_task else "primary"
+                    logger.warning("Hedged %s call failed: %s", side, task.exception())
+            self.both_failed += 1
+            raise primary_task.exception()
+        finally:
+            # Cancel the loser, or both if the caller itself was cancelled
+            for task in (primary_task, hedge_task):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": HEDGE_ENABLED,
+            "target": f"host {HEDGE_HOST}" if HEDGE_HOST else "fallback model",
+            "deadline_seconds": round(self.deadline(), 3),
+            "first_token_samples": len(self._first_token_seconds),
+            "requests": self.requests,
+            "hedges_fired": self.hedges_fired,
+            "hedge_rate": round(self.hedges_fired / self.requests, 4) if self.requests else 0.0,
+            "primary_wins": self.primary_wins,
+            "hedge_wins": self.hedge_wins,
+            "both_failed": self.both_failed,
+        }
+
+
+hedger = Hedger(HEDGE_PERCENTILE, HEDGE_MIN_DELAY_SECONDS)
@@ -0,0 +1,304 @@
+"""Background ingestion of uploaded documents.
+
+An upload is streamed to disk and recorded as an IngestionJob; the request returns right away.
+Request bodies on the upload endpoints are capped at UPLOAD_MAX_BYTES by UploadLimitMiddleware,
+and the multipart parser spools file parts to a temporary file, so an upload costs little memory.
+Each job then runs parse -> normalize page by page into a text file (in a process pool, so
+CPU-heavy PDF parsing never blocks the event loop; PDF pages are sharded across it and cached,
+see backend.pdf_pages) -> store, chunk and index (in a thread, it
+does blocking DB and embedding I/O).
+A zip archive is imported as one job through backend.bulk_import.
+Job status lives in the database, so any worker can report it. Jobs left unfinished by a
+restart are picked up again at startup; a lease per job keeps two workers from both running it.
+Job status updates are blocking DB writes too, so they also run in threads.
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import BinaryIO
+
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import func
+from starlette.responses import JSONResponse
+
+from backend import bulk_import, facts, leases, pdf_pages
+from backend.dashboard_jobs import pregenerator
+from backend.database import DB_DIR, SessionLocal
+from backend.dedup import find_copy
+from backend.document_processor import parse_file, store_document, write_text
+from shared.models import IngestionJob
+
+logger = logging.getLogger(__name__)
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(min(4, os.cpu_count() or 1))))
+UPLOAD_DIR = os.path.join(DB_DIR, "uploads")
+LEASE_TTL_SECONDS = 60
+PENDING = ["queued", "parsing", "indexing"]
+MAX_UPLOAD_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+# Limits on what an uploaded zip may unpack to (see bulk_import.import_archive)
+MAX_ARCHIVE_FILES = int(os.getenv("UPLOAD_ARCHIVE_MAX_FILES", "10000"))
+MAX_ARCHIVE_UNPACKED_BYTES = int(os.getenv("UPLOAD_ARCHIVE_MAX_UNPACKED_BYTES", str(10 * MAX_UPLOAD_BYTES)))
+COPY_CHUNK_BYTES = 1024 * 1024
+
+_executor: ProcessPoolExecutor | None = None
+_semaphore = asyncio.Semaphore(INGEST_WORKERS)
+_tasks: set[asyncio.Task] = set()
+_uploads = {"in_flight": 0, "in_flight_bytes": 0, "accepted": 0, "accepted_bytes": 0, "rejected_too_large": 0}
+
+
+class UploadLimitMiddleware:
+    """ASGI middleware that rejects upload request bodies over MAX_UPLOAD_BYTES with 413.
+
+    Checks Content-Length up front and counts the body as it arrives (for chunked requests),
+    so an oversized upload is refused before it is spooled to disk. Also tracks in-flight uploads.
+    """
+
+    def __init__(self, app, path_prefix: str = "/upload/"):
+        self.app = app
+        self.path_prefix = path_prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES:
+            _uploads["rejected_too_large"] += 1
+            response = JSONResponse({"detail": _too_large_detail()}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def receive_limited():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                size = len(message.get("body", b""))
+                received += size
+                _uploads["in_flight_bytes"] += size
+                if received > MAX_UPLOAD_BYTES:
+                    _uploads["rejected_too_large"] += 1
+                    raise HTTPException(status_code=413, detail=_too_large_detail())
+            return message
+
+        _uploads["in_flight"] += 1
+        try:
+            await self.app(scope, receive_limited, send)
+        finally:
+            _uploads["in_flight"] -= 1
+            _uploads["in_flight_bytes"] -= received
+
+
+def _too_large_detail() -> str:
+    return f"Upload too large; the limit is {MAX_UPLOAD_BYTES} bytes"
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn: forking a process that runs an event loop and threads is not safe
+        _executor = ProcessPoolExecutor(
+            max_workers=INGEST_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+
+def _reset_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def shutdown() -> None:
+    """Stop the parser processes (call on application shutdown)."""
+    for task in _tasks:
+        task.cancel()
+    _reset_executor()
+
+
+async def enqueue(upload: UploadFile) -> dict:
+    """Save an upload, record a queued job for it and start processing it. Returns the job."""
+    job, size = await asyncio.to_thread(_save_upload, upload.filename, upload.file)
+    _uploads["accepted"] += 1
+    _uploads["accepted_bytes"] += size
+    submit(job["id"])
+    return job
+
+
+def _save_upload(filename: str, src: BinaryIO) -> tuple[dict, int]:
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    db = SessionLocal()
+    try:
+        job = IngestionJob(filename=filename)
+        db.add(job)
+        db.flush()
+        job.upload_path = os.path.join(UPLOAD_DIR, f"{job.id}{os.path.splitext(filename)[1].lower()}")
+        src.seek(0)
+        with open(job.upload_path, "wb") as f:
+            shutil.copyfileobj(src, f, COPY_CHUNK_BYTES)
+            size = f.tell()
+        db.commit()
+        return job.to_dict(), size
+    finally:
+        db.close()
+
+
+def submit(job_id: int) -> None:
+    task = asyncio.create_task(_run_job(job_id))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+def resume_pending() -> int:
+    """Restart jobs that were queued or running when the process stopped."""
+    db = SessionLocal()
+    try:
+        job_ids = [
+            job_id for (job_id,) in
+            db.query(IngestionJob.id).filter(IngestionJob.status.in_(PENDING))
+        ]
+    finally:
+        db.close()
+    for job_id in job_ids:
+        submit(job_id)
+    if job_ids:
+        logger.info("Resuming %d ingestion jobs", len(job_ids))
+    return len(job_ids)
+
+
+def get_job(job_id: int) -> dict | None:
+    db = SessionLocal()
+    try:
+        job = db.get(IngestionJob, job_id)
+        return job.to_dict() if job else None
+    finally:
+        db.close()
+
+
+def stats() -> dict:
+    """Upload and ingestion-job counters for this worker, plus job counts by status."""
+    db = SessionLocal()
+    try:
+        jobs = dict(db.query(IngestionJob.status, func.count()).group_by(IngestionJob.status).all())
+    finally:
+        db.close()
+    return {
+        "workers": INGEST_WORKERS,
+        "max_upload_bytes": MAX_UPLOAD_BYTES,
+        "uploads": dict(_uploads),
+        "active_tasks": len(_tasks),
+        "jobs": jobs,
+        "pdf_pages": pdf_pages.stats(),
+    }
+
+
+def _pending_job(job_id: int) -> tuple[str, str] | None:
+    """(filename, upload path) of the job if it still needs running."""
+    db = SessionLocal()
+    try:
+        job = db.get(IngestionJob, job_id)
+        if job is None or job.status not in PENDING:
+            return None
+        return job.filename, job.upload_path
+    finally:
+        db.close()
+
+
+async def _set_status(job_id: int, status: str, **fields) -> None:
+    await asyncio.to_thread(_write_status, job_id, status, fields)
+
+
+def _write_status(job_id: int, status: str, fields: dict) -> None:
+    db = SessionLocal()
+    try:
+        db.query(IngestionJob).filter(IngestionJob.id == job_id).update({"status": status, **fields})
+        db.commit()
+    finally:
+        db.close()
+
+
+def _import_archive(path: str) -> dict:
+    summary = bulk_import.import_archive(
+        path, _get_executor(), MAX_UPLOAD_BYTES, max_files=MAX_ARCHIVE_FILES, max_total_bytes=MAX_ARCHIVE_UNPACKED_BYTES
+    )
+    if not summary["imported"] and not summary["duplicates"]:
+        raise ValueError("No documents could be imported from the archive")
+    error = None
+    if summary["failed"]:
+        error = f"{len(summary['failed'])} files skipped: " + "; ".join(
+            f"{f['filename']}: {f['error']}" for f in summary["failed"][:20]
+        )
+    return {"documents_added": summary["imported"], "error": error}
+
+
+def _store(filename: str, text_path: str) -> tuple[int, int]:
+    """Store the parsed text. Returns (document id, documents added): 0 added for an exact copy."""
+    with open(text_path, encoding="utf-8") as f:
+        text = f.read()
+    db = SessionLocal()
+    try:
+        existing = find_copy(db, text)
+        if existing:
+            return existing.id, 0
+        return store_document(db, title=filename, content=text).id, 1
+    finally:
+        db.close()
+
+
+async def _run_job(job_id: int) -> None:
+    async with _semaphore, leases.hold(f"ingestion:{job_id}", LEASE_TTL_SECONDS) as acquired:
+        if not acquired:
+            return  # another worker is running it
+        job = await asyncio.to_thread(_pending_job, job_id)
+        if job is None:
+            return
+        filename, path = job
+        text_path = f"{path}.txt"
+
+        try:
+            await _set_status(job_id, "parsing")
+            if os.path.splitext(filename)[1].lower() == ".zip":
+                document_id = None
+                result = await asyncio.to_thread(_import_archive, path)
+            else:
+                if os.path.splitext(filename)[1].lower() == ".pdf":
+                    pages, parse_stats = await pdf_pages.extract_pdf(path, _get_executor())
+                    written = await asyncio.to_thread(write_text, pages, text_path)
+                    await _set_status(job_id, "parsing", stats=json.dumps(parse_stats))
+                else:
+                    loop = asyncio.get_running_loop()
+                    written = await loop.run_in_executor(_get_executor(), parse_file, path, filename, text_path)
+                if not written:
+                    raise ValueError("No text could be extracted from the file")
+
+                await _set_status(job_id, "indexing")
+                document_id, added = await asyncio.to_thread(_store, filename, text_path)
+                result = {"documents_added": added}
+        except asyncio.CancelledError:
+            raise  # shutting down; the job is resumed on the next start
+        except BrokenProcessPool as e:
+            # A parser process died (e.g. out of memory on a pathological PDF); start a fresh pool
+            _reset_executor()
+            logger.warning("Ingestion job %s (%s) failed: %s", job_id, filename, e)
+            await _set_status(job_id, "failed", error=f"Parser process crashed: {e}", finished_at=datetime.utcnow())
+        except Exception as e:
+            logger.warning("Ingestion job %s (%s) failed: %s", job_id, filename, e)
+            await _set_status(job_id, "failed", error=f"{type(e).__name__}: {e}", finished_at=datetime.utcnow())
+        else:
+            await _set_status(job_id, "done", document_id=document_id, finished_at=datetime.utcnow(), **result)
+            logger.info("Ingestion job %s done: %d documents added", job_id, result["documents_added"])
+            facts.notify_document_added()
+            pregenerator.notify_documents_changed()
+        for leftover in (path, text_path):
+            if leftover and os.path.exists(leftover):
+                os.remove(leftover)
@@ -0,0 +1,125 @@
+"""Database-backed leases so that only one process (uvicorn worker) works on a key at a time.
+
+A lease is a row in `generation_leases`. Acquiring inserts it, or takes it over once it has
+expired; the holder keeps it alive with a heartbeat and deletes it when done. A worker that
+crashes simply lets its lease expire.
+
+The functions below are blocking; `hold` runs them in worker threads so acquiring, the
+heartbeat and releasing never block the event loop.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from backend.database import SessionLocal
+from shared.models import GenerationLease
+
+logger = logging.getLogger(__name__)
+
+# Identifies this process as a lease owner
+OWNER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def try_acquire(db: Session, key: str, ttl: float, owner: str = OWNER_ID) -> bool:
+    """Take the lease on `key` if it is free or expired. Returns True if we now hold it."""
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=ttl)
+
+    db.add(GenerationLease(key=key, owner=owner, expires_at=expires_at))
+    try:
+        db.commit()
+        return True
+    except IntegrityError:
+        db.rollback()
+
+    # Someone holds (or held) it; take over only if it has expired. The conditional UPDATE
+    # is atomic, so of several processes racing for an expired lease exactly one wins.
+    taken = (
+        db.query(GenerationLease)
+        .filter(GenerationLease.key == key, GenerationLease.expires_at < now)
+        .update({"owner": owner, "expires_at": expires_at}, synchronize_session=False)
+    )
+    db.commit()
+    return taken == 1
+
+
+def renew(db: Session, key: str, ttl: float, owner: str = OWNER_ID) -> bool:
+    """Extend a lease we hold. Returns False if it was lost."""
+    renewed = (
+        db.query(GenerationLease)
+        .filter(GenerationLease.key == key, GenerationLease.owner == owner)
+        .update({"expires_at": datetime.utcnow() + timedelta(seconds=ttl)}, synchronize_session=False)
+    )
+    db.commit()
+    return renewed == 1
+
+
+def release(db: Session, key: str, owner: str = OWNER_ID) -> None:
+    """Give up a lease we hold."""
+    db.query(GenerationLease).filter(
+        GenerationLease.key == key, GenerationLease.owner == owner
+    ).delete(synchronize_session=False)
+    db.commit()
+
+
+def is_held(db: Session, key: str) -> bool:
+    """True if anyone holds an unexpired lease on `key`."""
+    return (
+        db.query(GenerationLease)
+        .filter(GenerationLease.key == key, GenerationLease.expires_at >= datetime.utcnow())
+        .first()
+        is not None
+    )
+
+
+def _with_session(fn, *args):
+    db = SessionLocal()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+
+async def _in_thread(fn, *args):
+    """Run `fn(db, *args)` with its own session in a worker thread."""
+    return await asyncio.to_thread(_with_session, fn, *args)
+
+
+@asynccontextmanager
+async def hold(key: str, ttl: float):
+    """Try to take the lease on `key`; yields True while held (renewed in the background)."""
+    acquired = await _in_thread(try_acquire, key, ttl)
+    if not acquired:
+        yield False
+        return
+
+    async def keep_alive():
+        while True:
+            await asyncio.sleep(ttl / 3)
+            try:
+                renewed = await _in_thread(renew, key, ttl)
+            except Exception:
+                # e.g. a locked database; the next beat tries again before the lease expires
+                logger.exception("Could not renew lease %s", key)
+                continue
+            if not renewed:
+                logger.warning("Lost lease %s", key)
+                return
+
+    heartbeat = asyncio.create_task(keep_alive())
+    try:
+        yield True
+    finally:
+        heartbeat.cancel()
+        try:
+            await _in_thread(release, key)
+        except Exception:
+            logger.exception("Could not release lease %s; it expires in %.0fs", key, ttl)
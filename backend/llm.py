@@ -1,14 +1,32 @@
 """Ollama LLM integration – builds prompts with persona context and queries the model."""
 
+import asyncio
 import logging
 import os
+from collections.abc import AsyncIterator, Callable
+from datetime import date
 
+import httpx
 import ollama
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
+from backend.facts import FACTS_CONTEXT_TOKEN_BUDGET, FACTS_SCHEMA, derive_charts
+from backend.hedging import HEDGE_ENABLED, HEDGE_HOST, hedger
+from backend.llm_scheduler import Priority, scheduler
+from backend.model_router import ModelRouter
+from backend.prompt_builder import PromptReport, assemble_prompt
+from backend.retrieval import (
+    CONTEXT_TOKEN_BUDGET,
+    RETRIEVAL_TOP_K,
+    document_chunks,
+    hybrid_search,
+    pack_chunks,
+    recent_chunks,
+    vector_search,
+)
 from shared.models import Document
 import json
-import re
 
 from shared.personas import get_chart_specs, get_dashboard_prompt, get_persona
 
@@ -17,214 +35,869 @@ logger = logging.getLogger(__name__)
 MODEL = os.getenv("OLLAMA_MODEL", "llama3.2")
 FALLBACK_MODEL = os.getenv("OLLAMA_FALLBACK_MODEL", "llama3.1:8b")
 
+# Context window (num_ctx) per model. Prompts are packed to fit, leaving room for the reply.
+MODEL_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "8192"))
+FALLBACK_MODEL_NUM_CTX = int(os.getenv("OLLAMA_FALLBACK_NUM_CTX", "8192"))
+CONTEXT_WINDOWS = {MODEL: MODEL_NUM_CTX, FALLBACK_MODEL: FALLBACK_MODEL_NUM_CTX}
+RESPONSE_TOKEN_RESERVE = int(os.getenv("OLLAMA_RESPONSE_TOKEN_RESERVE", "1024"))
+
+# Shared async client: one pooled HTTP connection set per process. How many generations
+# run at once is decided by backend.llm_scheduler.
+OLLAMA_HOST = os.getenv("OLLAMA_HOST")  # None -> library default (http://localhost:11434)
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "16"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "300"))
+
+_client: ollama.AsyncClient | None = None
+_hedge_client: ollama.AsyncClient | None = None
+
+# Circuit breakers per model; every loop below tries router.candidates() in order
+router = ModelRouter([MODEL, FALLBACK_MODEL])
+
+# Dashboards summarise the whole portfolio, so they retrieve more chunks than a chat turn
+DASHBOARD_TOP_K = int(os.getenv("DASHBOARD_TOP_K", "40"))
+DASHBOARD_CONTEXT_TOKEN_BUDGET = int(os.getenv("DASHBOARD_CONTEXT_TOKEN_BUDGET", "6000"))
+
+
+def _fetch_context(
+    db: Session,
+    limit: int = 10,
+    query: str | None = None,
+    top_k: int = RETRIEVAL_TOP_K,
+    token_budget: int = CONTEXT_TOKEN_BUDGET,
+    document_ids: list[int] | None = None,
+    vector_hits: list[tuple[int, float]] | None = None,
+) -> list[str]:
+    """Fetch knowledge-base context for the LLM as a list of per-document parts, best first.
+
+    With `document_ids`, exactly those documents are used (packed into `token_budget`).
+    With a `query`, the best-matching chunks (keyword, vector or hybrid, see
+    backend.retrieval.RETRIEVAL_MODE) are packed into `token_budget`;
+    if nothing matches, the leading chunks of the most recent documents are used instead.
+    Without either, the `limit` most recent documents are returned in full.
+    `vector_hits` is passed on to hybrid_search.
+    """
+    if document_ids is not None:
+        chunks = pack_chunks(document_chunks(db, document_ids), token_budget)
+    elif query is None:
+        docs = (
+            db.query(Document)
+            .filter(Document.duplicate_of.is_(None))
+            .order_by(Document.upload_date.desc())
+            .limit(limit)
+            .all()
+        )
+        if not docs:
+            return ["No documents available in the knowledge base yet."]
+
+        parts = []
+        for doc in docs:
+            parts.append(f"--- {doc.title} (uploaded {doc.upload_date}) ---\n{doc.content}")
+        return parts
+    else:
+        chunks = pack_chunks(hybrid_search(db, query, top_k, vector_hits) or recent_chunks(db, limit), token_budget)
+    if not chunks:
+        return ["No documents available in the knowledge base yet."]
+
+    # Group chunks under their source document, keeping each document's chunks in order
+    by_doc: dict[int, list[dict]] = {}
+    for chunk in chunks:
+        by_doc.setdefault(chunk["document_id"], []).append(chunk)
+
+    parts = []
+    for doc_chunks in by_doc.values():
+        head = doc_chunks[0]
+        body = "\n[...]\n".join(c["content"] for c in sorted(doc_chunks, key=lambda c: c["chunk_index"]))
+        parts.append(f"--- {head['title']} (uploaded {head['upload_date']}) ---\n{body}")
+    return parts
+
+
+def _new_client(host: str | None) -> ollama.AsyncClient:
+    return ollama.AsyncClient(
+        host=host,
+        timeout=LLM_TIMEOUT_SECONDS,
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_CONNECTIONS,
+        ),
+    )
+
+
+def get_client() -> ollama.AsyncClient:
+    """Return the process-wide Ollama AsyncClient, creating it on first use."""
+    global _client
+    if _client is None:
+        _client = _new_client(OLLAMA_HOST)
+    return _client
+
+
+def get_hedge_client() -> ollama.AsyncClient:
+    """Return the client for the second Ollama host used by hedged requests (LLM_HEDGE_HOST)."""
+    global _hedge_client
+    if _hedge_client is None:
+        _hedge_client = _new_client(HEDGE_HOST)
+    return _hedge_client
+
+
+async def close_client() -> None:
+    """Close the pooled clients (call on application shutdown)."""
+    global _client, _hedge_client
+    for client in (_client, _hedge_client):
+        if client is not None:
+            await client.close()
+    _client = _hedge_client = None
+
+
+async def _fetch_context_async(db: Session | AsyncSession, **kwargs) -> list[str]:
+    """Run _fetch_context (DB reads + query embedding) without blocking the event loop.
+
+    With an AsyncSession the query is embedded in a thread and the reads run on the session's
+    connection; a sync Session runs the whole fetch in a thread.
+    """
+    if not isinstance(db, AsyncSession):
+        return await asyncio.to_thread(_fetch_context, db, **kwargs)
+    if kwargs.get("query") is not None and kwargs.get("document_ids") is None:
+        # [] when unavailable, so the search is not retried on the event loop
+        kwargs["vector_hits"] = await asyncio.to_thread(
+            vector_search, kwargs["query"], kwargs.get("top_k", RETRIEVAL_TOP_K)
+        ) or []
+    return await db.run_sync(_fetch_context, **kwargs)
+
+
+def _error_detail(error: Exception | None) -> str:
+    """Suffix for "no model available" messages."""
+    if error is None:
+        return " All model circuits are open; see /admin/models."
+    return f" Last error: {type(error).__name__}: {error}"
+
+
+def _prompt_budget(model: str) -> int:
+    """Tokens available for the prompt on `model` once the reply reserve is set aside."""
+    return CONTEXT_WINDOWS.get(model, MODEL_NUM_CTX) - RESPONSE_TOKEN_RESERVE
+
+
+def _response_text(response) -> str:
+    """Pull the reply text out of an Ollama chat response."""
+    # Handle both dict-style and attribute-style access (depends on ollama library version)
+    if hasattr(response, "message"):
+        msg = response.message
+        return msg.content if hasattr(msg, "content") else msg.get("content", "")
+    if isinstance(response, dict) and "message" in response:
+        return response["message"]["content"]
+    logger.error("Unexpected response format: %s", response)
+    return str(response)
+
+
+async def _ollama_chat(
+    model: str,
+    messages: list[dict],
+    report: PromptReport,
+    client: ollama.AsyncClient | None = None,
+    format: dict | None = None,
+) -> str:
+    """Run one non-streaming generation with num_ctx pinned to the window the prompt was packed for.
+
+    `format` is a JSON schema the output is constrained to.
+    """
+    logger.info(
+        "Sending %d messages to Ollama model=%s (~%d/%d prompt tokens)",
+        len(messages), model, report.used_tokens, report.budget,
+    )
+    num_ctx = CONTEXT_WINDOWS.get(model, MODEL_NUM_CTX)
+    response = await (client or get_client()).chat(
+        model=model, messages=messages, format=format, options={"num_ctx": num_ctx}
+    )
+    return _response_text(response)
 
-def _fetch_context(db: Session, limit: int = 10) -> str:
-    """Fetch the most recent documents and format them as context for the LLM."""
-    docs = db.query(Document).order_by(Document.upload_date.desc()).limit(limit).all()
-    if not docs:
-        return "No documents available in the knowledge base yet."
 
+async def _ollama_chat_collect(
+    model: str, messages: list[dict], report: PromptReport, on_first_token: Callable[[], None]
+) -> str:
+    """Like _ollama_chat, but streams internally so the caller learns when the first token arrives."""
+    logger.info(
+        "Sending %d messages to Ollama model=%s (~%d/%d prompt tokens, hedged)",
+        len(messages), model, report.used_tokens, report.budget,
+    )
+    num_ctx = CONTEXT_WINDOWS.get(model, MODEL_NUM_CTX)
+    stream = await get_client().chat(model=model, messages=messages, stream=True, options={"num_ctx": num_ctx})
     parts = []
-    for doc in docs:
-        parts.append(f"--- {doc.title} (uploaded {doc.upload_date}) ---\n{doc.content}")
-    return "\n\n".join(parts)
+    async for part in stream:
+        delta = _response_text(part)
+        if delta:
+            if not parts:
+                on_first_token()
+            parts.append(delta)
+    return "".join(parts)
+
+
+async def _hedged_chat(
+    model: str,
+    messages: list[dict],
+    report: PromptReport,
+    build_messages: Callable[[str], tuple[list[dict], PromptReport]],
+) -> tuple[str, bool]:
+    """Run `model` with a hedge on LLM_HEDGE_HOST or the next candidate model.
+
+    Returns (reply, hedge_won). Without a usable hedge target this is a plain call.
+
+    A hedge never queues for a scheduler slot: behind other chats it would start too late to
+    help. On LLM_HEDGE_HOST it runs outside the local limit; on the primary host it needs a
+    free INTERACTIVE slot (so LLM_MAX_CONCURRENCY >= 2) and is skipped when there is none.
+    """
+    if HEDGE_HOST:
+        hedge_model, hedge_client = model, get_hedge_client()
+    else:
+        others = [m for m in router.candidates() if m != model]
+        if not others or scheduler.max_concurrency < 2:
+            return await _ollama_chat(model, messages, report), False
+        hedge_model, hedge_client = others[0], get_client()
+    hedge_messages, hedge_report = build_messages(hedge_model)
+
+    async def hedge() -> str:
+        if HEDGE_HOST:
+            return await _ollama_chat(hedge_model, hedge_messages, hedge_report, client=hedge_client)
+        # Claim the slot first, so a skipped hedge leaves the breaker's half-open trial alone
+        async with scheduler.slot_if_free(Priority.INTERACTIVE):
+            if not router.acquire(hedge_model):
+                raise RuntimeError(f"Hedge model {hedge_model} is unavailable")
+            try:
+                reply = await _ollama_chat(hedge_model, hedge_messages, hedge_report, client=hedge_client)
+            except Exception as e:
+                router.record_failure(hedge_model, e)
+                raise
+        router.record_success(hedge_model)
+        return reply
+
+    return await hedger.run(
+        lambda on_first_token: _ollama_chat_collect(model, messages, report, on_first_token),
+        hedge,
+    )
 
 
-def chat(
-    department: str, user_message: str, db: Session, history: list[dict] | None = None
+async def chat(
+    department: str, user_message: str, db: AsyncSession, history: list[dict] | None = None
 ) -> str:
     """
     Send a chat request to Ollama using the specified department persona.
 
-    Returns the assistant's reply text.
-    Raises RuntimeError if Ollama is unreachable.
+    Returns the assistant's reply text. The session's transaction is ended once the context
+    is read, so no pooled connection is held while the reply is generated.
+    Raises SchedulerRejected if the LLM queue is full.
     """
     persona = get_persona(department)
     if persona is None:
         return f"Unknown department: {department}"
 
-    context = _fetch_context(db)
+    context = await _fetch_context_async(db, query=user_message)
+    await db.commit()  # release the connection; generation can take minutes
 
-    system_message = (
-        f"{persona['system_prompt']}\n\n"
-        "Below is the current knowledge base. Use it to ground your answers:\n\n"
-        f"{context}"
-    )
-
-    # Build the messages list for the Ollama API
-    messages = [{"role": "system", "content": system_message}]
-    if history:
-        messages.extend(history)
-    messages.append({"role": "user", "content": user_message})
+    def build_messages(model: str) -> tuple[list[dict], PromptReport]:
+        return assemble_prompt(
+            model,
+            _prompt_budget(model),
+            system_prompt=persona["system_prompt"],
+            user_message=user_message,
+            context=context,
+            context_header="\n\nBelow is the current knowledge base. Use it to ground your answers:\n\n",
+            history=history,
+        )
 
     # Try primary model, then fallback
     last_error = None
-    for model in (MODEL, FALLBACK_MODEL):
-        try:
-            logger.info("Querying Ollama model=%s department=%s", model, department)
-            logger.info("Sending %d messages to Ollama", len(messages))
-            response = ollama.chat(model=model, messages=messages)
-            logger.info("Ollama response type: %s", type(response))
-            logger.info("Ollama response keys: %s", response.keys() if hasattr(response, 'keys') else dir(response))
-
-            # Handle both dict-style and attribute-style access (depends on ollama library version)
-            if hasattr(response, "message"):
-                msg = response.message
-                content = msg.content if hasattr(msg, "content") else msg.get("content", "")
-            elif isinstance(response, dict) and "message" in response:
-                content = response["message"]["content"]
-            else:
-                logger.error("Unexpected response format: %s", response)
-                content = str(response)
-
-            logger.info("Got reply from Ollama (%d chars)", len(content))
-            return content
-        except ollama.ResponseError as e:
-            logger.warning("Model %s ResponseError: %s", model, e)
-            last_error = e
-            continue
-        except Exception as e:
-            logger.error("Model %s unexpected error (%s): %s", model, type(e).__name__, e)
-            last_error = e
-            continue
-
-    error_detail = f" Last error: {type(last_error).__name__}: {last_error}" if last_error else ""
-    logger.error("All models failed. Tried: %s, %s.%s", MODEL, FALLBACK_MODEL, error_detail)
+    async with scheduler.slot(Priority.INTERACTIVE):
+        for model in router.candidates():
+            if not router.acquire(model):
+                continue
+            messages, report = build_messages(model)
+            try:
+                logger.info("Querying Ollama model=%s department=%s", model, department)
+                if HEDGE_ENABLED:
+                    content, hedge_won = await _hedged_chat(model, messages, report, build_messages)
+                else:
+                    content, hedge_won = await _ollama_chat(model, messages, report), False
+                if not hedge_won:
+                    router.record_success(model)
+                logger.info("Got reply from Ollama (%d chars)", len(content))
+                return content
+            except ollama.ResponseError as e:
+                logger.warning("Model %s ResponseError: %s", model, e)
+                router.record_failure(model, e)
+                last_error = e
+                continue
+            except Exception as e:
+                logger.error("Model %s unexpected error (%s): %s", model, type(e).__name__, e)
+                router.record_failure(model, e)
+                last_error = e
+                continue
+
+    error_detail = _error_detail(last_error)
+    logger.error("All models failed. Configured: %s.%s", ", ".join(router.models), error_detail)
     return (
-        f"Sorry, no LLM model is available. Tried models: {MODEL}, {FALLBACK_MODEL}. "
+        f"Sorry, no LLM model is available. Configured models: {', '.join(router.models)}. "
         f"Make sure Ollama is running and has a model pulled.{error_detail}"
     )
 
 
-def generate_dashboard(department: str, db: Session) -> str:
+async def chat_stream(
+    department: str, user_message: str, db: AsyncSession, history: list[dict] | None = None
+) -> AsyncIterator[str]:
+    """
+    Stream a chat reply from Ollama, yielding text deltas as they are generated.
+
+    Falls back to FALLBACK_MODEL only if the primary fails before producing any output.
+    Raises ValueError for an unknown department and RuntimeError if no model produced
+    output, or if the stream broke after partial output (the partial text has already
+    been yielded by then). As in chat, the session's transaction is ended before generation.
+    """
+    persona = get_persona(department)
+    if persona is None:
+        raise ValueError(f"Unknown department: {department}")
+
+    context = await _fetch_context_async(db, query=user_message)
+    await db.commit()  # release the connection for the length of the stream
+
+    last_error = None
+    async with scheduler.slot(Priority.INTERACTIVE):
+        for model in router.candidates():
+            if not router.acquire(model):
+                continue
+            messages, report = assemble_prompt(
+                model,
+                _prompt_budget(model),
+                system_prompt=persona["system_prompt"],
+                user_message=user_message,
+                context=context,
+                context_header="\n\nBelow is the current knowledge base. Use it to ground your answers:\n\n",
+                history=history,
+            )
+            produced = 0
+            try:
+                logger.info("Streaming from Ollama model=%s department=%s", model, department)
+                stream = await get_client().chat(
+                    model=model,
+                    messages=messages,
+                    stream=True,
+                    options={"num_ctx": CONTEXT_WINDOWS.get(model, MODEL_NUM_CTX)},
+                )
+                async for part in stream:
+                    delta = _response_text(part)
+                    if delta:
+                        produced += len(delta)
+                        yield delta
+                router.record_success(model)
+                logger.info("Streamed reply from Ollama (%d chars)", produced)
+                return
+            except Exception as e:
+                router.record_failure(model, e)
+                if produced:
+                    logger.error("Model %s stream broke after %d chars: %s", model, produced, e)
+                    raise RuntimeError(f"Stream from {model} was interrupted: {e}") from e
+                logger.warning("Model %s stream failed before output (%s): %s", model, type(e).__name__, e)
+                last_error = e
+                continue
+
+    raise RuntimeError(
+        f"No LLM model is available. Configured models: {', '.join(router.models)}.{_error_detail(last_error)}"
+    )
+
+
+async def generate_dashboard(
+    department: str,
+    db: Session,
+    priority: Priority = Priority.DASHBOARD,
+    previous: str | None = None,
+    document_ids: list[int] | None = None,
+) -> str:
     """Generate a department dashboard by feeding all documents into the department-specific dashboard prompt.
 
-    Returns Markdown content. Raises RuntimeError if all models fail.
+    Incremental mode: given the `previous` dashboard and the `document_ids` added since it was
+    built, only those documents are sent and the model updates the previous dashboard. They must
+    fit DASHBOARD_CONTEXT_TOKEN_BUDGET; if the prompt cannot hold all of them next to the previous
+    dashboard, ValueError is raised rather than leaving some out.
+
+    Returns Markdown content. Raises RuntimeError if all models fail
+    (SchedulerRejected, a RuntimeError, if the LLM queue is full).
     """
     dashboard_prompt = get_dashboard_prompt(department)
     if dashboard_prompt is None:
         raise ValueError(f"No dashboard prompt defined for department: {department}")
 
-    context = _fetch_context(db, limit=50)  # pull more docs for the dashboard
+    if previous is not None:
+        context = await _fetch_context_async(
+            db, document_ids=document_ids, token_budget=DASHBOARD_CONTEXT_TOKEN_BUDGET
+        )
+        user_message = (
+            "Below is the current dashboard, followed by the documents added since it was generated. "
+            "Update the dashboard with the new information: keep what is still valid, revise figures "
+            "and statuses the new documents change, and add anything new. Return the complete updated "
+            "dashboard in the same format.\n\n=== CURRENT DASHBOARD ===\n\n" + previous
+        )
+        context_header = "\n\n=== NEW DOCUMENTS ===\n\n"
+    else:
+        context = await _fetch_context_async(
+            db,
+            limit=50,
+            query=dashboard_prompt,
+            top_k=DASHBOARD_TOP_K,
+            token_budget=DASHBOARD_CONTEXT_TOKEN_BUDGET,
+        )
+        user_message = "Generate the dashboard now based on all available documents."
+        context_header = "\n\n=== KNOWLEDGE BASE DOCUMENTS ===\n\n"
+
+    last_error = None
+    async with scheduler.slot(priority):
+        for model in router.candidates():
+            messages, report = assemble_prompt(
+                model,
+                _prompt_budget(model),
+                system_prompt=dashboard_prompt,
+                user_message=user_message,
+                context=context,
+                context_header=context_header,
+            )
+            _check_incremental_fits(previous, report)
+            if not router.acquire(model):
+                continue
+            try:
+                logger.info("Generating dashboard model=%s department=%s", model, department)
+                content = await _ollama_chat(model, messages, report)
+                router.record_success(model)
+                logger.info("Dashboard generated for %s (%d chars)", department, len(content))
+                return content
+            except ollama.ResponseError as e:
+                logger.warning("Dashboard model %s ResponseError: %s", model, e)
+                router.record_failure(model, e)
+                last_error = e
+                continue
+            except Exception as e:
+                logger.error("Dashboard model %s error (%s): %s", model, type(e).__name__, e)
+                router.record_failure(model, e)
+                last_error = e
+                continue
 
-    system_message = (
-        f"{dashboard_prompt}\n\n"
-        "=== KNOWLEDGE BASE DOCUMENTS ===\n\n"
-        f"{context}"
+    raise RuntimeError(
+        f"Failed to generate dashboard. Configured models: {', '.join(router.models)}.{_error_detail(last_error)}"
     )
 
-    messages = [
-        {"role": "system", "content": system_message},
-        {"role": "user", "content": "Generate the dashboard now based on all available documents."},
-    ]
 
-    last_error = None
-    for model in (MODEL, FALLBACK_MODEL):
-        try:
-            logger.info("Generating dashboard model=%s department=%s", model, department)
-            response = ollama.chat(model=model, messages=messages)
-
-            if hasattr(response, "message"):
-                msg = response.message
-                content = msg.content if hasattr(msg, "content") else msg.get("content", "")
-            elif isinstance(response, dict) and "message" in response:
-                content = response["message"]["content"]
-            else:
-                content = str(response)
-
-            logger.info("Dashboard generated for %s (%d chars)", department, len(content))
-            return content
-        except ollama.ResponseError as e:
-            logger.warning("Dashboard model %s ResponseError: %s", model, e)
-            last_error = e
-            continue
-        except Exception as e:
-            logger.error("Dashboard model %s error (%s): %s", model, type(e).__name__, e)
-            last_error = e
-            continue
+def _check_incremental_fits(previous: str | None, report: PromptReport) -> None:
+    """An incremental update must see every new document; raise ValueError if any was trimmed.
 
-    raise RuntimeError(
-        f"Failed to generate dashboard. Tried: {MODEL}, {FALLBACK_MODEL}. "
-        f"Last error: {last_error}"
+    Called before router.acquire, so a refused prompt never holds a half-open breaker's trial.
+    """
+    if previous is not None and report.context_dropped:
+        raise ValueError(
+            f"{report.context_dropped} new document parts do not fit next to the previous dashboard "
+            f"in the {report.model} prompt"
+        )
+
+
+def _charts_instructions(specs: list[dict]) -> str:
+    """Rules and per-chart instructions shared by the chart and structured dashboard prompts."""
+    if not specs:
+        return "There are no charts to generate; return the chart data as an empty object.\n"
+    charts_description = "\n".join(
+        f'{i+1}. "{s["id"]}" ({s["type"]} chart, "{s["title"]}")\n   Instruction: {s["instruction"]}'
+        for i, s in enumerate(specs)
+    )
+    return (
+        "Chart data is a JSON object keyed by chart id; each chart is an array of "
+        '{"label": "<text>", "value": <number>} points.\n\n'
+        "Rules:\n"
+        "- Include every chart listed below, and no others\n"
+        "- If no data is available for a chart, use a single point {\"label\": \"No data\", \"value\": 1}\n"
+        "- Do NOT invent data — only use what is present in the documents\n\n"
+        f"Charts to generate:\n{charts_description}"
     )
 
 
-def _extract_json_from_response(text: str) -> list[dict]:
-    """Best-effort extraction of a JSON array from LLM output (may be wrapped in markdown fences)."""
-    # Try to find a JSON array in the text
-    # First strip markdown code fences
-    cleaned = re.sub(r"```(?:json)?\s*", "", text).strip().rstrip("`")
-    # Find the outermost [ ... ]
-    start = cleaned.find("[")
-    end = cleaned.rfind("]")
-    if start != -1 and end != -1 and end > start:
-        try:
-            return json.loads(cleaned[start : end + 1])
-        except json.JSONDecodeError:
-            pass
-    return []
+def _charts_schema(specs: list[dict]) -> dict:
+    """JSON schema for chart data: one required array of label/value points per chart spec."""
+    point = {
+        "type": "object",
+        "properties": {"label": {"type": "string"}, "value": {"type": "number"}},
+        "required": ["label", "value"],
+        "additionalProperties": False,  # _parse_charts rejects any other key
+    }
+    return {
+        "type": "object",
+        "properties": {s["id"]: {"type": "array", "items": point} for s in specs},
+        "required": [s["id"] for s in specs],
+        "additionalProperties": False,
+    }
+
+
+def _dashboard_schema(specs: list[dict]) -> dict:
+    """JSON schema for the structured dashboard: Markdown plus the chart data of `specs`."""
+    return {
+        "type": "object",
+        "properties": {"markdown": {"type": "string"}, "charts": _charts_schema(specs)},
+        "required": ["markdown", "charts"],
+    }
+
+
+def _parse_charts(specs: list[dict], data) -> list[dict]:
+    """Validate model chart data against `specs` and turn it into the stored chart list.
+
+    Raises ValueError on anything the schema should have prevented (missing or unknown chart
+    ids, malformed points, non-numeric values). Type and title come from the spec.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("chart data is not an object")
+    expected = {s["id"] for s in specs}
+    if set(data) != expected:
+        raise ValueError(
+            f"chart ids do not match the spec (missing {sorted(expected - set(data))}, "
+            f"unexpected {sorted(set(data) - expected)})"
+        )
+    charts = []
+    for spec in specs:
+        points = data[spec["id"]]
+        if not isinstance(points, list):
+            raise ValueError(f"chart {spec['id']} is not an array")
+        labels, values = [], []
+        for point in points:
+            if not isinstance(point, dict) or set(point) != {"label", "value"}:
+                raise ValueError(f"chart {spec['id']} has a malformed point: {point!r}")
+            label, value = point["label"], point["value"]
+            if not isinstance(label, str) or isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f"chart {spec['id']} has a malformed point: {point!r}")
+            labels.append(label)
+            values.append(value)
+        if not points:
+            labels, values = ["No data"], [1]
+        charts.append(
+            {"id": spec["id"], "type": spec["type"], "title": spec["title"], "labels": labels, "values": values}
+        )
+    return charts
+
+
+def _charts_for_prompt(charts_json: str, specs: list[dict]) -> str:
+    """Stored chart list -> the keyed label/value form the model is asked to produce, for `specs` only."""
+    wanted = {s["id"] for s in specs}
+    charts = json.loads(charts_json or "[]")
+    return json.dumps(
+        {
+            c["id"]: [{"label": label, "value": value} for label, value in zip(c["labels"], c["values"])]
+            for c in charts
+            if c["id"] in wanted
+        }
+    )
 
 
-def generate_dashboard_charts(department: str, db: Session) -> str:
+def _ordered_charts(specs: list[dict], *chart_lists) -> list[dict]:
+    """Charts from `chart_lists` in the order of `specs`."""
+    by_id = {c["id"]: c for charts in chart_lists for c in charts}
+    return [by_id[s["id"]] for s in specs if s["id"] in by_id]
+
+
+async def _split_chart_specs(db: Session, specs: list[dict]) -> tuple[list[dict], list[dict]]:
+    """(charts computed from extracted facts, specs that still need the LLM)."""
+    derived = await asyncio.to_thread(derive_charts, db, specs)
+    return list(derived.values()), [s for s in specs if s["id"] not in derived]
+
+
+async def generate_dashboard_charts(
+    department: str,
+    db: Session,
+    priority: Priority = Priority.DASHBOARD,
+    previous: str | None = None,
+    document_ids: list[int] | None = None,
+) -> str:
     """Ask the LLM to extract structured chart data from documents, returning a JSON string.
 
-    Each chart entry: {"id": str, "type": "pie"|"bar", "title": str, "labels": [...], "values": [...]}
-    Returns a JSON string (array). Falls back to "[]" on failure.
+    The model's output is constrained to a JSON schema built from the department's chart specs
+    and validated strictly; each stored chart entry is
+    {"id": str, "type": "pie"|"bar", "title": str, "labels": [...], "values": [...]}.
+    Charts that can be computed from extracted facts (backend.facts) are aggregated with SQL;
+    only the rest are asked of the LLM.
+    Incremental mode works as in generate_dashboard, with `previous` the previous charts JSON.
+    Returns a JSON string (array). Charts the LLM fails to produce are left out.
+    Raises SchedulerRejected if the LLM queue is full, and ValueError as generate_dashboard does.
     """
-    specs = get_chart_specs(department)
-    if not specs:
+    all_specs = get_chart_specs(department)
+    if not all_specs:
         return "[]"
+    derived, specs = await _split_chart_specs(db, all_specs)
+    if not specs:
+        logger.info("All %d charts for %s derived from facts", len(derived), department)
+        return json.dumps(_ordered_charts(all_specs, derived))
+
+    if previous is not None:
+        context = await _fetch_context_async(
+            db, document_ids=document_ids, token_budget=DASHBOARD_CONTEXT_TOKEN_BUDGET
+        )
+        user_message = (
+            "Below is the current chart data, followed by the documents added since it was extracted. "
+            "Update the counts and values with the new documents and return the complete chart data "
+            "now.\n\n=== CURRENT CHART DATA ===\n\n" + _charts_for_prompt(previous, specs)
+        )
+        context_header = "\n\n=== NEW DOCUMENTS ===\n\n"
+    else:
+        context = await _fetch_context_async(
+            db,
+            limit=50,
+            query="\n".join(f'{s["title"]}: {s["instruction"]}' for s in specs),
+            top_k=DASHBOARD_TOP_K,
+            token_budget=DASHBOARD_CONTEXT_TOKEN_BUDGET,
+        )
+        user_message = "Generate the chart data now."
+        context_header = "\n\n=== KNOWLEDGE BASE DOCUMENTS ===\n\n"
+
+    system_prompt = (
+        "You are a data analyst. Extract chart data from the provided documents.\n"
+        "Return ONLY the JSON chart data — no markdown, no explanation, no extra text.\n\n"
+        + _charts_instructions(specs)
+    )
 
-    context = _fetch_context(db, limit=50)
+    async with scheduler.slot(priority):
+        for model in router.candidates():
+            messages, report = assemble_prompt(
+                model,
+                _prompt_budget(model),
+                system_prompt=system_prompt,
+                user_message=user_message,
+                context=context,
+                context_header=context_header,
+            )
+            _check_incremental_fits(previous, report)
+            if not router.acquire(model):
+                continue
+            try:
+                logger.info("Generating charts model=%s department=%s", model, department)
+                raw = await _ollama_chat(model, messages, report, format=_charts_schema(specs))
+                router.record_success(model)
+            except Exception as e:
+                logger.warning("Chart generation model %s error: %s", model, e)
+                router.record_failure(model, e)
+                continue
+
+            # Output is schema-constrained, so a model that answered is not asked again
+            try:
+                charts = _parse_charts(specs, json.loads(raw))
+            except (json.JSONDecodeError, ValueError) as e:
+                logger.warning("Invalid chart data from model %s for %s: %s", model, department, e)
+                break
+            logger.info("Generated %d charts for %s (%d derived from facts)", len(charts), department, len(derived))
+            return json.dumps(_ordered_charts(all_specs, derived, charts))
+
+    logger.warning("Chart generation failed for %s, returning only charts derived from facts", department)
+    return json.dumps(_ordered_charts(all_specs, derived))
+
+
+async def generate_dashboard_structured(
+    department: str,
+    db: Session,
+    priority: Priority = Priority.DASHBOARD,
+    previous: str | None = None,
+    previous_charts: str | None = None,
+    document_ids: list[int] | None = None,
+) -> tuple[str, str]:
+    """Generate the dashboard Markdown and its chart data in one schema-constrained call.
+
+    The context is retrieved and sent once instead of once per part. Charts derivable from
+    extracted facts are aggregated with SQL, as in generate_dashboard_charts. Incremental mode works as
+    in generate_dashboard, with `previous_charts` the previous charts JSON.
+
+    Returns (markdown, charts JSON string). Raises ValueError if the output does not match the
+    schema (or, incremental, as generate_dashboard) and RuntimeError if all models fail; callers then fall back to generate_dashboard
+    plus generate_dashboard_charts.
+    """
+    dashboard_prompt = get_dashboard_prompt(department)
+    if dashboard_prompt is None:
+        raise ValueError(f"No dashboard prompt defined for department: {department}")
+    all_specs = get_chart_specs(department) or []
+    derived, specs = await _split_chart_specs(db, all_specs)
+
+    if previous is not None:
+        context = await _fetch_context_async(
+            db, document_ids=document_ids, token_budget=DASHBOARD_CONTEXT_TOKEN_BUDGET
+        )
+        user_message = (
+            "Below are the current dashboard and chart data, followed by the documents added since they "
+            "were generated. Update both with the new information: keep what is still valid, revise "
+            "figures, statuses and counts the new documents change, and add anything new. Return the "
+            "complete updated dashboard and charts.\n\n=== CURRENT DASHBOARD ===\n\n"
+            + previous
+            + "\n\n=== CURRENT CHART DATA ===\n\n"
+            + _charts_for_prompt(previous_charts, specs)
+        )
+        context_header = "\n\n=== NEW DOCUMENTS ===\n\n"
+    else:
+        context = await _fetch_context_async(
+            db,
+            limit=50,
+            query=dashboard_prompt + "\n" + "\n".join(f'{s["title"]}: {s["instruction"]}' for s in specs),
+            top_k=DASHBOARD_TOP_K,
+            token_budget=DASHBOARD_CONTEXT_TOKEN_BUDGET,
+        )
+        user_message = "Generate the dashboard and its chart data now based on all available documents."
+        context_header = "\n\n=== KNOWLEDGE BASE DOCUMENTS ===\n\n"
+
+    system_prompt = (
+        dashboard_prompt
+        + "\n\nRespond with a JSON object with two fields:\n"
+        '- "markdown": the complete dashboard in the Markdown format described above\n'
+        '- "charts": the chart data described below\n\n'
+        + _charts_instructions(specs)
+    )
 
-    # Build a prompt that describes the expected output format
-    charts_description = "\n".join(
-        f'{i+1}. id="{s["id"]}", type="{s["type"]}", title="{s["title"]}"\n   Instruction: {s["instruction"]}'
-        for i, s in enumerate(specs)
+    last_error = None
+    async with scheduler.slot(priority):
+        for model in router.candidates():
+            messages, report = assemble_prompt(
+                model,
+                _prompt_budget(model),
+                system_prompt=system_prompt,
+                user_message=user_message,
+                context=context,
+                context_header=context_header,
+            )
+            _check_incremental_fits(previous, report)
+            if not router.acquire(model):
+                continue
+            try:
+                logger.info("Generating structured dashboard model=%s department=%s", model, department)
+                raw = await _ollama_chat(model, messages, report, format=_dashboard_schema(specs))
+                router.record_success(model)
+            except Exception as e:
+                logger.warning("Structured dashboard model %s error (%s): %s", model, type(e).__name__, e)
+                router.record_failure(model, e)
+                last_error = e
+                continue
+
+            # The model did answer; output that misses the schema is not retried on another model
+            try:
+                result = json.loads(raw)
+                markdown = result["markdown"]
+                charts = _parse_charts(specs, result["charts"])
+            except (json.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+                raise ValueError(f"Structured dashboard output from {model} is invalid: {e}") from e
+            if not isinstance(markdown, str) or not markdown.strip():
+                raise ValueError(f"Structured dashboard output from {model} has no Markdown")
+            logger.info(
+                "Structured dashboard generated for %s (%d chars, %d charts)", department, len(markdown), len(charts)
+            )
+            return markdown, json.dumps(_ordered_charts(all_specs, derived, charts))
+
+    raise RuntimeError(
+        f"Failed to generate dashboard. Configured models: {', '.join(router.models)}.{_error_detail(last_error)}"
     )
 
-    system_message = (
-        "You are a data analyst. Extract chart data from the provided documents.\n"
-        "Return ONLY a valid JSON array — no markdown, no explanation, no extra text.\n\n"
-        "Each element must have exactly these fields:\n"
-        '  {"id": "<chart_id>", "type": "<pie|bar>", "title": "<chart title>", "labels": ["A","B",...], "values": [1,2,...]}\n\n'
+
+async def extract_document_facts(
+    db: AsyncSession, document_id: int, priority: Priority = Priority.BACKGROUND
+) -> dict:
+    """Extract the structured facts (backend.facts.FACTS_SCHEMA) of one document.
+
+    Only the first FACTS_CONTEXT_TOKEN_BUDGET tokens of a long document are read. Ends db's
+    transaction before generating, so its connection is not held while the model runs.
+    Raises ValueError if the output is not valid JSON and RuntimeError if all models fail.
+    """
+    context = await _fetch_context_async(
+        db, document_ids=[document_id], token_budget=FACTS_CONTEXT_TOKEN_BUDGET
+    )
+    await db.commit()  # release the connection; extraction can take minutes
+    system_prompt = (
+        "You extract structured facts from a company document: the projects, clients, people, "
+        "sales leads/deals and milestones it mentions.\n\n"
         "Rules:\n"
-        "- labels and values arrays must be the same length\n"
-        "- values must be numbers (integers or floats)\n"
-        "- If no data is available for a chart, use labels=[\"No data\"] and values=[1]\n"
-        "- Do NOT invent data — only use what is present in the documents\n\n"
-        f"Charts to generate:\n{charts_description}\n\n"
-        "=== KNOWLEDGE BASE DOCUMENTS ===\n\n"
-        f"{context}"
-    )
-
-    messages = [
-        {"role": "system", "content": system_message},
-        {"role": "user", "content": "Generate the JSON array of chart data now."},
-    ]
-
-    for model in (MODEL, FALLBACK_MODEL):
-        try:
-            logger.info("Generating charts model=%s department=%s", model, department)
-            response = ollama.chat(model=model, messages=messages)
-
-            if hasattr(response, "message"):
-                msg = response.message
-                raw = msg.content if hasattr(msg, "content") else msg.get("content", "")
-            elif isinstance(response, dict) and "message" in response:
-                raw = response["message"]["content"]
-            else:
-                raw = str(response)
-
-            charts = _extract_json_from_response(raw)
-            if charts:
-                logger.info("Generated %d charts for %s", len(charts), department)
-                return json.dumps(charts)
-
-            logger.warning("No valid JSON charts parsed from model %s response", model)
-        except Exception as e:
-            logger.warning("Chart generation model %s error: %s", model, e)
-            continue
-
-    logger.warning("Chart generation failed for %s, returning empty", department)
-    return "[]"
+        "- Only record what the document states; do NOT guess or invent\n"
+        "- Use an empty string for unknown text fields and dates, null for unknown numbers, "
+        '"Unknown" for unknown categories\n'
+        "- Dates as YYYY-MM-DD (YYYY-MM if the day is not given); resolve relative dates against "
+        f"today, {date.today().isoformat()}\n"
+        "- people: one entry per person and project they work on; open_work_items is the number of "
+        "tasks, tickets or stories currently assigned to them\n"
+        "- deals: value is the deal value as a plain number in the document's currency"
+    )
+
+    last_error = None
+    async with scheduler.slot(priority):
+        for model in router.candidates():
+            if not router.acquire(model):
+                continue
+            messages, report = assemble_prompt(
+                model,
+                _prompt_budget(model),
+                system_prompt=system_prompt,
+                user_message="Extract the facts from the document now.",
+                context=context,
+                context_header="\n\n=== DOCUMENT ===\n\n",
+            )
+            try:
+                logger.info("Extracting facts model=%s document_id=%s", model, document_id)
+                raw = await _ollama_chat(model, messages, report, format=FACTS_SCHEMA)
+                router.record_success(model)
+            except Exception as e:
+                logger.warning("Fact extraction model %s error (%s): %s", model, type(e).__name__, e)
+                router.record_failure(model, e)
+                last_error = e
+                continue
+
+            try:
+                data = json.loads(raw)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Fact extraction output from {model} is invalid: {e}") from e
+            if not isinstance(data, dict):
+                raise ValueError(f"Fact extraction output from {model} is not an object")
+            return data
+
+    raise RuntimeError(
+        f"Failed to extract facts. Configured models: {', '.join(router.models)}.{_error_detail(last_error)}"
+    )
+
+
+async def summarize_conversation(
+    department: str, summary: str | None, turns: list[dict], priority: Priority = Priority.BACKGROUND
+) -> str:
+    """Fold `turns` (oldest first) into the running `summary` of a conversation. Returns the new summary.
+
+    Raises ValueError if the output is empty and RuntimeError if all models fail.
+    """
+    system_prompt = (
+        f"You keep a running summary of a conversation between a user and the {department} "
+        "representative of the company.\n\n"
+        "Rules:\n"
+        "- Merge the earlier summary (if any) and the new turns into one updated summary\n"
+        "- Keep the user's questions, goals and preferences, the facts and figures given, and "
+        "any decisions, commitments or open questions\n"
+        "- Leave out greetings and small talk\n"
+        "- Write plain prose of at most 300 words; output only the summary"
+    )
+    transcript = "\n\n".join(f"{turn['role'].upper()}: {turn['content']}" for turn in turns)
+    context = [f"=== EARLIER SUMMARY ===\n\n{summary}"] if summary else []
+    context.append(f"=== NEW TURNS ===\n\n{transcript}")
+
+    last_error = None
+    async with scheduler.slot(priority):
+        for model in router.candidates():
+            messages, report = assemble_prompt(
+                model,
+                _prompt_budget(model),
+                system_prompt=system_prompt,
+                user_message="Write the updated summary now.",
+                context=context,
+                context_header="\n\n",
+            )
+            # Checked before acquiring, so a refused prompt never holds a half-open breaker's trial
+            if report.context_dropped:
+                raise ValueError(f"Conversation turns do not fit the {model} context window")
+            if not router.acquire(model):
+                continue
+            try:
+                logger.info("Summarizing %d conversation turns model=%s department=%s", len(turns), model, department)
+                content = (await _ollama_chat(model, messages, report)).strip()
+                router.record_success(model)
+            except Exception as e:
+                logger.warning("Summary model %s error (%s): %s", model, type(e).__name__, e)
+                router.record_failure(model, e)
+                last_error = e
+                continue
+            if not content:
+                raise ValueError(f"Summary output from {model} is empty")
+            return content
+
+    raise RuntimeError(
+        f"Failed to summarize the conversation. Configured models: {', '.join(router.models)}."
+        f"{_error_detail(last_error)}"
+    )
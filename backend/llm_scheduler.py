@@ -0,0 +1,201 @@
+"""Priority scheduler in front of every Ollama generation.
+
+Ollama runs one (or a few) generations at a time, so requests are admitted through a
+bounded, prioritised queue:
+
+- INTERACTIVE (chat) is always served first and may use every slot,
+- DASHBOARD (on-demand dashboard generation) and BACKGROUND (pre-generation, ingest
+  extraction) are capped so interactive traffic always finds a free slot.
+
+When the queue is full, callers are rejected immediately with QueueFullError rather than
+piling up; a caller that waits longer than the queue timeout gets QueueTimeoutError.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from enum import IntEnum
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Request classes, highest priority first."""
+
+    INTERACTIVE = 0
+    DASHBOARD = 1
+    BACKGROUND = 2
+
+
+class SchedulerRejected(RuntimeError):
+    """Base class for requests the scheduler refused to run."""
+
+
+class QueueFullError(SchedulerRejected):
+    """The wait queue is at capacity (maps to HTTP 429)."""
+
+
+class QueueTimeoutError(SchedulerRejected):
+    """The request waited longer than the queue timeout (maps to HTTP 503)."""
+
+
+class LLMScheduler:
+    """Bounded priority queue with a global and a per-class concurrency limit."""
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        class_limits: dict[Priority, int],
+        max_queue_depth: int,
+        queue_timeout: float,
+    ):
+        self.max_concurrency = max_concurrency
+        self.class_limits = {p: min(class_limits.get(p, max_concurrency), max_concurrency) for p in Priority}
+        self.max_queue_depth = max_queue_depth
+        self.queue_timeout = queue_timeout
+
+        self._running = {p: 0 for p in Priority}
+        self._waiters: dict[Priority, deque[asyncio.Future]] = {p: deque() for p in Priority}
+        self._completed = {p: 0 for p in Priority}
+        self._rejected = {p: 0 for p in Priority}
+        self._timed_out = {p: 0 for p in Priority}
+        self._wait_times: dict[Priority, deque[float]] = {p: deque(maxlen=200) for p in Priority}
+
+    @classmethod
+    def from_env(cls) -> "LLMScheduler":
+        total = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+        return cls(
+            max_concurrency=total,
+            class_limits={
+                Priority.INTERACTIVE: total,
+                Priority.DASHBOARD: int(os.getenv("LLM_DASHBOARD_CONCURRENCY", str(max(1, total // 2)))),
+                Priority.BACKGROUND: int(os.getenv("LLM_BACKGROUND_CONCURRENCY", "1")),
+            },
+            max_queue_depth=int(os.getenv("LLM_QUEUE_MAX_DEPTH", "64")),
+            queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "120")),
+        )
+
+    # ---- admission ----
+
+    def _queued(self) -> int:
+        return sum(len(q) for q in self._waiters.values())
+
+    def _can_run(self, priority: Priority) -> bool:
+        return (
+            sum(self._running.values()) < self.max_concurrency
+            and self._running[priority] < self.class_limits[priority]
+        )
+
+    def check_capacity(self, priority: Priority) -> None:
+        """Raise QueueFullError now if a request of this class would be rejected."""
+        if not self._can_run(priority) and self._queued() >= self.max_queue_depth:
+            self._rejected[priority] += 1
+            raise QueueFullError(
+                f"LLM queue is full ({self.max_queue_depth} waiting); try again shortly"
+            )
+
+    def _try_acquire(self, priority: Priority) -> bool:
+        # Run immediately only if no equal-or-higher priority request is already waiting
+        ahead = any(self._waiters[p] for p in Priority if p <= priority)
+        if not ahead and self._can_run(priority):
+            self._running[priority] += 1
+            self._wait_times[priority].append(0.0)
+            return True
+        return False
+
+    async def _acquire(self, priority: Priority) -> None:
+        if self._try_acquire(priority):
+            return
+
+        self.check_capacity(priority)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[priority].append(future)
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._abandon(priority, future)
+            self._timed_out[priority] += 1
+            raise QueueTimeoutError(f"Waited more than {self.queue_timeout:.0f}s for an LLM slot")
+        except asyncio.CancelledError:
+            self._abandon(priority, future)
+            raise
+        self._wait_times[priority].append(time.monotonic() - started)
+
+    def _abandon(self, priority: Priority, future: asyncio.Future) -> None:
+        """Drop a waiter that gave up; hand its slot on if it had been granted one meanwhile."""
+        if future.done() and not future.cancelled():
+            self._release(priority)
+        else:
+            future.cancel()
+            try:
+                self._waiters[priority].remove(future)
+            except ValueError:
+                pass
+
+    def _release(self, priority: Priority) -> None:
+        self._running[priority] -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Grant free slots to waiters, highest priority class first."""
+        for priority in Priority:
+            queue = self._waiters[priority]
+            while queue and self._can_run(priority):
+                future = queue.popleft()
+                if future.done():
+                    continue
+                self._running[priority] += 1
+                future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority):
+        """Hold one generation slot of the given class for the duration of the block."""
+        await self._acquire(priority)
+        try:
+            yield
+        finally:
+            self._completed[priority] += 1
+            self._release(priority)
+
+    @asynccontextmanager
+    async def slot_if_free(self, priority: Priority):
+        """Like slot(), but raise QueueFullError at once instead of waiting for a slot."""
+        if not self._try_acquire(priority):
+            raise QueueFullError(f"No free {priority.name.lower()} LLM slot")
+        try:
+            yield
+        finally:
+            self._completed[priority] += 1
+            self._release(priority)
+
+    # ---- metrics ----
+
+    def stats(self) -> dict:
+        """Queue depth, running counts and wait-time percentiles per class."""
+        classes = {}
+        for p in Priority:
+            waits = sorted(self._wait_times[p])
+            classes[p.name.lower()] = {
+                "limit": self.class_limits[p],
+                "running": self._running[p],
+                "queued": len(self._waiters[p]),
+                "completed": self._completed[p],
+                "rejected": self._rejected[p],
+                "timed_out": self._timed_out[p],
+                "wait_p50_seconds": round(waits[len(waits) // 2], 3) if waits else None,
+                "wait_p95_seconds": round(waits[int(len(waits) * 0.95)], 3) if waits else None,
+            }
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue_depth": self.max_queue_depth,
+            "running": sum(self._running.values()),
+            "queued": self._queued(),
+            "classes": classes,
+        }
+
+
+scheduler = LLMScheduler.from_env()
@@ -1,26 +1,41 @@
 """FastAPI application – API endpoints for the Virtual Representatives system."""
 
+import asyncio
+import json
 import logging
 import os
-from datetime import date, datetime
 from urllib.parse import urlencode
 
+import anyio
 from fastapi import Depends, FastAPI, File, HTTPException, Query, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, StreamingResponse
 from pydantic import BaseModel, Field
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from backend import conversations, facts, ingestion, vector_index
 from backend.auth import (
     create_jwt_token,
     get_current_user,
     get_google_oauth_flow,
     get_or_create_user,
 )
-from backend.database import get_db, init_db
-from backend.document_processor import extract_text, store_document
-from backend.llm import chat as llm_chat, generate_dashboard, generate_dashboard_charts
-from shared.models import ConversationMessage, DashboardSnapshot, Document, User
+from backend.dashboard_jobs import PREGENERATE_ENABLED, pregenerator
+from backend.dashboards import get_snapshot as get_dashboard_snapshot
+from backend.dashboards import regenerate_snapshot as regenerate_dashboard_snapshot
+from backend.database import AsyncSessionLocal, async_engine, get_db, init_db
+from backend.document_processor import delete_document as remove_document
+from backend.hedging import hedger
+from backend.llm import (
+    chat as llm_chat,
+    chat_stream as llm_chat_stream,
+    close_client as close_llm_client,
+    get_client as get_llm_client,
+    router as model_router,
+)
+from backend.llm_scheduler import Priority, QueueFullError, scheduler
+from shared.models import Document, User
 from shared.personas import list_departments
 
 logging.basicConfig(level=logging.INFO)
@@ -54,10 +69,15 @@ tags_metadata = [
         "Dashboards are cached once per day; use the regenerate endpoint to force a refresh. "
         "All endpoints require a valid Bearer token.",
     },
+    {
+        "name": "Admin",
+        "description": "Operational state of the LLM layer (queue depth, concurrency, model routing). "
+        "All endpoints require a valid Bearer token.",
+    },
     {
         "name": "Chat",
         "description": "Converse with a department representative powered by Ollama. "
-        "Conversation history is persisted per user per department. "
+        "Conversation history is persisted per user, department and conversation, and read back in pages. "
         "All endpoints require a valid Bearer token.",
     },
 ]
@@ -80,6 +100,9 @@ app = FastAPI(
     openapi_tags=tags_metadata,
 )
 
+# Cap upload sizes; added before CORS so CORS headers are set on its 413 responses too
+app.add_middleware(ingestion.UploadLimitMiddleware)
+
 # Allow the Streamlit frontend to call this API
 app.add_middleware(
     CORSMiddleware,
@@ -90,29 +113,62 @@ app.add_middleware(
 )
 
 
+_background_tasks: list[asyncio.Task] = []
+
+
 @app.on_event("startup")
-def on_startup():
+async def on_startup():
     init_db()
+    # Embedding a large backlog of chunks can take a while; serve keyword retrieval meanwhile
+    _background_tasks.append(asyncio.create_task(asyncio.to_thread(vector_index.backfill)))
+    # First probe runs right away, so a missing model is skipped from the first request on
+    _background_tasks.append(asyncio.create_task(model_router.run_probes(get_llm_client())))
+    ingestion.resume_pending()
+    if facts.FACTS_ENABLED:
+        _background_tasks.append(asyncio.create_task(facts.run()))
+    if PREGENERATE_ENABLED:
+        _background_tasks.append(asyncio.create_task(pregenerator.run()))
+    if conversations.SUMMARY_ENABLED:
+        _background_tasks.append(asyncio.create_task(conversations.run()))
     logger.info("Backend started")
 
 
+@app.on_event("shutdown")
+async def on_shutdown():
+    for task in _background_tasks:
+        task.cancel()
+    ingestion.shutdown()
+    await close_llm_client()
+    await async_engine.dispose()
+
+
 # --------------- Pydantic schemas ---------------
 
 class ChatRequest(BaseModel):
     """Payload for sending a message to a department representative."""
     department: str = Field(..., description="Department name (e.g. Engineering, Sales, C-level)")
     message: str = Field(..., description="The user's message / question")
-    history: list[dict] | None = Field(None, description="Prior conversation turns for context")
+    conversation_id: str | None = Field(
+        None, max_length=64, description="Conversation to continue; omit for the department's default conversation"
+    )
+    history: list[dict] | None = Field(
+        None,
+        deprecated=True,
+        description="Ignored: the server loads the conversation's recent turns from the stored history",
+    )
 
 
 class ChatResponse(BaseModel):
     """Response from a department representative."""
     department: str
+    conversation_id: str | None
     reply: str
 
 
 class ChatMessageOut(BaseModel):
     """A single persisted chat message."""
+    id: int = Field(..., description="Pass the oldest id of a page as `before_id` to get the page before it")
+    conversation_id: str | None
     role: str = Field(..., description="'user' or 'assistant'")
     content: str
 
@@ -125,6 +181,28 @@ class DocumentOut(BaseModel):
     upload_date: str | None
     tags: str
     metadata: str
+    duplicate_of: int | None = Field(
+        None,
+        description="Set if this is a copy of that document, or a near-copy it replaced; "
+        "it is then not used for answers or dashboards",
+    )
+
+
+class IngestionJobOut(BaseModel):
+    """Progress of an uploaded file through parsing and indexing."""
+    id: int
+    filename: str
+    status: str = Field(..., description="queued, parsing, indexing, done or failed")
+    error: str | None = None
+    document_id: int | None = Field(None, description="The stored document, once done")
+    documents_added: int | None = Field(
+        None, description="Documents added, once done (an archive may add many; 0 if the file was already stored)"
+    )
+    stats: dict | None = Field(
+        None, description="Parse statistics; for a PDF: pages, pages_cached, extract_seconds, slowest_pages"
+    )
+    created_at: str
+    finished_at: str | None = None
 
 
 class DepartmentOut(BaseModel):
@@ -135,12 +213,14 @@ class DepartmentOut(BaseModel):
 
 
 class DashboardOut(BaseModel):
-    """A daily dashboard snapshot for a department."""
+    """A cached dashboard snapshot for a department."""
     department: str
     content: str = Field(..., description="Markdown-formatted dashboard content")
     charts_json: str = Field(..., description="JSON array of chart data objects")
     generated_date: str
     generated_at: str
+    kb_version: int | None = Field(None, description="Knowledge-base version the dashboard was built from")
+    spec_version: str | None = Field(None, description="Fingerprint of the dashboard prompt and chart specs")
 
 
 class UserOut(BaseModel):
@@ -220,24 +300,26 @@ def google_login():
     "generates a JWT, and redirects to the Streamlit frontend with `?token=<jwt>`.",
     responses={302: {"description": "Redirect to Streamlit with JWT"}},
 )
-def google_callback(
+async def google_callback(
     code: str = Query(..., description="Authorization code from Google"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     flow = get_google_oauth_flow()
-    flow.fetch_token(code=code)
+    # Both calls go to Google over blocking HTTP
+    await asyncio.to_thread(flow.fetch_token, code=code)
 
     credentials = flow.credentials
     from google.oauth2 import id_token as google_id_token
     from google.auth.transport.requests import Request as GoogleRequest
 
-    id_info = google_id_token.verify_oauth2_token(
+    id_info = await asyncio.to_thread(
+        google_id_token.verify_oauth2_token,
         credentials.id_token,
         GoogleRequest(),
         flow.client_config["client_id"],
     )
 
-    user = get_or_create_user(
+    user = await get_or_create_user(
         db,
         google_id=id_info["sub"],
         email=id_info["email"],
@@ -284,8 +366,8 @@ def auth_logout():
     description="Returns all uploaded knowledge-base documents, newest first.",
     responses={401: {"description": "Not authenticated"}},
 )
-def get_documents(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    docs = db.query(Document).order_by(Document.upload_date.desc()).all()
+async def get_documents(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    docs = (await db.scalars(select(Document).order_by(Document.upload_date.desc()))).all()
     return [d.to_dict() for d in docs]
 
 
@@ -297,30 +379,36 @@ def get_documents(db: Session = Depends(get_db), current_user: User = Depends(ge
     description="Permanently removes a document from the knowledge base by its ID.",
     responses={401: {"description": "Not authenticated"}, 404: {"description": "Document not found"}},
 )
-def delete_document(
+async def delete_document(
     doc_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    doc = db.query(Document).filter(Document.id == doc_id).first()
+    doc = await db.get(Document, doc_id)
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
-    db.delete(doc)
-    db.commit()
+    await db.run_sync(lambda session: remove_document(session, doc))
+    pregenerator.notify_documents_changed()
     return {"detail": "Document deleted"}
 
 
 @app.post(
     "/upload/document",
     tags=["Documents"],
-    response_model=DocumentOut,
+    status_code=202,
+    response_model=IngestionJobOut,
     summary="Upload a document",
-    description="Upload a `.txt`, `.md`, or `.pdf` file. The content is extracted and stored in the knowledge base.",
-    responses={400: {"description": "Unsupported file type or parse error"}, 401: {"description": "Not authenticated"}},
+    description="Upload a `.txt`, `.md`, or `.pdf` file. The file is queued for parsing and indexing "
+    "in the background; poll `/documents/jobs/{job_id}` until its status is `done` or `failed`. "
+    "Files larger than `UPLOAD_MAX_BYTES` are rejected.",
+    responses={
+        400: {"description": "Unsupported file type"},
+        401: {"description": "Not authenticated"},
+        413: {"description": "File too large"},
+    },
 )
 async def upload_document(
     file: UploadFile = File(..., description="Text, Markdown, or PDF file"),
-    db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
     allowed_extensions = (".txt", ".md", ".pdf")
@@ -330,105 +418,170 @@ async def upload_document(
             detail=f"Unsupported file type. Allowed: {', '.join(allowed_extensions)}",
         )
 
-    content_bytes = await file.read()
-    try:
-        text = extract_text(file.filename, content_bytes)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Failed to parse file: {e}")
+    return await ingestion.enqueue(file)
 
-    doc = store_document(db, title=file.filename, content=text)
-    return doc.to_dict()
+
+@app.post(
+    "/upload/archive",
+    tags=["Documents"],
+    status_code=202,
+    response_model=IngestionJobOut,
+    summary="Bulk-import a zip archive",
+    description="Upload a `.zip` of `.txt`, `.md` and `.pdf` files. They are parsed in parallel and "
+    "stored in batches by one background job; poll `/documents/jobs/{job_id}` for its status. "
+    "Once `done`, `documents_added` is the number imported and `error` lists any skipped files.",
+    responses={
+        400: {"description": "Not a zip file"},
+        401: {"description": "Not authenticated"},
+        413: {"description": "File too large"},
+    },
+)
+async def upload_archive(
+    file: UploadFile = File(..., description="Zip archive of text, Markdown, or PDF files"),
+    current_user: User = Depends(get_current_user),
+):
+    if not file.filename or not file.filename.lower().endswith(".zip"):
+        raise HTTPException(status_code=400, detail="Unsupported file type. Allowed: .zip")
+    return await ingestion.enqueue(file)
+
+
+@app.get(
+    "/documents/jobs/{job_id}",
+    tags=["Documents"],
+    response_model=IngestionJobOut,
+    summary="Get upload status",
+    description="Status of a document upload. Once `done`, `document_id` is the stored document; "
+    "if `failed`, `error` says why.",
+    responses={401: {"description": "Not authenticated"}, 404: {"description": "Job not found"}},
+)
+def get_ingestion_job(job_id: int, current_user: User = Depends(get_current_user)):
+    job = ingestion.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Ingestion job not found")
+    return job
 
 
 # --------------- Dashboard endpoints ---------------
 
+def _queue_full(e: QueueFullError) -> HTTPException:
+    """429 for a request the LLM scheduler turned away."""
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+
+
 @app.get(
     "/dashboard/{department}",
     tags=["Dashboard"],
     response_model=DashboardOut,
     summary="Get department dashboard",
-    description="Returns today's cached dashboard for the given department. "
-    "If no dashboard has been generated today, it is created on the fly (may take up to 60 seconds). "
+    description="Returns the cached dashboard for the given department. "
+    "It is regenerated only when documents have been added or removed, or the department's "
+    "dashboard prompt changed, since it was built (may take up to 60 seconds); "
+    "concurrent requests for the same dashboard share a single generation. "
     "The response includes Markdown content and a JSON array of chart data.",
-    responses={401: {"description": "Not authenticated"}, 503: {"description": "LLM unavailable"}},
+    responses={
+        401: {"description": "Not authenticated"},
+        429: {"description": "LLM queue full"},
+        503: {"description": "LLM unavailable"},
+    },
 )
-def get_dashboard(
+async def get_dashboard(
     department: str,
-    db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    today = date.today()
-    snapshot = (
-        db.query(DashboardSnapshot)
-        .filter(
-            DashboardSnapshot.department == department,
-            DashboardSnapshot.generated_date == today,
-        )
-        .first()
-    )
-
-    if snapshot:
-        return snapshot.to_dict()
-
     try:
-        content = generate_dashboard(department, db)
+        return await get_dashboard_snapshot(department)
+    except QueueFullError as e:
+        raise _queue_full(e)
     except (ValueError, RuntimeError) as e:
         raise HTTPException(status_code=503, detail=str(e))
 
-    charts_json = generate_dashboard_charts(department, db)
-
-    snapshot = DashboardSnapshot(
-        department=department, content=content, charts_json=charts_json, generated_date=today,
-    )
-    db.add(snapshot)
-    db.commit()
-    db.refresh(snapshot)
-    return snapshot.to_dict()
-
 
 @app.post(
     "/dashboard/{department}/regenerate",
     tags=["Dashboard"],
     response_model=DashboardOut,
     summary="Regenerate department dashboard",
-    description="Force-regenerates today's dashboard for the given department, "
-    "replacing any previously cached version. Useful after uploading new documents.",
-    responses={401: {"description": "Not authenticated"}, 503: {"description": "LLM unavailable"}},
+    description="Force-regenerates the dashboard for the given department, "
+    "replacing any previously cached version.",
+    responses={
+        401: {"description": "Not authenticated"},
+        429: {"description": "LLM queue full"},
+        503: {"description": "LLM unavailable"},
+    },
 )
-def regenerate_dashboard(
+async def regenerate_dashboard(
     department: str,
-    db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
     try:
-        content = generate_dashboard(department, db)
+        return await regenerate_dashboard_snapshot(department)
+    except QueueFullError as e:
+        raise _queue_full(e)
     except (ValueError, RuntimeError) as e:
         raise HTTPException(status_code=503, detail=str(e))
 
-    charts_json = generate_dashboard_charts(department, db)
 
-    today = date.today()
-    existing = (
-        db.query(DashboardSnapshot)
-        .filter(
-            DashboardSnapshot.department == department,
-            DashboardSnapshot.generated_date == today,
-        )
-        .first()
-    )
-    if existing:
-        existing.content = content
-        existing.charts_json = charts_json
-        existing.generated_at = datetime.utcnow()
-    else:
-        existing = DashboardSnapshot(
-            department=department, content=content, charts_json=charts_json, generated_date=today,
-        )
-        db.add(existing)
+# --------------- Admin endpoints ---------------
+
+@app.get(
+    "/admin/llm/scheduler",
+    tags=["Admin"],
+    summary="LLM scheduler state",
+    description="Per-priority-class concurrency limits, running and queued requests, "
+    "rejections, and queue wait-time percentiles for this worker.",
+    responses={401: {"description": "Not authenticated"}},
+)
+def get_llm_scheduler_stats(current_user: User = Depends(get_current_user)):
+    return scheduler.stats()
+
+
+@app.get(
+    "/admin/models",
+    tags=["Admin"],
+    summary="Model routing state",
+    description="Circuit-breaker state (`closed`, `open`, `half_open`), probe results and "
+    "success/failure counts for the primary and fallback models, plus the current routing order.",
+    responses={401: {"description": "Not authenticated"}},
+)
+def get_model_routing(current_user: User = Depends(get_current_user)):
+    return model_router.state()
 
-    db.commit()
-    db.refresh(existing)
-    return existing.to_dict()
+
+@app.get(
+    "/admin/llm/hedging",
+    tags=["Admin"],
+    summary="Hedged request metrics",
+    description="Whether hedging is enabled for `/chat`, the current first-token deadline, "
+    "and how often hedges were fired and won.",
+    responses={401: {"description": "Not authenticated"}},
+)
+def get_hedging_stats(current_user: User = Depends(get_current_user)):
+    return hedger.stats()
+
+
+@app.get(
+    "/admin/dashboard/jobs",
+    tags=["Admin"],
+    summary="Dashboard pre-generation jobs",
+    description="Schedule of the background dashboard pre-generation (daily run time, pending "
+    "document-change run) and the state, attempts and last error of each department's job.",
+    responses={401: {"description": "Not authenticated"}},
+)
+def get_dashboard_jobs(current_user: User = Depends(get_current_user)):
+    return pregenerator.status()
+
+
+@app.get(
+    "/admin/ingestion",
+    tags=["Admin"],
+    summary="Document ingestion metrics",
+    description="Upload size limit, in-flight uploads and their bytes received so far, accepted and "
+    "oversized (rejected) uploads on this worker, ingestion jobs by status, and PDF page "
+    "extraction counters (pages extracted vs. served from the page cache, slow pages).",
+    responses={401: {"description": "Not authenticated"}},
+)
+def get_ingestion_stats(current_user: User = Depends(get_current_user)):
+    return ingestion.stats()
 
 
 # --------------- Chat endpoints ---------------
@@ -439,25 +592,101 @@ def regenerate_dashboard(
     response_model=ChatResponse,
     summary="Send a message to a representative",
     description="Sends a user message to the specified department's AI representative. "
-    "The message and reply are persisted to the conversation history. "
-    "Prior conversation turns can be passed in `history` for context.",
-    responses={401: {"description": "Not authenticated"}, 503: {"description": "LLM unavailable"}},
+    "The conversation's recent turns are loaded from the stored history for context; "
+    "the message and reply are then added to it.",
+    responses={
+        401: {"description": "Not authenticated"},
+        429: {"description": "LLM queue full"},
+        503: {"description": "LLM unavailable"},
+    },
 )
-def chat_endpoint(
+async def chat_endpoint(
     req: ChatRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
+    history = await conversations.recent_turns(db, current_user.id, req.department, req.conversation_id)
     try:
-        reply = llm_chat(req.department, req.message, db, history=req.history)
+        # Ends `db`'s transaction before generating, so the connection is not held meanwhile
+        reply = await llm_chat(req.department, req.message, db, history=history)
+    except QueueFullError as e:
+        raise _queue_full(e)
     except RuntimeError as e:
         raise HTTPException(status_code=503, detail=str(e))
 
-    db.add(ConversationMessage(user_id=current_user.id, department=req.department, role="user", content=req.message))
-    db.add(ConversationMessage(user_id=current_user.id, department=req.department, role="assistant", content=reply))
-    db.commit()
+    async with AsyncSessionLocal() as save_db:
+        await conversations.save_exchange(
+            save_db, current_user.id, req.department, req.conversation_id, req.message, reply
+        )
+
+    return {"department": req.department, "conversation_id": req.conversation_id, "reply": reply}
 
-    return {"department": req.department, "reply": reply}
+
+def _sse(event: str, data: dict) -> str:
+    """Format one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post(
+    "/chat/stream",
+    tags=["Chat"],
+    summary="Stream a reply from a representative",
+    description="Same as `POST /chat`, but the reply is streamed as Server-Sent Events while it is generated. "
+    "Events: `token` (`{\"token\": str}`) for each text delta, then either `done` (`{\"reply\": str}`) "
+    "or `error` (`{\"detail\": str, \"partial\": bool}`). "
+    "The exchange is persisted once the stream ends; an interrupted reply is persisted with what was generated.",
+    responses={
+        200: {"content": {"text/event-stream": {}}, "description": "Stream of Server-Sent Events"},
+        401: {"description": "Not authenticated"},
+        429: {"description": "LLM queue full"},
+    },
+)
+async def chat_stream_endpoint(
+    req: ChatRequest,
+    current_user: User = Depends(get_current_user),
+):
+    # Reject before the stream starts, while a proper status code can still be sent
+    try:
+        scheduler.check_capacity(Priority.INTERACTIVE)
+    except QueueFullError as e:
+        raise _queue_full(e)
+
+    user_id = current_user.id
+
+    async def event_stream():
+        # The stream outlives the request-scoped session. Its reads use a session of its own,
+        # whose transaction llm_chat_stream ends before generating; the save opens another.
+        parts: list[str] = []
+        try:
+            try:
+                async with AsyncSessionLocal() as db:
+                    history = await conversations.recent_turns(db, user_id, req.department, req.conversation_id)
+                    async for token in llm_chat_stream(req.department, req.message, db, history=history):
+                        parts.append(token)
+                        yield _sse("token", {"token": token})
+            except (ValueError, RuntimeError) as e:
+                yield _sse("error", {"detail": str(e), "partial": bool(parts)})
+            except Exception:
+                # Every stream ends with a terminal event
+                logger.exception("Chat stream failed")
+                yield _sse("error", {"detail": "Internal error while generating the reply", "partial": bool(parts)})
+            else:
+                yield _sse("done", {"reply": "".join(parts)})
+        finally:
+            # Runs on completion, on errors and when the client disconnects mid-stream. In the
+            # last case the stream's task is already cancelled, so shield the save from it.
+            if parts:
+                with anyio.CancelScope(shield=True):
+                    async with AsyncSessionLocal() as db:
+                        await conversations.save_exchange(
+                            db, user_id, req.department, req.conversation_id, req.message, "".join(parts)
+                        )
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.get(
@@ -465,23 +694,22 @@ def chat_endpoint(
     tags=["Chat"],
     response_model=list[ChatMessageOut],
     summary="Get conversation history",
-    description="Returns the full conversation history for the current user and department, ordered oldest first.",
+    description="Returns one page of a conversation for the current user and department, ordered oldest first: "
+    "the latest `limit` messages, or with `before_id` the `limit` messages before that one. "
+    "To page back, pass the first message's id as `before_id`; a page shorter than `limit` is the last.",
     responses={401: {"description": "Not authenticated"}},
 )
-def get_chat_history(
+async def get_chat_history(
     department: str = Query(..., description="Department name"),
-    db: Session = Depends(get_db),
+    conversation_id: str | None = Query(None, max_length=64, description="Conversation; omit for the default one"),
+    before_id: int | None = Query(None, description="Return messages older than this message id"),
+    limit: int = Query(
+        conversations.HISTORY_PAGE_SIZE, ge=1, le=conversations.MAX_HISTORY_PAGE_SIZE, description="Page size"
+    ),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    messages = (
-        db.query(ConversationMessage)
-        .filter(
-            ConversationMessage.user_id == current_user.id,
-            ConversationMessage.department == department,
-        )
-        .order_by(ConversationMessage.created_at.asc())
-        .all()
-    )
+    messages = await conversations.history_page(db, current_user.id, department, conversation_id, before_id, limit)
     return [m.to_dict() for m in messages]
 
 
@@ -490,17 +718,15 @@ def get_chat_history(
     tags=["Chat"],
     response_model=DetailOut,
     summary="Clear conversation history",
-    description="Deletes all conversation messages for the current user and department.",
+    description="Deletes one conversation of the current user with a department, "
+    "or without `conversation_id` all of their conversations with it.",
     responses={401: {"description": "Not authenticated"}},
 )
-def delete_chat_history(
+async def delete_chat_history(
     department: str = Query(..., description="Department name"),
-    db: Session = Depends(get_db),
+    conversation_id: str | None = Query(None, max_length=64, description="Conversation; omit for all of them"),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    db.query(ConversationMessage).filter(
-        ConversationMessage.user_id == current_user.id,
-        ConversationMessage.department == department,
-    ).delete()
-    db.commit()
+    await conversations.clear(db, current_user.id, department, conversation_id)
     return {"detail": f"History cleared for {department}"}
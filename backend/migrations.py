@@ -0,0 +1,135 @@
+"""Versioned schema migrations.
+
+Each migration runs once per database, in order, and is recorded in `schema_migrations`.
+init_db creates missing tables from the models first, so on a new database a migration finds
+its columns and indexes already there: every step must be idempotent. To change the schema,
+update the model and append a migration here; never edit or renumber one that has shipped.
+"""
+
+import logging
+from collections.abc import Callable
+from datetime import datetime
+
+from sqlalchemy import DateTime, Integer, LargeBinary, String, Text, insert, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.types import TypeEngine
+
+from shared.models import SchemaMigration
+
+logger = logging.getLogger(__name__)
+
+
+def _add_column(conn: Connection, table: str, column: str, col_type: TypeEngine, constraints: str = "") -> None:
+    if column in {c["name"] for c in inspect(conn).get_columns(table)}:
+        return
+    col_sql = f"{col_type.compile(dialect=conn.dialect)} {constraints}".strip()
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {col_sql}"))
+
+
+def _create_index(conn: Connection, name: str, table: str, columns: list[str], unique: bool = False) -> None:
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    conn.execute(text(f"CREATE {kind} IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"))
+
+
+def _added_columns(conn: Connection) -> None:
+    # Columns added to existing tables before migrations were versioned
+    _add_column(conn, "dashboard_snapshots", "charts_json", Text(), "NOT NULL DEFAULT '[]'")
+    _add_column(conn, "dashboard_snapshots", "kb_version", Integer())
+    _add_column(conn, "dashboard_snapshots", "spec_version", String(64))
+    _add_column(conn, "dashboard_snapshots", "document_ids", Text())
+    _add_column(conn, "documents", "facts_extracted_at", DateTime())
+    _add_column(conn, "ingestion_jobs", "documents_added", Integer())
+    _add_column(conn, "ingestion_jobs", "stats", Text())
+    _add_column(conn, "documents", "content_hash", String(64))
+    _add_column(conn, "documents", "minhash", LargeBinary())
+    _add_column(conn, "documents", "duplicate_of", Integer(), "REFERENCES documents(id) ON DELETE SET NULL")
+    _create_index(conn, "ix_documents_content_hash", "documents", ["content_hash"])
+
+
+def _unique_snapshot_per_day(conn: Connection) -> None:
+    # Snapshot writes upsert against this index; drop older duplicates left from before it existed
+    conn.execute(text(
+        "DELETE FROM dashboard_snapshots WHERE id NOT IN ("
+        "SELECT MAX(id) FROM dashboard_snapshots GROUP BY department, generated_date)"
+    ))
+    _create_index(
+        conn, "uq_dashboard_snapshots_department_date", "dashboard_snapshots",
+        ["department", "generated_date"], unique=True,
+    )
+
+
+def _kb_version_row(conn: Connection) -> None:
+    # The knowledge-base version counter is a single row that is only ever updated
+    if not conn.execute(text("SELECT 1 FROM kb_version WHERE id = 1")).first():
+        conn.execute(text("INSERT INTO kb_version (id, version) VALUES (1, 0)"))
+
+
+def _chat_history_index(conn: Connection) -> None:
+    _create_index(
+        conn, "ix_conversation_messages_user_department_created", "conversation_messages",
+        ["user_id", "department", "created_at"],
+    )
+
+
+def _document_date_indexes(conn: Connection) -> None:
+    _create_index(conn, "ix_documents_upload_date", "documents", ["upload_date"])
+    # Replaces the single-column index: also serves "non-duplicates, newest first"
+    _create_index(conn, "ix_documents_duplicate_of_upload_date", "documents", ["duplicate_of", "upload_date"])
+    conn.execute(text("DROP INDEX IF EXISTS ix_documents_duplicate_of"))
+
+
+def _conversation_ids(conn: Connection) -> None:
+    _add_column(conn, "conversation_messages", "conversation_id", String(64))
+    # History is now paged and read by message id within a conversation
+    _create_index(
+        conn, "ix_conversation_messages_conversation", "conversation_messages",
+        ["user_id", "department", "conversation_id", "id"],
+    )
+    conn.execute(text("DROP INDEX IF EXISTS ix_conversation_messages_user_department_created"))
+
+
+def _current_snapshot_index(conn: Connection) -> None:
+    _create_index(
+        conn, "ix_dashboard_snapshots_current", "dashboard_snapshots",
+        ["department", "kb_version", "spec_version", "generated_at"],
+    )
+
+
+# (version, name, migration), applied in order
+MIGRATIONS: list[tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "add columns to existing tables", _added_columns),
+    (2, "unique dashboard snapshot per department and day", _unique_snapshot_per_day),
+    (3, "knowledge-base version row", _kb_version_row),
+    (4, "conversation_messages (user_id, department, created_at) index", _chat_history_index),
+    (5, "documents upload_date indexes", _document_date_indexes),
+    (6, "conversation ids and conversation_messages keyset index", _conversation_ids),
+    (7, "dashboard_snapshots current-snapshot index", _current_snapshot_index),
+]
+
+
+def applied_versions(engine: Engine) -> set[int]:
+    with engine.connect() as conn:
+        return {version for (version,) in conn.execute(select(SchemaMigration.version))}
+
+
+def run_migrations(engine: Engine) -> list[int]:
+    """Apply every migration this database has not had yet. Returns the versions applied."""
+    done = applied_versions(engine)
+    applied = []
+    for version, name, migrate in MIGRATIONS:
+        if version in done:
+            continue
+        try:
+            with engine.begin() as conn:
+                migrate(conn)
+                conn.execute(
+                    insert(SchemaMigration).values(version=version, name=name, applied_at=datetime.utcnow())
+                )
+        except IntegrityError:
+            # Another worker starting at the same time recorded it first
+            logger.info("Migration %d (%s) was applied by another process", version, name)
+            continue
+        applied.append(version)
+        logger.info("Applied migration %d: %s", version, name)
+    return applied
@@ -0,0 +1,189 @@
+"""Health-aware routing across the primary and fallback models.
+
+Each model gets a circuit breaker:
+
+- CLOSED: requests go through; consecutive failures are counted.
+- OPEN: after `failure_threshold` failures (or a probe finding the model missing) the
+  model is skipped instantly, with no round-trip to Ollama.
+- HALF_OPEN: once `reset_timeout` has passed, one trial request is let through; success
+  closes the breaker, failure re-opens it.
+
+A periodic probe lists the models pulled into Ollama so that a missing model is opened
+before any user request pays for discovering it.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from enum import Enum
+
+logger = logging.getLogger(__name__)
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("MODEL_BREAKER_FAILURE_THRESHOLD", "3"))
+BREAKER_RESET_SECONDS = float(os.getenv("MODEL_BREAKER_RESET_SECONDS", "30"))
+PROBE_INTERVAL_SECONDS = float(os.getenv("MODEL_PROBE_INTERVAL_SECONDS", "60"))
+# A half-open trial that never reported back (e.g. its request was cancelled) is given up after this
+TRIAL_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "300"))
+
+
+class BreakerState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open trial."""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = BreakerState.CLOSED
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.trial_started: float | None = None
+        self.last_error: str | None = None
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        if self.state == BreakerState.OPEN and now - self.opened_at >= self.reset_timeout:
+            self.state = BreakerState.HALF_OPEN
+            self.trial_started = None
+        if self.trial_started is not None and now - self.trial_started >= TRIAL_TIMEOUT_SECONDS:
+            self.trial_started = None
+
+    def available(self) -> bool:
+        """True if a request could be sent now (no side effects)."""
+        self._refresh()
+        if self.state == BreakerState.HALF_OPEN:
+            return self.trial_started is None
+        return self.state == BreakerState.CLOSED
+
+    def acquire(self) -> bool:
+        """Claim the right to send one request; in HALF_OPEN only a single trial is granted."""
+        if not self.available():
+            return False
+        if self.state == BreakerState.HALF_OPEN:
+            self.trial_started = time.monotonic()
+        return True
+
+    def record_success(self) -> None:
+        self.state = BreakerState.CLOSED
+        self.failures = 0
+        self.trial_started = None
+
+    def record_failure(self, error: str) -> None:
+        self.failures += 1
+        self.last_error = error
+        self.trial_started = None
+        if self.state == BreakerState.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.trip()
+
+    def trip(self) -> None:
+        self.state = BreakerState.OPEN
+        self.opened_at = time.monotonic()
+
+
+class ModelRouter:
+    """Orders the configured models by preference, skipping those whose breaker is open."""
+
+    def __init__(self, models: list[str]):
+        # dict.fromkeys drops a duplicate when primary and fallback are the same model
+        self.models = list(dict.fromkeys(models))
+        self.breakers = {
+            m: CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS) for m in self.models
+        }
+        self.pulled: dict[str, bool | None] = {m: None for m in self.models}
+        self.successes = {m: 0 for m in self.models}
+        self.failures = {m: 0 for m in self.models}
+        self.last_probe: float | None = None
+        self.last_probe_error: str | None = None
+
+    def candidates(self) -> list[str]:
+        """Models that may be tried right now, in preference order.
+
+        Models the last probe found missing stay out until a probe sees them again.
+        """
+        return [m for m in self.models if self.pulled[m] is not False and self.breakers[m].available()]
+
+    def acquire(self, model: str) -> bool:
+        """Call immediately before sending a request to `model`; skip the model if False."""
+        return self.breakers[model].acquire()
+
+    def record_success(self, model: str) -> None:
+        self.successes[model] += 1
+        self.breakers[model].record_success()
+
+    def record_failure(self, model: str, error: Exception) -> None:
+        self.failures[model] += 1
+        breaker = self.breakers[model]
+        breaker.record_failure(f"{type(error).__name__}: {error}")
+        # "model not found" will not fix itself within the reset window of a retry
+        if getattr(error, "status_code", None) == 404:
+            breaker.trip()
+        if breaker.state == BreakerState.OPEN:
+            logger.warning("Circuit opened for model %s: %s", model, breaker.last_error)
+
+    async def probe(self, client) -> None:
+        """Check which models are pulled into Ollama and open the breaker of missing ones."""
+        self.last_probe = time.time()
+        try:
+            response = await client.list()
+        except Exception as e:
+            self.last_probe_error = f"{type(e).__name__}: {e}"
+            logger.warning("Model probe failed: %s", self.last_probe_error)
+            for model in self.models:
+                self.breakers[model].record_failure(f"probe: {self.last_probe_error}")
+            return
+
+        self.last_probe_error = None
+        entries = response["models"] if isinstance(response, dict) else response.models
+        names = set()
+        for entry in entries:
+            name = entry["model"] if isinstance(entry, dict) else entry.model
+            names.add(name)
+            if name.endswith(":latest"):
+                names.add(name.removesuffix(":latest"))
+
+        for model in self.models:
+            was_pulled = self.pulled[model]
+            self.pulled[model] = model in names
+            breaker = self.breakers[model]
+            if not self.pulled[model]:
+                breaker.last_error = "model is not pulled"
+                breaker.trip()
+            elif was_pulled is False:
+                # The only thing wrong was that the model was missing; it is there now
+                breaker.record_success()
+                logger.info("Model %s is now available", model)
+
+    async def run_probes(self, client, interval: float = PROBE_INTERVAL_SECONDS) -> None:
+        """Probe forever (start as a background task at startup)."""
+        while True:
+            await self.probe(client)
+            await asyncio.sleep(interval)
+
+    def state(self) -> dict:
+        """Routing state for the admin endpoint."""
+        models = []
+        for model in self.models:
+            breaker = self.breakers[model]
+            breaker._refresh()
+            models.append(
+                {
+                    "model": model,
+                    "state": breaker.state.value,
+                    "pulled": self.pulled[model],
+                    "consecutive_failures": breaker.failures,
+                    "last_error": breaker.last_error,
+                    "successes": self.successes[model],
+                    "failures": self.failures[model],
+                }
+            )
+        return {
+            "order": self.candidates(),
+            "last_probe": self.last_probe,
+            "last_probe_error": self.last_probe_error,
+            "models": models,
+        }
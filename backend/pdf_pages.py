@@ -0,0 +1,180 @@
+"""Parallel, cached text extraction for PDF pages.
+
+A PDF's pages are split into runs of PDF_PAGES_PER_SHARD that are extracted in parallel in the
+ingestion process pool. Each page's text is cached in `pdf_page_cache` under a hash of what
+determines it (content stream, fonts and their Unicode maps, Form XObjects, rotation), so a re-uploaded or
+slightly edited PDF only has its new or changed pages extracted. Per-page extraction times are
+recorded; pages slower than PDF_SLOW_PAGE_SECONDS are logged.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from concurrent.futures import Executor
+
+import PyPDF2
+from PyPDF2 import PdfReader
+from sqlalchemy.exc import IntegrityError
+
+from backend.database import SessionLocal
+from shared.models import PdfPageText
+
+logger = logging.getLogger(__name__)
+
+PAGES_PER_SHARD = int(os.getenv("PDF_PAGES_PER_SHARD", "8"))
+SLOW_PAGE_SECONDS = float(os.getenv("PDF_SLOW_PAGE_SECONDS", "2"))
+SLOWEST_PAGES_REPORTED = 5
+
+_stats = {"pages_extracted": 0, "pages_cached": 0, "extract_seconds": 0.0, "slow_pages": 0}
+
+
+def page_hashes(path: str) -> list[str]:
+    """Hash every page of a PDF (runs in a worker process)."""
+    return [_page_hash(page) for page in PdfReader(path).pages]
+
+
+def _page_hash(page) -> str:
+    digest = hashlib.sha256(f"PyPDF2 {PyPDF2.__version__}".encode())  # new extractor, new text
+    contents = page.get_contents()
+    if contents is not None:
+        digest.update(contents.get_data())
+    digest.update(str(page.get("/Rotate", 0)).encode())
+    _hash_resources(digest, page.get("/Resources"), set())
+    return digest.hexdigest()
+
+
+def _hash_resources(digest, resources, seen: set[int]) -> None:
+    """Add the fonts and Form XObjects (their content and own resources, recursively) to `digest`.
+
+    extract_text also reads the text of forms a page draws, so templated pages that share one
+    content stream (e.g. `/Fm0 Do`) differ only here.
+    """
+    if resources is None:
+        return
+    resources = resources.get_object()
+    fonts = resources.get("/Font")
+    if fonts is not None:
+        fonts = fonts.get_object()
+        for name in sorted(fonts):
+            font = fonts[name].get_object()
+            digest.update(f"{name}:{font.get('/BaseFont')}:{font.get('/Encoding')}".encode())
+            to_unicode = font.get("/ToUnicode")
+            if to_unicode is not None:
+                digest.update(to_unicode.get_object().get_data())
+    xobjects = resources.get("/XObject")
+    if xobjects is not None:
+        xobjects = xobjects.get_object()
+        for name in sorted(xobjects):
+            xobject = xobjects[name].get_object()
+            digest.update(f"{name}:{xobject.get('/Subtype')}".encode())
+            if xobject.get("/Subtype") != "/Form":
+                continue  # images carry no text
+            if id(xobject) in seen:
+                digest.update(b"<seen>")  # a form drawn again (or drawing itself)
+                continue
+            seen.add(id(xobject))
+            digest.update(str(xobject.get("/Matrix", "")).encode())
+            digest.update(xobject.get_data())
+            _hash_resources(digest, xobject.get("/Resources"), seen)
+
+
+def extract_pages(path: str, indices: list[int]) -> list[tuple[int, str, float]]:
+    """Extract the text of some pages of a PDF (runs in a worker process).
+
+    Returns (page index, text, seconds taken) for each page.
+    """
+    reader = PdfReader(path)
+    results = []
+    for index in indices:
+        started = time.perf_counter()
+        text = reader.pages[index].extract_text() or ""
+        results.append((index, text, time.perf_counter() - started))
+    return results
+
+
+async def extract_pdf(path: str, executor: Executor) -> tuple[list[str], dict]:
+    """Extract the text of every page of a PDF, reusing cached pages. Returns (pages, stats)."""
+    loop = asyncio.get_running_loop()
+    hashes = await loop.run_in_executor(executor, page_hashes, path)
+    cached = await asyncio.to_thread(_load_cached, hashes)
+
+    # One extraction per distinct uncached page (blank or repeated pages share a hash)
+    missing, seen = [], set(cached)
+    for index, page_hash in enumerate(hashes):
+        if page_hash not in seen:
+            seen.add(page_hash)
+            missing.append(index)
+    shards = [missing[start : start + PAGES_PER_SHARD] for start in range(0, len(missing), PAGES_PER_SHARD)]
+    results = await asyncio.gather(
+        *(loop.run_in_executor(executor, extract_pages, path, shard) for shard in shards)
+    )
+
+    extracted = {}
+    timings = []
+    for shard in results:
+        for index, text, seconds in shard:
+            extracted[hashes[index]] = (text, seconds)
+            timings.append((index, seconds))
+    if extracted:
+        await asyncio.to_thread(_store_cached, extracted)
+
+    slow = [(index, seconds) for index, seconds in timings if seconds >= SLOW_PAGE_SECONDS]
+    for index, seconds in slow:
+        logger.warning("Slow PDF page: %s page %d took %.1fs to extract", os.path.basename(path), index + 1, seconds)
+
+    _stats["pages_extracted"] += len(timings)
+    _stats["pages_cached"] += len(hashes) - len(timings)
+    _stats["extract_seconds"] += sum(seconds for _, seconds in timings)
+    _stats["slow_pages"] += len(slow)
+
+    texts = {page_hash: text for page_hash, (text, _) in extracted.items()}
+    texts.update(cached)
+    pages = [texts[page_hash] for page_hash in hashes]
+    stats = {
+        "pages": len(hashes),
+        "pages_cached": len(hashes) - len(timings),
+        "extract_seconds": round(sum(seconds for _, seconds in timings), 3),
+        "slowest_pages": [
+            {"page": index + 1, "seconds": round(seconds, 3)}
+            for index, seconds in sorted(timings, key=lambda t: t[1], reverse=True)[:SLOWEST_PAGES_REPORTED]
+        ],
+    }
+    return pages, stats
+
+
+def stats() -> dict:
+    """Page extraction and cache-hit counters for this worker."""
+    return {**_stats, "extract_seconds": round(_stats["extract_seconds"], 3)}
+
+
+def _load_cached(hashes: list[str]) -> dict[str, str]:
+    unique = list(set(hashes))
+    db = SessionLocal()
+    try:
+        cached = {}
+        for start in range(0, len(unique), 500):  # stay under SQLite's bound-parameter limit
+            rows = db.query(PdfPageText.page_hash, PdfPageText.text).filter(
+                PdfPageText.page_hash.in_(unique[start : start + 500])
+            )
+            cached.update(rows)
+        return cached
+    finally:
+        db.close()
+
+
+def _store_cached(extracted: dict[str, tuple[str, float]]) -> None:
+    db = SessionLocal()
+    try:
+        db.add_all(
+            PdfPageText(page_hash=page_hash, text=text, extract_seconds=seconds)
+            for page_hash, (text, seconds) in extracted.items()
+        )
+        try:
+            db.commit()
+        except IntegrityError:
+            # Another job cached some of these pages at the same moment; the cache is best-effort
+            db.rollback()
+    finally:
+        db.close()
@@ -0,0 +1,112 @@
+"""Token-budget-aware prompt assembly.
+
+Ollama silently truncates prompts that overflow `num_ctx`, so every prompt is packed
+into the target model's window up front, by priority:
+
+1. persona / task prompt, the user message and any system turns leading the history, such
+   as a conversation summary (always kept)
+2. knowledge-base context parts, in retrieval rank order
+3. the rest of the conversation history, newest turns first
+
+Whatever does not fit is dropped whole and reported in a PromptReport.
+"""
+
+import logging
+from dataclasses import dataclass
+
+from backend.retrieval import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Chat-template overhead per message (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@dataclass
+class PromptReport:
+    """What an assembled prompt contains and what had to be left out."""
+
+    model: str
+    budget: int
+    used_tokens: int
+    context_kept: int
+    context_dropped: int
+    history_kept: int
+    history_dropped: int
+    dropped_tokens: int
+
+    @property
+    def over_budget(self) -> bool:
+        """True when the required parts alone exceed the budget."""
+        return self.used_tokens > self.budget
+
+
+def _message_tokens(content: str) -> int:
+    return estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+
+def assemble_prompt(
+    model: str,
+    budget: int,
+    system_prompt: str,
+    user_message: str,
+    context: list[str] | None = None,
+    context_header: str = "",
+    history: list[dict] | None = None,
+) -> tuple[list[dict], PromptReport]:
+    """Build the Ollama `messages` list for `model`, fitting it into `budget` tokens."""
+    context = context or []
+    history = history or []
+    pinned = 0
+    while pinned < len(history) and history[pinned].get("role") == "system":
+        pinned += 1
+    pinned_history, history = history[:pinned], history[pinned:]
+
+    used = _message_tokens(system_prompt) + _message_tokens(user_message)
+    used += sum(_message_tokens(turn.get("content", "")) for turn in pinned_history)
+    if context:
+        used += estimate_tokens(context_header)
+
+    kept_context = []
+    dropped_tokens = 0
+    for part in context:
+        cost = estimate_tokens(part)
+        if used + cost <= budget:
+            kept_context.append(part)
+            used += cost
+        else:
+            dropped_tokens += cost
+
+    # Walk history newest-first so the most recent turns survive
+    kept_history: list[dict] = []
+    for turn in reversed(history):
+        cost = _message_tokens(turn.get("content", ""))
+        if used + cost <= budget:
+            kept_history.append(turn)
+            used += cost
+        else:
+            dropped_tokens += cost
+    kept_history.reverse()
+
+    system_content = system_prompt
+    if kept_context:
+        system_content += context_header + "\n\n".join(kept_context)
+
+    messages = [{"role": "system", "content": system_content}, *pinned_history, *kept_history]
+    messages.append({"role": "user", "content": user_message})
+
+    report = PromptReport(
+        model=model,
+        budget=budget,
+        used_tokens=used,
+        context_kept=len(kept_context),
+        context_dropped=len(context) - len(kept_context),
+        history_kept=len(pinned_history) + len(kept_history),
+        history_dropped=len(history) - len(kept_history),
+        dropped_tokens=dropped_tokens,
+    )
+    if report.over_budget:
+        logger.warning("Prompt for %s exceeds budget even without optional parts: %s", model, report)
+    elif dropped_tokens:
+        logger.info("Prompt for %s trimmed to budget: %s", model, report)
+    return messages, report
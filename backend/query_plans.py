@@ -0,0 +1,105 @@
+"""Query-plan checks for the hot read paths.
+
+Each query in HOT_QUERIES mirrors one the app runs on every request (or every upload). Its plan
+must use an index: on SQLite no `SCAN <table>` without an index and no temporary B-tree for
+ORDER BY; on PostgreSQL (checked with sequential scans disabled, so small tables do not hide a
+missing index) no `Seq Scan`. Run with scripts/check_query_plans.py.
+"""
+
+import json
+import re
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+# name -> (SQL, parameters)
+HOT_QUERIES: dict[str, tuple[str, dict]] = {
+    "chat history page (GET /chat/history, recent turns for /chat)": (
+        "SELECT id, role, content FROM conversation_messages "
+        "WHERE user_id = :user_id AND department = :department AND conversation_id = :conversation_id "
+        "AND id < :before_id ORDER BY id DESC LIMIT :limit",
+        {"user_id": 1, "department": "Engineering", "conversation_id": "c1", "before_id": 100, "limit": 50},
+    ),
+    "default conversation history": (
+        "SELECT id, role, content FROM conversation_messages "
+        "WHERE user_id = :user_id AND department = :department AND conversation_id IS NULL "
+        "ORDER BY id DESC LIMIT :limit",
+        {"user_id": 1, "department": "Engineering", "limit": 20},
+    ),
+    "conversation summary (chat prompt)": (
+        "SELECT id, content, last_message_id FROM conversation_summaries "
+        "WHERE user_id = :user_id AND department = :department AND conversation_id = :conversation_id "
+        "ORDER BY id DESC LIMIT 1",
+        {"user_id": 1, "department": "Engineering", "conversation_id": "c1"},
+    ),
+    "document list (GET /documents)": (
+        "SELECT id, title FROM documents ORDER BY upload_date DESC",
+        {},
+    ),
+    "recent documents (LLM context)": (
+        "SELECT id, title, content FROM documents WHERE duplicate_of IS NULL "
+        "ORDER BY upload_date DESC LIMIT :limit",
+        {"limit": 10},
+    ),
+    "current dashboard snapshot (GET /dashboard)": (
+        "SELECT id, content, charts_json FROM dashboard_snapshots "
+        "WHERE department = :department AND kb_version = :kb_version AND spec_version = :spec_version "
+        "ORDER BY generated_at DESC LIMIT 1",
+        {"department": "Engineering", "kb_version": 1, "spec_version": "0" * 16},
+    ),
+    "dashboard snapshot for a day": (
+        "SELECT id FROM dashboard_snapshots WHERE department = :department AND generated_date = :day",
+        {"department": "Engineering", "day": "2025-01-01"},
+    ),
+    "exact-copy lookup (uploads)": (
+        "SELECT id FROM documents WHERE content_hash = :content_hash ORDER BY id LIMIT 1",
+        {"content_hash": "0" * 64},
+    ),
+    "pending ingestion jobs (startup)": (
+        "SELECT id FROM ingestion_jobs WHERE status IN ('queued', 'parsing', 'indexing')",
+        {},
+    ),
+}
+
+_SQLITE_FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+
+
+def _problems_sqlite(plan: list[str]) -> list[str]:
+    problems = []
+    for step in plan:
+        if _SQLITE_FULL_SCAN.match(step):
+            problems.append(f"full table scan: {step}")
+        elif "USE TEMP B-TREE FOR ORDER BY" in step:
+            problems.append("sort without an index")
+    return problems
+
+
+def _problems_postgres(plan: dict) -> list[str]:
+    problems = []
+    nodes = [plan]
+    while nodes:
+        node = nodes.pop()
+        if node.get("Node Type") == "Seq Scan":
+            problems.append(f"full table scan: Seq Scan on {node.get('Relation Name')}")
+        nodes.extend(node.get("Plans", []))
+    return problems
+
+
+def check_query_plans(engine: Engine) -> list[dict]:
+    """Explain every hot query. Returns [{"name", "plan", "problems"}], empty problems if indexed."""
+    results = []
+    with engine.connect() as conn:
+        for name, (sql, params) in HOT_QUERIES.items():
+            if engine.dialect.name == "sqlite":
+                rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params).all()
+                plan = [row[-1] for row in rows]
+                problems = _problems_sqlite(plan)
+            else:
+                with conn.begin():
+                    conn.execute(text("SET LOCAL enable_seqscan = off"))
+                    raw = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"), params).scalar()
+                explained = json.loads(raw) if isinstance(raw, str) else raw
+                plan = [json.dumps(explained[0]["Plan"])]
+                problems = _problems_postgres(explained[0]["Plan"])
+            results.append({"name": name, "plan": plan, "problems": problems})
+    return results
@@ -0,0 +1,292 @@
+"""Chunked retrieval over the knowledge base: SQLite FTS5/BM25 (PostgreSQL full-text search on a
+server database), optionally fused with dense vectors.
+
+Documents flagged as near-duplicates (see backend.dedup) are never returned.
+"""
+
+import logging
+import os
+import re
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from backend import vector_index
+from backend.database import IS_SQLITE
+from shared.models import Document, DocumentChunk
+
+logger = logging.getLogger(__name__)
+
+CHUNK_TOKENS = int(os.getenv("RETRIEVAL_CHUNK_TOKENS", "300"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "8"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))
+
+# "keyword" (BM25 only), "semantic" (vectors only) or "hybrid" (reciprocal-rank fusion of both)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+HYBRID_KEYWORD_WEIGHT = float(os.getenv("HYBRID_KEYWORD_WEIGHT", "0.5"))
+RRF_K = 60
+
+FTS_TABLE = "document_chunks_fts"
+
+# External-content FTS5 table mirroring document_chunks; the triggers keep it in sync
+# with every insert/update/delete on the chunk table (including ORM cascades).
+FTS_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        content, content='document_chunks', content_rowid='id', tokenize='porter unicode61'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS document_chunks_ai AFTER INSERT ON document_chunks BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS document_chunks_ad AFTER DELETE ON document_chunks BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS document_chunks_au AFTER UPDATE ON document_chunks BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+    END""",
+]
+
+# On PostgreSQL: an expression GIN index over the chunk text instead of a separate FTS table
+PG_TS_CONFIG = "english"
+PG_FTS_INDEX = (
+    "CREATE INDEX IF NOT EXISTS ix_document_chunks_tsv ON document_chunks "
+    f"USING GIN (to_tsvector('{PG_TS_CONFIG}', content))"
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)."""
+    return len(text) // 4 + 1
+
+
+def chunk_text(content: str, max_tokens: int = CHUNK_TOKENS) -> list[str]:
+    """Split text into chunks of roughly `max_tokens`, packing whole paragraphs where possible."""
+    max_chars = max_tokens * 4
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n", content) if p.strip()]
+
+    chunks: list[str] = []
+    current = ""
+    for para in paragraphs:
+        # Hard-split paragraphs that are larger than a chunk on their own
+        while len(para) > max_chars:
+            cut = para.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(para[:cut].strip())
+            para = para[cut:].strip()
+
+        if current and len(current) + len(para) + 2 > max_chars:
+            chunks.append(current)
+            current = para
+        else:
+            current = f"{current}\n\n{para}" if current else para
+
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def index_document(db: Session, doc: Document) -> int:
+    """(Re)build the chunks for a document. The FTS index is maintained by triggers.
+
+    Does not commit; the caller owns the transaction. Returns the number of chunks.
+    """
+    doc.chunks = [
+        DocumentChunk(chunk_index=i, content=chunk, token_count=estimate_tokens(chunk))
+        for i, chunk in enumerate(chunk_text(doc.content))
+    ]
+    return len(doc.chunks)
+
+
+def init_index(db: Session) -> None:
+    """Create the full-text index, and chunk any documents stored before chunking existed."""
+    if IS_SQLITE:
+        fts_exists = db.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": FTS_TABLE},
+        ).first()
+        for statement in FTS_SCHEMA:
+            db.execute(text(statement))
+        if not fts_exists:
+            db.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    else:
+        db.execute(text(PG_FTS_INDEX))
+
+    unindexed = db.query(Document).filter(~Document.chunks.any()).all()
+    for doc in unindexed:
+        index_document(db, doc)
+    db.commit()
+    if unindexed:
+        logger.info("Chunked %d previously unindexed documents", len(unindexed))
+
+
+def _match_query(query: str) -> str | None:
+    """Turn free text into a safe FTS5 MATCH expression (quoted terms OR-ed together)."""
+    terms = {t for t in re.findall(r"\w+", query.lower()) if len(t) > 1}
+    if not terms:
+        return None
+    return " OR ".join(f'"{t}"' for t in sorted(terms))
+
+
+def search_chunks(db: Session, query: str, top_k: int = RETRIEVAL_TOP_K) -> list[dict]:
+    """Return the top-k chunks for `query`, best BM25 (PostgreSQL: ts_rank_cd) match first."""
+    match = _match_query(query)
+    if match is None:
+        return []
+    if not IS_SQLITE:
+        return _search_chunks_pg(db, query, top_k)
+
+    rows = db.execute(
+        text(
+            f"""
+            SELECT c.id, c.document_id, c.chunk_index, c.content, c.token_count,
+                   d.title, d.upload_date, bm25({FTS_TABLE}) AS score
+            FROM {FTS_TABLE}
+            JOIN document_chunks c ON c.id = {FTS_TABLE}.rowid
+            JOIN documents d ON d.id = c.document_id
+            WHERE {FTS_TABLE} MATCH :match AND d.duplicate_of IS NULL
+            ORDER BY score
+            LIMIT :top_k
+            """
+        ),
+        {"match": match, "top_k": top_k},
+    ).mappings()
+    return [dict(r) for r in rows]
+
+
+def _search_chunks_pg(db: Session, query: str, top_k: int) -> list[dict]:
+    terms = sorted({t for t in re.findall(r"[^\W_]+", query.lower()) if len(t) > 1})
+    rows = db.execute(
+        text(
+            f"""
+            SELECT c.id, c.document_id, c.chunk_index, c.content, c.token_count,
+                   d.title, d.upload_date, -ts_rank_cd(to_tsvector('{PG_TS_CONFIG}', c.content), q) AS score
+            FROM document_chunks c
+            JOIN documents d ON d.id = c.document_id,
+                 to_tsquery('{PG_TS_CONFIG}', :match) q
+            WHERE to_tsvector('{PG_TS_CONFIG}', c.content) @@ q AND d.duplicate_of IS NULL
+            ORDER BY score
+            LIMIT :top_k
+            """
+        ),
+        {"match": " | ".join(terms), "top_k": top_k},
+    ).mappings()
+    return [dict(r) for r in rows]
+
+
+def _chunk_rows(rows) -> list[dict]:
+    return [
+        {
+            "id": chunk.id,
+            "document_id": doc.id,
+            "chunk_index": chunk.chunk_index,
+            "content": chunk.content,
+            "token_count": chunk.token_count,
+            "title": doc.title,
+            "upload_date": doc.upload_date,
+        }
+        for chunk, doc in rows
+    ]
+
+
+def get_chunks(db: Session, chunk_ids: list[int]) -> list[dict]:
+    """Load chunks by id, preserving the order of `chunk_ids` and skipping deleted ones."""
+    if not chunk_ids:
+        return []
+    rows = (
+        db.query(DocumentChunk, Document)
+        .join(Document, Document.id == DocumentChunk.document_id)
+        .filter(DocumentChunk.id.in_(chunk_ids), Document.duplicate_of.is_(None))
+        .all()
+    )
+    by_id = {c["id"]: c for c in _chunk_rows(rows)}
+    return [by_id[i] for i in chunk_ids if i in by_id]
+
+
+def vector_search(query: str, top_k: int = RETRIEVAL_TOP_K) -> list[tuple[int, float]] | None:
+    """The vector half of hybrid_search: (chunk_id, similarity) pairs, or None if unavailable.
+
+    Embeds the query, which blocks; async callers run it in a thread and pass the result on.
+    """
+    if RETRIEVAL_MODE == "keyword":
+        return []
+    try:
+        return vector_index.search(query, top_k * 2)
+    except Exception as e:
+        logger.warning("Vector search unavailable (%s: %s); using keyword results", type(e).__name__, e)
+        return None
+
+
+def hybrid_search(
+    db: Session,
+    query: str,
+    top_k: int = RETRIEVAL_TOP_K,
+    vector_hits: list[tuple[int, float]] | None = None,
+) -> list[dict]:
+    """Search according to RETRIEVAL_MODE, fusing keyword and vector rankings with weighted RRF.
+
+    `vector_hits` is a precomputed vector_search(query, top_k); without it the search runs here.
+    Falls back to keyword-only results if the embedding model is unavailable.
+    """
+    keyword_hits = [] if RETRIEVAL_MODE == "semantic" else search_chunks(db, query, top_k * 2)
+    if RETRIEVAL_MODE == "keyword":
+        return keyword_hits[:top_k]
+
+    if vector_hits is None:
+        vector_hits = vector_search(query, top_k)
+    if vector_hits is None:
+        return keyword_hits[:top_k]
+
+    scores: dict[int, float] = {}
+    for rank, hit in enumerate(keyword_hits):
+        scores[hit["id"]] = scores.get(hit["id"], 0.0) + HYBRID_KEYWORD_WEIGHT / (RRF_K + rank)
+    for rank, (chunk_id, _) in enumerate(vector_hits):
+        scores[chunk_id] = scores.get(chunk_id, 0.0) + (1 - HYBRID_KEYWORD_WEIGHT) / (RRF_K + rank)
+
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    known = {hit["id"]: hit for hit in keyword_hits}
+    missing = get_chunks(db, [i for i in ranked if i not in known])
+    known.update({c["id"]: c for c in missing})
+    return [known[i] for i in ranked if i in known][:top_k]
+
+
+def recent_chunks(db: Session, limit: int) -> list[dict]:
+    """Return the leading chunks of the most recent documents (fallback when nothing matches)."""
+    rows = (
+        db.query(DocumentChunk, Document)
+        .join(Document, Document.id == DocumentChunk.document_id)
+        .filter(Document.duplicate_of.is_(None))
+        .order_by(Document.upload_date.desc(), DocumentChunk.chunk_index)
+        .limit(limit)
+        .all()
+    )
+    return _chunk_rows(rows)
+
+
+def document_chunks(db: Session, document_ids: list[int]) -> list[dict]:
+    """Return every chunk of the given documents, oldest document first, in reading order."""
+    if not document_ids:
+        return []
+    rows = (
+        db.query(DocumentChunk, Document)
+        .join(Document, Document.id == DocumentChunk.document_id)
+        .filter(Document.id.in_(document_ids), Document.duplicate_of.is_(None))
+        .order_by(Document.upload_date, Document.id, DocumentChunk.chunk_index)
+        .all()
+    )
+    return _chunk_rows(rows)
+
+
+def pack_chunks(chunks: list[dict], token_budget: int = CONTEXT_TOKEN_BUDGET) -> list[dict]:
+    """Keep chunks in rank order until the token budget is used up."""
+    packed = []
+    used = 0
+    for chunk in chunks:
+        if used + chunk["token_count"] > token_budget:
+            continue
+        packed.append(chunk)
+        used += chunk["token_count"]
+    return packed
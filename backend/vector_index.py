@@ -0,0 +1,212 @@
+"""Dense-vector index of chunk embeddings, memory-mapped from data/ for zero-copy sharing.
+
+Embeddings come from the local Ollama embeddings API and are stored L2-normalised as raw
+float32 rows alongside a parallel raw int64 file of chunk ids. Readers memory-map both, so
+every uvicorn worker shares the same page-cache pages. The row count lives in a small JSON
+file: writers append new rows to the data files and then atomically replace the JSON, and
+readers map only the rows it lists, re-mapping when it changes. Adding chunks therefore
+costs only their own rows, never a rewrite of the index.
+"""
+
+import fcntl
+import json
+import logging
+import os
+
+import numpy as np
+import ollama
+from sqlalchemy.orm import Session
+
+from backend.database import DB_DIR, SessionLocal
+from shared.models import DocumentChunk
+
+logger = logging.getLogger(__name__)
+
+EMBED_MODEL = os.getenv("OLLAMA_EMBED_MODEL", "nomic-embed-text")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+
+MATRIX_PATH = os.path.join(DB_DIR, "chunk_embeddings.f32")
+IDS_PATH = os.path.join(DB_DIR, "chunk_embedding_ids.i64")
+META_PATH = os.path.join(DB_DIR, "chunk_embeddings.json")
+LOCK_PATH = os.path.join(DB_DIR, "chunk_embeddings.lock")
+# Earlier versions kept the index in .npy files, rewritten whole on every sync
+LEGACY_MATRIX_PATH = os.path.join(DB_DIR, "chunk_embeddings.npy")
+LEGACY_IDS_PATH = os.path.join(DB_DIR, "chunk_embedding_ids.npy")
+
+# Per-process view of the mapped index: (meta file identity, matrix, ids)
+_loaded: tuple[tuple[int, int], np.ndarray, np.ndarray] | None = None
+
+
+def embed_texts(texts: list[str]) -> np.ndarray:
+    """Embed texts with Ollama and return an L2-normalised float32 matrix."""
+    response = ollama.embed(model=EMBED_MODEL, input=texts)
+    embeddings = response["embeddings"] if isinstance(response, dict) else response.embeddings
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _read_meta() -> dict:
+    try:
+        with open(META_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_index() -> tuple[np.ndarray, np.ndarray] | None:
+    """Return the (matrix, ids) memory maps, re-mapping if another process added rows."""
+    global _loaded
+    try:
+        stat = os.stat(META_PATH)
+    except FileNotFoundError:
+        _loaded = None
+        return None
+
+    # The meta file is replaced, never rewritten in place, on every change
+    identity = (stat.st_ino, stat.st_mtime_ns)
+    if _loaded is None or _loaded[0] != identity:
+        meta = _read_meta()
+        if meta.get("model") != EMBED_MODEL or "rows" not in meta:
+            logger.info("Vector index was built with a different embedding model or format; ignoring it")
+            _loaded = None
+            return None
+        rows, dim = meta["rows"], meta["dim"]
+        if rows:
+            matrix = np.memmap(MATRIX_PATH, dtype=np.float32, mode="r", shape=(rows, dim))
+            ids = np.memmap(IDS_PATH, dtype=np.int64, mode="r", shape=(rows,))
+        else:
+            matrix, ids = np.empty((0, dim), dtype=np.float32), np.empty(0, dtype=np.int64)
+        _loaded = (identity, matrix, ids)
+    return _loaded[1], _loaded[2]
+
+
+def _write_meta(dim: int, rows: int) -> None:
+    with open(META_PATH + ".tmp", "w") as f:
+        json.dump({"model": EMBED_MODEL, "dim": dim, "rows": rows}, f)
+    os.replace(META_PATH + ".tmp", META_PATH)
+
+
+def _create_index(dim: int, ids: np.ndarray | None = None, vectors: np.ndarray | None = None) -> None:
+    """Start a fresh index (new files, so maps of an old one stay valid), optionally with rows."""
+    for path, data in ((MATRIX_PATH, vectors), (IDS_PATH, ids)):
+        with open(path + ".tmp", "wb") as f:
+            if data is not None:
+                f.write(np.ascontiguousarray(data).tobytes())
+        os.replace(path + ".tmp", path)
+    _write_meta(dim, 0 if ids is None else len(ids))
+
+
+def _append(rows: int, new_ids: np.ndarray, new_vectors: np.ndarray) -> None:
+    """Append rows after the first `rows` and publish them by updating the meta file."""
+    dim = new_vectors.shape[1]
+    for path, data, row_bytes in ((MATRIX_PATH, new_vectors, dim * 4), (IDS_PATH, new_ids, 8)):
+        with open(path, "r+b") as f:
+            # Drop whatever an interrupted append left past the published rows
+            f.truncate(rows * row_bytes)
+            f.seek(0, os.SEEK_END)
+            f.write(np.ascontiguousarray(data).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+    _write_meta(dim, rows + len(new_ids))
+
+
+def _convert_legacy_index() -> None:
+    """Move an index in the old .npy format over to the append-only files."""
+    if not os.path.exists(LEGACY_MATRIX_PATH) or os.path.exists(MATRIX_PATH):
+        return
+    if _read_meta().get("model") == EMBED_MODEL:
+        matrix = np.load(LEGACY_MATRIX_PATH, mmap_mode="r")
+        _create_index(matrix.shape[1], np.load(LEGACY_IDS_PATH), matrix)
+        logger.info("Converted the vector index (%d rows) to the append-only format", matrix.shape[0])
+    for path in (LEGACY_MATRIX_PATH, LEGACY_IDS_PATH):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def sync_embeddings(db: Session) -> int:
+    """Embed every chunk that is not in the index yet. Returns the number of chunks added.
+
+    Only chunk ids are read to find the missing chunks; their text is loaded one embedding
+    batch at a time, and each batch is appended as soon as it is embedded.
+    Rows for deleted chunks are left in place; search results are resolved against the
+    chunk table, so stale ids simply drop out.
+    """
+    os.makedirs(DB_DIR, exist_ok=True)
+    with open(LOCK_PATH, "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            _convert_legacy_index()
+            return _sync_locked(db)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _sync_locked(db: Session) -> int:
+    current = load_index()
+    chunk_ids = np.fromiter((chunk_id for (chunk_id,) in db.query(DocumentChunk.id)), dtype=np.int64)
+    if current is not None:
+        chunk_ids = chunk_ids[~np.isin(chunk_ids, current[1])]
+    if not chunk_ids.size:
+        return 0
+
+    rows, dim = (0, None) if current is None else (current[1].shape[0], current[0].shape[1])
+    added = 0
+    for start in range(0, chunk_ids.size, EMBED_BATCH_SIZE):
+        batch = chunk_ids[start : start + EMBED_BATCH_SIZE].tolist()
+        contents = dict(db.query(DocumentChunk.id, DocumentChunk.content).filter(DocumentChunk.id.in_(batch)))
+        batch = [chunk_id for chunk_id in batch if chunk_id in contents]  # deleted meanwhile
+        if not batch:
+            continue
+        vectors = embed_texts([contents[chunk_id] for chunk_id in batch])
+        if dim is not None and vectors.shape[1] != dim:
+            # The embedding model's dimension changed: start over and embed everything again
+            logger.warning(
+                "Embedding dimension changed from %d to %d; rebuilding the vector index", dim, vectors.shape[1]
+            )
+            _create_index(vectors.shape[1])
+            return added + _sync_locked(db)
+        if dim is None:
+            _create_index(vectors.shape[1], np.array(batch, dtype=np.int64), vectors)
+            dim = vectors.shape[1]
+        else:
+            _append(rows, np.array(batch, dtype=np.int64), vectors)
+        rows += len(batch)
+        added += len(batch)
+
+    logger.info("Embedded %d chunks with %s", added, EMBED_MODEL)
+    return added
+
+
+def backfill() -> None:
+    """Embed the chunks missing from the index (run in a background thread at startup)."""
+    db = SessionLocal()
+    try:
+        sync_embeddings(db)
+    except Exception as e:
+        # Keyword retrieval still works; chunks are embedded on the next successful sync
+        logger.warning("Skipping chunk embedding at startup: %s", e)
+    finally:
+        db.close()
+
+
+def search(query: str, top_k: int) -> list[tuple[int, float]]:
+    """Return up to `top_k` (chunk_id, cosine similarity) pairs, most similar first."""
+    index = load_index()
+    if index is None:
+        return []
+    matrix, ids = index
+    if matrix.shape[0] == 0:
+        return []
+
+    query_vector = embed_texts([query])[0]
+    if query_vector.shape[0] != matrix.shape[1]:
+        logger.warning("Query embedding dim %d != index dim %d", query_vector.shape[0], matrix.shape[1])
+        return []
+
+    scores = matrix @ query_vector
+    k = min(top_k, scores.shape[0])
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [(int(ids[i]), float(scores[i])) for i in top]
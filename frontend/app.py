@@ -2,12 +2,14 @@
 
 import json
 import re
+import time
 
 import plotly.graph_objects as go
 import requests
 import streamlit as st
 
 API_URL = "http://localhost:8000"
+HISTORY_PAGE_SIZE = 50
 
 # ---- Page config ----
 st.set_page_config(page_title="Virtual Representatives", page_icon="🏢", layout="wide")
@@ -181,7 +183,26 @@ with st.sidebar:
                         logout()
                         st.rerun()
                     resp.raise_for_status()
-                    st.success(f"Uploaded: {uploaded_file.name}")
+                    job = resp.json()
+                    # Parsing and indexing run in the background; wait for the job to finish
+                    deadline = time.time() + 120
+                    while job["status"] not in ("done", "failed") and time.time() < deadline:
+                        time.sleep(1)
+                        job_resp = requests.get(
+                            f"{API_URL}/documents/jobs/{job['id']}",
+                            headers=get_auth_headers(),
+                            timeout=5,
+                        )
+                        job_resp.raise_for_status()
+                        job = job_resp.json()
+                    if job["status"] == "failed":
+                        st.error(f"Upload failed: {job['error']}")
+                    elif job["status"] == "done" and job.get("documents_added") == 0:
+                        st.info(f"{uploaded_file.name} is already in the knowledge base.")
+                    elif job["status"] == "done":
+                        st.success(f"Uploaded: {uploaded_file.name}")
+                    else:
+                        st.info(f"{uploaded_file.name} is still being processed; it will appear shortly.")
                     st.cache_data.clear()
                 except Exception as e:
                     st.error(f"Upload failed: {e}")
@@ -205,6 +226,8 @@ with st.sidebar:
     else:
         for doc in docs:
             with st.expander(doc["title"]):
+                if doc.get("duplicate_of"):
+                    st.caption(f"Near-duplicate of document {doc['duplicate_of']}; not used for answers.")
                 st.text(doc["content"][:500] + ("..." if len(doc["content"]) > 500 else ""))
                 if st.button("Delete", key=f"del_{doc['id']}"):
                     resp = requests.delete(
@@ -230,7 +253,7 @@ tab_dashboard, tab_chat = st.tabs(["Dashboard", "Chat"])
 with tab_dashboard:
 
     def fetch_dashboard(dept: str) -> dict | None:
-        """Fetch (or generate) today's dashboard snapshot from the API."""
+        """Fetch (or generate) the current dashboard snapshot from the API."""
         try:
             resp = requests.get(
                 f"{API_URL}/dashboard/{dept}",
@@ -351,28 +374,48 @@ with tab_dashboard:
 
 # =============== CHAT TAB ===============
 with tab_chat:
-    # Load chat history from backend per department
+    # Load chat history from backend per department, one page at a time (newest first)
     if "histories" not in st.session_state:
         st.session_state.histories = {}
+    if "history_more" not in st.session_state:
+        st.session_state.history_more = {}
+
+    def load_history_page(before_id=None):
+        params = {"department": selected_dept, "limit": HISTORY_PAGE_SIZE}
+        if before_id is not None:
+            params["before_id"] = before_id
+        hist_resp = requests.get(
+            f"{API_URL}/chat/history",
+            params=params,
+            headers=get_auth_headers(),
+            timeout=5,
+        )
+        if hist_resp.status_code == 401:
+            logout()
+            st.rerun()
+        hist_resp.raise_for_status()
+        page = hist_resp.json()
+        st.session_state.history_more[selected_dept] = len(page) == HISTORY_PAGE_SIZE
+        return page
 
     if selected_dept not in st.session_state.histories:
         try:
-            hist_resp = requests.get(
-                f"{API_URL}/chat/history",
-                params={"department": selected_dept},
-                headers=get_auth_headers(),
-                timeout=5,
-            )
-            if hist_resp.status_code == 401:
-                logout()
-                st.rerun()
-            hist_resp.raise_for_status()
-            st.session_state.histories[selected_dept] = hist_resp.json()
+            st.session_state.histories[selected_dept] = load_history_page()
         except Exception:
             st.session_state.histories[selected_dept] = []
+            st.session_state.history_more[selected_dept] = False
 
     history = st.session_state.histories[selected_dept]
 
+    # Earlier messages are fetched on demand, keyed on the oldest loaded message
+    if history and "id" in history[0] and st.session_state.history_more.get(selected_dept):
+        if st.button("Load earlier messages", key=f"earlier_{selected_dept}"):
+            try:
+                history[:0] = load_history_page(before_id=history[0]["id"])
+            except Exception:
+                st.error("Could not load earlier messages.")
+            st.rerun()
+
     # Clear history button
     if history and st.button("Clear History", key=f"clear_{selected_dept}"):
         try:
@@ -385,6 +428,7 @@ with tab_chat:
         except Exception:
             pass
         st.session_state.histories[selected_dept] = []
+        st.session_state.history_more[selected_dept] = False
         st.rerun()
 
     # Display chat messages
@@ -401,10 +445,10 @@ with tab_chat:
         with st.chat_message("assistant"):
             with st.spinner("Thinking..."):
                 try:
+                    # The backend adds the conversation's recent turns itself
                     payload = {
                         "department": selected_dept,
                         "message": prompt,
-                        "history": history[:-1],
                     }
                     resp = requests.post(
                         f"{API_URL}/chat",
@@ -15,7 +15,6 @@ import {
   uploadDocument,
   deleteDocument,
   sendChat,
-  ChatHistoryItem,
 } from "@/lib/api";
 
 const generateId = () => Math.random().toString(36).substring(2, 9);
@@ -131,14 +130,12 @@ export function useChat(isAuthenticated: boolean) {
       setCurrentMessages(pendingMessages);
       setIsTyping(true);
 
-      const history: ChatHistoryItem[] = currentMessages.map((message) => ({
-        role: message.sender === "user" ? "user" : "assistant",
-        content: message.content,
-      }));
+      // A new chat gets its id up front so the backend can key its history on it
+      const conversationId = activeConversationId ?? `conv-${generateId()}`;
 
       try {
         const deptName = departmentsById[selectedDepartment]?.name ?? departments[selectedDepartment].name;
-        const reply = await sendChat(deptName, content, history);
+        const reply = await sendChat(deptName, content, conversationId);
         const departmentResponse: ChatMessage = {
           id: generateId(),
           content: reply,
@@ -165,7 +162,7 @@ export function useChat(isAuthenticated: boolean) {
           }
 
           const newConversation: ChatConversation = {
-            id: `conv-${generateId()}`,
+            id: conversationId,
             title: content.slice(0, 40) + (content.length > 40 ? "..." : ""),
             department: selectedDepartment,
             lastMessage: reply,
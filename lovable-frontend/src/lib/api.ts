@@ -73,11 +73,6 @@ export interface ApiDocument {
   metadata: string;
 }
 
-export interface ChatHistoryItem {
-  role: "user" | "assistant";
-  content: string;
-}
-
 export async function fetchDepartments(): Promise<ApiDepartment[]> {
   const resp = await fetchWithTimeout(`${API_URL}/departments`);
   if (!resp.ok) {
@@ -118,7 +113,28 @@ export async function fetchDocuments(): Promise<ApiDocument[]> {
   return resp.json();
 }
 
-export async function uploadDocument(file: File): Promise<ApiDocument> {
+export interface ApiIngestionJob {
+  id: number;
+  filename: string;
+  status: "queued" | "parsing" | "indexing" | "done" | "failed";
+  error: string | null;
+  document_id: number | null;
+  created_at: string;
+  finished_at: string | null;
+}
+
+export async function fetchIngestionJob(jobId: number): Promise<ApiIngestionJob> {
+  const resp = await fetchWithTimeout(`${API_URL}/documents/jobs/${jobId}`, {
+    headers: authHeaders(),
+  });
+  if (!resp.ok) {
+    throw new Error(`Failed to load upload status (${resp.status})`);
+  }
+  return resp.json();
+}
+
+/** Upload a file and wait until it has been parsed and indexed in the background. */
+export async function uploadDocument(file: File): Promise<ApiIngestionJob> {
   const formData = new FormData();
   formData.append("file", file);
 
@@ -131,7 +147,17 @@ export async function uploadDocument(file: File): Promise<ApiDocument> {
     const detail = await resp.text();
     throw new Error(detail || `Upload failed (${resp.status})`);
   }
-  return resp.json();
+
+  let job: ApiIngestionJob = await resp.json();
+  const deadline = Date.now() + 120_000;
+  while (job.status !== "done" && job.status !== "failed" && Date.now() < deadline) {
+    await new Promise((resolve) => setTimeout(resolve, 1000));
+    job = await fetchIngestionJob(job.id);
+  }
+  if (job.status === "failed") {
+    throw new Error(job.error || "Upload failed");
+  }
+  return job;
 }
 
 export async function deleteDocument(docId: number): Promise<void> {
@@ -150,7 +176,7 @@ export async function deleteDocument(docId: number): Promise<void> {
 export async function sendChat(
   department: string,
   message: string,
-  history: ChatHistoryItem[]
+  conversationId: string
 ): Promise<string> {
   const resp = await fetchWithTimeout(`${API_URL}/chat`, {
     method: "POST",
@@ -158,7 +184,8 @@ export async function sendChat(
       "Content-Type": "application/json",
       ...authHeaders(),
     },
-    body: JSON.stringify({ department, message, history }),
+    // The backend loads the conversation's earlier turns itself
+    body: JSON.stringify({ department, message, conversation_id: conversationId }),
   }, 120_000);
   if (!resp.ok) {
     const detail = await resp.text();
@@ -0,0 +1,47 @@
+"""Bulk-import documents from zip archives and/or directories into the knowledge base.
+
+Usage: python scripts/bulk_import.py PATH [PATH ...] [--workers N]
+"""
+
+import argparse
+import sys
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Allow imports from project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.bulk_import import import_archive, import_directory
+from backend.database import init_db
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-import .txt, .md and .pdf files from zip archives or directories.")
+    parser.add_argument("paths", nargs="+", help="Zip archives or directories to import")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Parser processes (default: CPUs)")
+    args = parser.parse_args()
+
+    init_db()
+    imported = failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for path in args.paths:
+            if os.path.isdir(path):
+                summary = import_directory(path, executor)
+            elif os.path.isfile(path) and path.lower().endswith(".zip"):
+                summary = import_archive(path, executor)
+            else:
+                print(f"Skipping {path}: not a directory or zip archive", file=sys.stderr)
+                continue
+            for failure in summary["failed"]:
+                print(f"  failed: {failure['filename']}: {failure['error']}", file=sys.stderr)
+            print(
+                f"{path}: imported {summary['imported']} documents, "
+                f"{summary['duplicates']} duplicates skipped, {len(summary['failed'])} failed."
+            )
+            imported += summary["imported"]
+            failed += len(summary["failed"])
+    print(f"Imported {imported} documents ({failed} failed).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""Check that the hot queries use indexes (see backend/query_plans.py); exits 1 if any do not.
+
+Usage: python scripts/check_query_plans.py
+"""
+
+import sys
+import os
+
+# Allow imports from project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.database import engine, init_db
+from backend.migrations import applied_versions
+from backend.query_plans import check_query_plans
+
+
+def main():
+    init_db()
+    print(f"Schema migrations applied: {sorted(applied_versions(engine))}")
+    failed = 0
+    for result in check_query_plans(engine):
+        status = "FAIL" if result["problems"] else "ok"
+        print(f"[{status}] {result['name']}")
+        for step in result["plan"]:
+            print(f"    {step}")
+        for problem in result["problems"]:
+            print(f"    -> {problem}")
+        failed += bool(result["problems"])
+    if failed:
+        print(f"{failed} queries are not fully indexed.")
+        sys.exit(1)
+    print("All hot queries use indexes.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,10 @@
 """SQLAlchemy database models for the Virtual Representatives system."""
 
+import json
 from datetime import date, datetime
 
-from sqlalchemy import Column, Date, DateTime, ForeignKey, Integer, String, Text
-from sqlalchemy.orm import declarative_base
+from sqlalchemy import Column, Date, DateTime, Float, ForeignKey, Index, Integer, LargeBinary, String, Text
+from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
 
@@ -12,13 +13,37 @@ class Document(Base):
     """Stores uploaded documents (meeting notes, PDFs, etc.) as knowledge base entries."""
 
     __tablename__ = "documents"
+    __table_args__ = (
+        # Serves "non-duplicate documents, newest first" (context fetching) and copy lookups
+        Index("ix_documents_duplicate_of_upload_date", "duplicate_of", "upload_date"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     title = Column(String(255), nullable=False)
     content = Column(Text, nullable=False)
-    upload_date = Column(DateTime, default=datetime.utcnow)
+    upload_date = Column(DateTime, default=datetime.utcnow, index=True)
     tags = Column(Text, default="[]")  # JSON string of tags
     extra_metadata = Column("metadata", Text, default="{}")  # JSON string of extra metadata
+    facts_extracted_at = Column(DateTime, nullable=True)  # set once backend.facts has run on it
+    content_hash = Column(String(64), nullable=True, index=True)  # see backend.dedup.content_hash
+    minhash = Column(LargeBinary, nullable=True)  # MinHash signature, see backend.dedup
+    # Set when this is a near-copy of another document; it is then left out of retrieval,
+    # dashboards and facts
+    duplicate_of = Column(Integer, ForeignKey("documents.id", ondelete="SET NULL"), nullable=True)
+
+    chunks = relationship(
+        "DocumentChunk",
+        back_populates="document",
+        cascade="all, delete-orphan",
+        order_by="DocumentChunk.chunk_index",
+    )
+    # Facts extracted from this document (see backend.facts); deleted with it
+    project_facts = relationship("ProjectFact", cascade="all, delete-orphan")
+    client_facts = relationship("ClientFact", cascade="all, delete-orphan")
+    person_facts = relationship("PersonFact", cascade="all, delete-orphan")
+    deal_facts = relationship("DealFact", cascade="all, delete-orphan")
+    technology_facts = relationship("TechnologyFact", cascade="all, delete-orphan")
+    milestone_facts = relationship("MilestoneFact", cascade="all, delete-orphan")
 
     def to_dict(self):
         return {
@@ -28,9 +53,104 @@ class Document(Base):
             "upload_date": self.upload_date.isoformat() if self.upload_date else None,
             "tags": self.tags,
             "metadata": self.extra_metadata,
+            "duplicate_of": self.duplicate_of,
         }
 
 
+class DocumentChunk(Base):
+    """A retrieval-sized slice of a Document, indexed in the FTS5 table document_chunks_fts."""
+
+    __tablename__ = "document_chunks"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), nullable=False, index=True)
+    chunk_index = Column(Integer, nullable=False)  # position within the parent document
+    content = Column(Text, nullable=False)
+    token_count = Column(Integer, nullable=False, default=0)  # estimated, see backend.retrieval
+
+    document = relationship("Document", back_populates="chunks")
+
+
+# --------------- Extracted facts ---------------
+# One row per mention in a document. `*_key` columns hold the lower-cased name so that
+# mentions of the same entity across documents can be grouped; the newest mention wins.
+
+
+class ProjectFact(Base):
+    __tablename__ = "fact_projects"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), nullable=False, index=True)
+    name = Column(String(255), nullable=False)
+    name_key = Column(String(255), nullable=False, index=True)
+    client = Column(String(255), nullable=True)
+    status = Column(String(50), nullable=True, index=True)  # Active, At Risk, Completed, On Hold
+    project_type = Column(String(100), nullable=True)
+    start_date = Column(Date, nullable=True)
+    end_date = Column(Date, nullable=True)
+
+
+class ClientFact(Base):
+    __tablename__ = "fact_clients"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), nullable=False, index=True)
+    name = Column(String(255), nullable=False)
+    name_key = Column(String(255), nullable=False, index=True)
+    industry = Column(String(100), nullable=True)
+    relationship_start = Column(Date, nullable=True)
+
+
+class PersonFact(Base):
+    """A person, optionally as assigned to a project."""
+
+    __tablename__ = "fact_people"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), nullable=False, index=True)
+    name = Column(String(255), nullable=False)
+    name_key = Column(String(255), nullable=False, index=True)
+    role = Column(String(50), nullable=True)  # Frontend, Backend, Full-Stack, DevOps, QA, ...
+    seniority = Column(String(50), nullable=True)  # Junior, Mid, Senior, Lead
+    project = Column(String(255), nullable=True)
+    project_key = Column(String(255), nullable=True, index=True)
+    open_work_items = Column(Integer, nullable=True)
+
+
+class DealFact(Base):
+    __tablename__ = "fact_deals"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), nullable=False, index=True)
+    company = Column(String(255), nullable=False)
+    company_key = Column(String(255), nullable=False, index=True)
+    stage = Column(String(50), nullable=True, index=True)  # Prospecting ... Won, Lost
+    industry = Column(String(100), nullable=True)
+    value = Column(Float, nullable=True)
+
+
+class TechnologyFact(Base):
+    """A technology used by a project."""
+
+    __tablename__ = "fact_technologies"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), nullable=False, index=True)
+    name = Column(String(100), nullable=False)
+    name_key = Column(String(100), nullable=False, index=True)
+    project_key = Column(String(255), nullable=True)
+
+
+class MilestoneFact(Base):
+    __tablename__ = "fact_milestones"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), nullable=False, index=True)
+    title = Column(String(255), nullable=False)
+    project = Column(String(255), nullable=True)
+    due_date = Column(Date, nullable=True, index=True)
+
+
 class User(Base):
     """Stores Google-authenticated users."""
 
@@ -59,25 +179,66 @@ class ConversationMessage(Base):
     """Persists chat messages per user per department."""
 
     __tablename__ = "conversation_messages"
+    __table_args__ = (
+        # One conversation's messages in order; serves keyset pages (id < before_id) and recent turns
+        Index(
+            "ix_conversation_messages_conversation", "user_id", "department", "conversation_id", "id"
+        ),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     department = Column(String(100), nullable=False, index=True)
+    conversation_id = Column(String(64), nullable=True)  # None: the department's default conversation
     role = Column(String(20), nullable=False)  # "user" or "assistant"
     content = Column(Text, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     def to_dict(self):
         return {
+            "id": self.id,
+            "conversation_id": self.conversation_id,
             "role": self.role,
             "content": self.content,
         }
 
 
+class ConversationSummary(Base):
+    """Rolling summary of a conversation's older messages (see backend.conversations).
+
+    Covers every message of the conversation up to and including `last_message_id`.
+    """
+
+    __tablename__ = "conversation_summaries"
+    __table_args__ = (
+        Index("ix_conversation_summaries_conversation", "user_id", "department", "conversation_id"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    department = Column(String(100), nullable=False)
+    conversation_id = Column(String(64), nullable=True)
+    content = Column(Text, nullable=False)
+    last_message_id = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
 class DashboardSnapshot(Base):
-    """Caches a daily LLM-generated dashboard per department."""
+    """Caches an LLM-generated dashboard per department.
+
+    A snapshot is current while its kb_version and spec_version match the knowledge base
+    and the department's dashboard prompt/chart specs; it is stored under the day it was made.
+    """
 
     __tablename__ = "dashboard_snapshots"
+    __table_args__ = (
+        # One snapshot per department per day; writes upsert against this
+        Index("uq_dashboard_snapshots_department_date", "department", "generated_date", unique=True),
+        # Finding the current snapshot (newest for a knowledge-base and spec version)
+        Index(
+            "ix_dashboard_snapshots_current", "department", "kb_version", "spec_version", "generated_at"
+        ),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     department = Column(String(100), nullable=False, index=True)
@@ -85,6 +246,9 @@ class DashboardSnapshot(Base):
     charts_json = Column(Text, nullable=False, default="[]")  # JSON array of chart data
     generated_date = Column(Date, nullable=False, default=date.today)
     generated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    kb_version = Column(Integer, nullable=True)  # KnowledgeBaseVersion.version it was built from
+    spec_version = Column(String(64), nullable=True)  # personas.get_dashboard_version()
+    document_ids = Column(Text, nullable=True)  # JSON array of the Document ids it covers
 
     def to_dict(self):
         return {
@@ -93,4 +257,76 @@ class DashboardSnapshot(Base):
             "charts_json": self.charts_json,
             "generated_date": self.generated_date.isoformat(),
             "generated_at": self.generated_at.isoformat(),
+            "kb_version": self.kb_version,
+            "spec_version": self.spec_version,
+        }
+
+
+class KnowledgeBaseVersion(Base):
+    """Single-row counter bumped whenever a document is added or removed."""
+
+    __tablename__ = "kb_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class GenerationLease(Base):
+    """Cross-process lock row: whoever holds an unexpired lease on a key does the work for it."""
+
+    __tablename__ = "generation_leases"
+
+    key = Column(String(255), primary_key=True)
+    owner = Column(String(255), nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+
+class PdfPageText(Base):
+    """Cache of extracted PDF page text, keyed by a hash of the page's content (see backend.pdf_pages)."""
+
+    __tablename__ = "pdf_page_cache"
+
+    page_hash = Column(String(64), primary_key=True)
+    text = Column(Text, nullable=False)
+    extract_seconds = Column(Float, nullable=False, default=0.0)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class SchemaMigration(Base):
+    """A migration from backend.migrations that has been applied to this database."""
+
+    __tablename__ = "schema_migrations"
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String(255), nullable=False)
+    applied_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class IngestionJob(Base):
+    """An uploaded file on its way into the knowledge base (see backend.ingestion)."""
+
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    filename = Column(String(255), nullable=False)
+    upload_path = Column(String(1024), nullable=True)  # raw upload on disk until the job finishes
+    status = Column(String(20), nullable=False, default="queued", index=True)  # queued, parsing, indexing, done, failed
+    error = Column(Text, nullable=True)
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="SET NULL"), nullable=True)
+    documents_added = Column(Integer, nullable=True)  # 1 for a single file; the import count for an archive
+    stats = Column(Text, nullable=True)  # JSON: parse statistics, e.g. PDF page counts and slowest pages
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "error": self.error,
+            "document_id": self.document_id,
+            "documents_added": self.documents_added,
+            "stats": json.loads(self.stats) if self.stats else None,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
         }
@@ -1,5 +1,8 @@
 """Department persona definitions with system prompts for the LLM."""
 
+import hashlib
+import json
+
 PERSONAS = {
     "Engineering": {
         "name": "Engineering",
@@ -518,6 +521,18 @@ def get_dashboard_prompt(department: str) -> str | None:
     return None
 
 
+def get_dashboard_version(department: str) -> str | None:
+    """Fingerprint of a department's dashboard prompt and chart specs.
+
+    Cached dashboards built from a different prompt or spec are regenerated.
+    """
+    prompt = get_dashboard_prompt(department)
+    if prompt is None:
+        return None
+    payload = json.dumps({"prompt": prompt, "charts": get_chart_specs(department)}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
 def get_persona(department: str) -> dict | None:
     """Get a persona by department name (case-insensitive)."""
     for key, persona in PERSONAS.items():